@@ -1,5 +1,5 @@
-from sqlalchemy import Column, Integer, String, DateTime, Text, Float, ForeignKey, Boolean, Numeric
-from sqlalchemy.orm import relationship
+from sqlalchemy import Column, Integer, String, DateTime, Text, Float, ForeignKey, Boolean, Numeric, LargeBinary
+from sqlalchemy.orm import relationship, deferred
 from sqlalchemy.sql import func
 from sqlalchemy.dialects.postgresql import UUID, JSONB
 import uuid
@@ -26,8 +26,11 @@ class Document(Base):
     filename = Column(String, nullable=False)
     file_path = Column(String, nullable=False)
     status = Column(String, nullable=False, default="uploaded")
-    upload_time = Column(DateTime(timezone=True), server_default=func.now())
-    user_id = Column(Integer, ForeignKey("users.id"))
+    content_hash = Column(String(64), index=True)  # sha256 of the uploaded file
+    upload_time = Column(DateTime(timezone=True), server_default=func.now(), index=True)
+    user_id = Column(Integer, ForeignKey("users.id"), index=True)
+    court = Column(String, index=True)
+    decision_year = Column(Integer, index=True)
     created_at = Column(DateTime(timezone=True), server_default=func.now())
     
     owner = relationship("User", back_populates="documents")
@@ -41,11 +44,38 @@ class DocumentChunk(Base):
     doc_id = Column(UUID(as_uuid=True), ForeignKey("documents.id"), nullable=False)
     chunk_index = Column(Integer, nullable=False)
     content = Column(Text, nullable=False)
-    embedding = Column(JSONB)  # Store embedding vectors as JSON
+    # Vectors are read by the resident index column by column; entity loads skip them
+    embedding = deferred(Column(JSONB))  # Legacy JSON vectors; superseded by embedding_bin
+    embedding_bin = deferred(Column(LargeBinary))  # Normalised vector bytes, see app.utils.vector_codec
+    embedding_dtype = Column(String(8))  # "float32", "float16" or "int8"
+    context_tokens = Column(Integer)  # Tokens of the snippet prompts carry, counted at parse time; see app.utils.tokenizer
     created_at = Column(DateTime(timezone=True), server_default=func.now())
     
     document = relationship("Document", back_populates="chunks")
 
+class StoredEmbedding(Base):
+    __tablename__ = "embedding_store"
+    
+    content_hash = Column(String(64), primary_key=True)  # sha256 of model + chunk text
+    model = Column(String, nullable=False)
+    embedding_bin = Column(LargeBinary, nullable=False)  # Normalised vector bytes, see app.utils.vector_codec
+    embedding_dtype = Column(String(8), nullable=False)
+    created_at = Column(DateTime(timezone=True), server_default=func.now())
+
+class CorpusVersion(Base):
+    __tablename__ = "corpus_version"
+    
+    id = Column(Integer, primary_key=True)
+    version = Column(Integer, nullable=False, default=0)  # Bumped whenever chunks are added or removed
+    updated_at = Column(DateTime(timezone=True), server_default=func.now(), onupdate=func.now())
+
+class CorpusChange(Base):
+    __tablename__ = "corpus_changes"
+    
+    version = Column(Integer, primary_key=True)  # Corpus version this change produced
+    doc_id = Column(UUID(as_uuid=True), nullable=False)  # Document whose chunks were replaced or removed
+    created_at = Column(DateTime(timezone=True), server_default=func.now())
+
 class QueryLog(Base):
     __tablename__ = "query_logs"
     
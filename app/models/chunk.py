@@ -8,8 +8,7 @@ class ChunkResponse(BaseModel):
     content: str
     embedding_length: int
 
-class ParseResult(BaseModel):
+class ParseJob(BaseModel):
+    job_id: str
     doc_id: UUID
-    chunks_indexed: int
-    total_chunks: int
     status: str
\ No newline at end of file
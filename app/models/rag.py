@@ -1,19 +1,27 @@
 from pydantic import BaseModel, Field
-from typing import List, Optional
+from typing import List, Literal, Optional
 from uuid import UUID
 from decimal import Decimal
 
+from app.models.search import SearchFilters
+
 class RetrievalItem(BaseModel):
     doc_id: UUID
     chunk_index: int
     score: float
     snippet: str
+    # Stored count for the snippet; None for chunks parsed before counts were kept
+    context_tokens: Optional[int] = None
 
 class AnswerRequest(BaseModel):
     query: str = Field(..., min_length=1, max_length=1000)
     k: int = Field(default=5, ge=1, le=20)
     max_context_tokens: int = Field(default=2000, ge=100, le=8000)
     model: Optional[str] = Field(default=None, max_length=50)
+    nprobe: Optional[int] = Field(default=None, ge=1, le=4096)
+    ef_search: Optional[int] = Field(default=None, ge=1, le=4096)
+    retrieval_mode: Optional[Literal["vector", "hybrid", "prefilter"]] = None
+    filters: Optional[SearchFilters] = None
 
 class Citation(BaseModel):
     doc_id: UUID
@@ -30,4 +38,27 @@ class AnswerResponse(BaseModel):
     tokens_out: int
     cost_usd: Decimal
     latency_ms: float
-    cached: bool
\ No newline at end of file
+    cached: bool
+    # Some index shards missed the search, so citations may be incomplete
+    partial: bool = False
+
+# Upper bound on questions accepted by one batch request
+MAX_BATCH_QUERIES = 50
+
+class BatchAnswerRequest(BaseModel):
+    queries: List[str] = Field(..., min_length=1, max_length=MAX_BATCH_QUERIES)
+    k: int = Field(default=5, ge=1, le=20)
+    max_context_tokens: int = Field(default=2000, ge=100, le=8000)
+    model: Optional[str] = Field(default=None, max_length=50)
+    nprobe: Optional[int] = Field(default=None, ge=1, le=4096)
+    ef_search: Optional[int] = Field(default=None, ge=1, le=4096)
+    retrieval_mode: Optional[Literal["vector", "hybrid", "prefilter"]] = None
+    filters: Optional[SearchFilters] = None
+
+class BatchAnswerItem(BaseModel):
+    query: str
+    response: Optional[AnswerResponse] = None
+    error: Optional[str] = None
+
+class BatchAnswerResponse(BaseModel):
+    results: List[BatchAnswerItem]
@@ -1,9 +1,23 @@
-from pydantic import BaseModel
-from typing import List
+from pydantic import BaseModel, ConfigDict, Field
+from typing import List, Optional
+from uuid import UUID
+from datetime import datetime
+
+class SearchFilters(BaseModel):
+    """Document metadata a search is restricted to; every given field must match"""
+    model_config = ConfigDict(extra="forbid")
+    
+    doc_ids: Optional[List[UUID]] = Field(default=None, max_length=10000)
+    owner_id: Optional[int] = None
+    court: Optional[str] = Field(default=None, max_length=200)
+    year_from: Optional[int] = None
+    year_to: Optional[int] = None
+    uploaded_after: Optional[datetime] = None
+    uploaded_before: Optional[datetime] = None
 
 class SearchQuery(BaseModel):
     query: str
-    filters: dict = {}
+    filters: SearchFilters = SearchFilters()
 
 class PrecedentResult(BaseModel):
     id: str
@@ -16,4 +30,23 @@ class PrecedentResult(BaseModel):
 class SearchResponse(BaseModel):
     query: str
     results: List[PrecedentResult]
-    total_count: int
\ No newline at end of file
+    total_count: int
+    # Some index shards missed the search, so results may be incomplete
+    partial: bool = False
+
+# Upper bound on queries accepted by one batch request
+MAX_BATCH_QUERIES = 50
+
+class BatchSearchQuery(BaseModel):
+    queries: List[str] = Field(..., min_length=1, max_length=MAX_BATCH_QUERIES)
+    filters: SearchFilters = SearchFilters()
+
+class BatchSearchResult(BaseModel):
+    query: str
+    results: List[PrecedentResult] = []
+    total_count: int = 0
+    partial: bool = False
+    error: Optional[str] = None
+
+class BatchSearchResponse(BaseModel):
+    results: List[BatchSearchResult]
@@ -1,9 +1,11 @@
 from pydantic import BaseModel
 from enum import Enum
+from typing import Optional
 from uuid import UUID
 
 class DocumentStatus(str, Enum):
     UPLOADED = "uploaded"
+    QUEUED = "queued"
     PROCESSING = "processing"
     COMPLETED = "completed"
     FAILED = "failed"
@@ -11,8 +13,14 @@ class DocumentStatus(str, Enum):
 class DocumentUploadResponse(BaseModel):
     id: UUID
     status: DocumentStatus
+    content_hash: Optional[str] = None
 
 class DocumentStatusResponse(BaseModel):
     document_id: UUID
     status: DocumentStatus
-    progress: int
\ No newline at end of file
+    progress: int
+    job_id: Optional[str] = None
+    stage: Optional[str] = None
+    pages_done: Optional[int] = None
+    pages_total: Optional[int] = None
+    error: Optional[str] = None
\ No newline at end of file
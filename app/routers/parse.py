@@ -1,27 +1,71 @@
 import uuid
-from pathlib import Path
-from fastapi import APIRouter, HTTPException, Depends, Path as FastAPIPath
+from fastapi import APIRouter, HTTPException, Depends, Query, Path as FastAPIPath
 from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
+from sqlalchemy import case, func
 from sqlalchemy.orm import Session
 
-from app.models.chunk import ParseResult
+from app.models.chunk import ParseJob
 from app.db.database import get_db
 from app.db.models import Document, DocumentChunk
-from app.utils.parser import extract_chunks_from_pdf
-from app.utils.embedding import embed_chunks
+from app.utils.vector_codec import dimension_from_size
+from app.utils.corpus import record_corpus_change
+from app.utils.ingest import (
+    INGEST_IN_PROCESS_WORKERS, IngestError, check_parseable, ingest_queue, sync_vector_index
+)
 import logging
 
 logger = logging.getLogger(__name__)
 router = APIRouter()
 security = HTTPBearer()
 
-@router.post("/{doc_id}", response_model=ParseResult)
-async def parse_document(
+# Plain def: FastAPI runs these in its threadpool, so DB and queue calls never block the event loop
+@router.post("/{doc_id}", response_model=ParseJob, status_code=202)
+def parse_document(
     doc_id: str = FastAPIPath(..., description="Document UUID to parse"),
+    force: bool = Query(False, description="Re-parse a document that already has chunks"),
     credentials: HTTPAuthorizationCredentials = Depends(security),
     db: Session = Depends(get_db)
 ):
-    """Parse uploaded PDF document into chunks and generate embeddings"""
+    """Queue an uploaded PDF for chunking and embedding; poll /api/upload/{doc_id}/status for progress"""
+    
+    # Validate UUID format
+    try:
+        document_uuid = uuid.UUID(doc_id)
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Invalid document ID format")
+    
+    # Reject what the worker would reject before queueing it
+    try:
+        document, _ = check_parseable(db, document_uuid, force)
+    except IngestError as e:
+        raise HTTPException(status_code=e.status_code, detail=e.detail)
+    
+    try:
+        job = ingest_queue.latest(document_uuid)
+        if job is not None and ingest_queue.is_active(job):
+            raise HTTPException(status_code=409, detail="Document is already being parsed")
+        job = ingest_queue.enqueue(document_uuid, force=force)
+        document.status = "processing"
+        db.commit()
+    except HTTPException:
+        raise
+    except Exception as e:
+        db.rollback()
+        logger.error(f"Error queueing document {doc_id} for parsing: {str(e)}")
+        raise HTTPException(status_code=503, detail=f"Parse queue unavailable: {str(e)}")
+    
+    if INGEST_IN_PROCESS_WORKERS:
+        ingest_queue.start_workers()
+    
+    return ParseJob(job_id=job["job_id"], doc_id=document_uuid, status=job["status"])
+
+@router.delete("/{doc_id}")
+def delete_document_chunks(
+    doc_id: str = FastAPIPath(..., description="Document UUID to remove chunks for"),
+    credentials: HTTPAuthorizationCredentials = Depends(security),
+    db: Session = Depends(get_db)
+):
+    """Remove a document's chunks and embeddings so it can be re-parsed"""
     
     # Validate UUID format
     try:
@@ -29,72 +73,30 @@ async def parse_document(
     except ValueError:
         raise HTTPException(status_code=400, detail="Invalid document ID format")
     
-    # Get document from database
     document = db.query(Document).filter(Document.id == document_uuid).first()
     if not document:
         raise HTTPException(status_code=404, detail="Document not found")
     
-    # Check if document file exists
-    file_path = Path(document.file_path)
-    if not file_path.exists():
-        raise HTTPException(status_code=404, detail="Document file not found on disk")
-    
-    # Check if document is already parsed
-    existing_chunks = db.query(DocumentChunk).filter(DocumentChunk.doc_id == document_uuid).count()
-    if existing_chunks > 0:
-        raise HTTPException(status_code=409, detail="Document already parsed")
-    
     try:
-        # Extract chunks from PDF
-        chunks = extract_chunks_from_pdf(str(file_path))
-        if not chunks:
-            raise HTTPException(status_code=422, detail="No text content extracted from PDF")
-        
-        # Generate embeddings for chunks
-        embeddings = embed_chunks(chunks)
-        if len(embeddings) != len(chunks):
-            raise HTTPException(status_code=500, detail="Embedding generation failed")
-        
-        # Store chunks and embeddings in database
-        chunk_objects = []
-        for i, (chunk_content, embedding) in enumerate(zip(chunks, embeddings)):
-            chunk_obj = DocumentChunk(
-                doc_id=document_uuid,
-                chunk_index=i,
-                content=chunk_content,
-                embedding=embedding
-            )
-            chunk_objects.append(chunk_obj)
-        
-        # Bulk insert chunks
-        db.add_all(chunk_objects)
-        
-        # Update document status
-        document.status = "parsed"
-        
-        # Commit transaction
+        deleted = db.query(DocumentChunk).filter(
+            DocumentChunk.doc_id == document_uuid
+        ).delete(synchronize_session=False)
+        document.status = "uploaded"
+        corpus_version = record_corpus_change(db, document_uuid)
         db.commit()
-        
-        logger.info(f"Successfully parsed document {doc_id} into {len(chunks)} chunks")
-        
-        return ParseResult(
-            doc_id=document_uuid,
-            chunks_indexed=len(chunks),
-            total_chunks=len(chunks),
-            status="completed"
-        )
-        
-    except HTTPException:
-        # Re-raise HTTP exceptions
-        raise
     except Exception as e:
-        # Rollback on error
         db.rollback()
-        logger.error(f"Error parsing document {doc_id}: {str(e)}")
-        raise HTTPException(status_code=500, detail=f"Document parsing failed: {str(e)}")
+        logger.error(f"Error deleting chunks for document {doc_id}: {str(e)}")
+        raise HTTPException(status_code=500, detail=f"Chunk deletion failed: {str(e)}")
+    
+    # Tombstone vectors; compaction runs in the background once enough pile up
+    sync_vector_index(document_uuid, corpus_version, replaced=True, owner_id=document.user_id)
+    
+    logger.info(f"Deleted {deleted} chunks for document {doc_id}")
+    return {"doc_id": doc_id, "chunks_deleted": deleted}
 
 @router.get("/{doc_id}/chunks")
-async def get_document_chunks(
+def get_document_chunks(
     doc_id: str = FastAPIPath(..., description="Document UUID to retrieve chunks for"),
     credentials: HTTPAuthorizationCredentials = Depends(security),
     db: Session = Depends(get_db)
@@ -108,7 +110,18 @@ async def get_document_chunks(
         raise HTTPException(status_code=400, detail="Invalid document ID format")
     
     # Get document chunks
-    chunks = db.query(DocumentChunk).filter(
+    # Vector sizes are measured in the database instead of shipping the vectors
+    chunks = db.query(
+        DocumentChunk.id,
+        DocumentChunk.chunk_index,
+        DocumentChunk.content,
+        DocumentChunk.embedding_dtype,
+        func.length(DocumentChunk.embedding_bin).label("embedding_bytes"),
+        case((
+            func.jsonb_typeof(DocumentChunk.embedding) == "array",
+            func.jsonb_array_length(DocumentChunk.embedding)
+        )).label("embedding_json_length")
+    ).filter(
         DocumentChunk.doc_id == document_uuid
     ).order_by(DocumentChunk.chunk_index).all()
     
@@ -123,7 +136,11 @@ async def get_document_chunks(
                 "id": str(chunk.id),
                 "chunk_index": chunk.chunk_index,
                 "content": chunk.content,
-                "embedding_length": len(chunk.embedding) if chunk.embedding else 0
+                "embedding_length": (
+                    dimension_from_size(chunk.embedding_bytes, chunk.embedding_dtype or "float32")
+                    or chunk.embedding_json_length
+                    or 0
+                )
             }
             for chunk in chunks
         ],
@@ -1,20 +1,40 @@
+import asyncio
 import hashlib
 import json
+import os
 import redis
-from typing import List
+import redis.asyncio
+from typing import List, Optional, Tuple
 from fastapi import APIRouter, HTTPException, Depends
+from fastapi.concurrency import run_in_threadpool
+from fastapi.responses import StreamingResponse
 from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
 from sqlalchemy.orm import Session
 from decimal import Decimal
 import logging
 
-from app.models.rag import AnswerRequest, AnswerResponse, Citation, RetrievalItem
-from app.db.database import get_db
+from app.models.rag import (
+    AnswerRequest,
+    AnswerResponse,
+    Citation,
+    RetrievalItem,
+    BatchAnswerRequest,
+    BatchAnswerItem,
+    BatchAnswerResponse,
+)
+from app.models.search import SearchFilters
+from app.db.database import get_db, SessionLocal
 from app.db.models import QueryLog, User
-from app.utils.retrieval import retrieve_topk, trim_context_to_token_budget
+from app.utils.retrieval import retrieval_cache_stats, retrieve_topk, retrieve_topk_async, retrieve_topk_batch, trim_context_to_token_budget
 from app.utils.prompting import build_prompt
-from app.utils.llm import chat_complete
-from app.utils.embedding import generate_embedding
+from app.utils.llm import chat_complete, chat_complete_async, chat_stream_async
+from app.utils.embedding import generate_embedding, embed_queries_async, embedding_cache_stats
+from app.utils.semantic_cache import SEMANTIC_CACHE_ENABLED, SemanticCache, scope_id
+from app.utils.corpus import get_corpus_version
+from app.utils.metadata_filter import filters_key
+from app.utils.singleflight import SingleFlight
+from app.utils.shards import is_partial
+from app.utils.tenant_index import tenant_index_stats
 
 logger = logging.getLogger(__name__)
 router = APIRouter()
@@ -22,8 +42,21 @@ security = HTTPBearer()
 
 # Redis configuration
 redis_client = redis.Redis(host='localhost', port=6379, db=0, decode_responses=True)
+async_redis_client = redis.asyncio.Redis(host='localhost', port=6379, db=0, decode_responses=True)
 CACHE_TTL = 600  # 10 minutes
 
+# Paraphrase lookups over cached answers; embeddings are stored as raw bytes
+semantic_cache = SemanticCache(redis.asyncio.Redis(host='localhost', port=6379, db=0), ttl=CACHE_TTL)
+
+# Concurrent misses for the same cache key share one retrieval and LLM call
+answer_flight = SingleFlight(async_redis_client)
+
+# Keep proxies from buffering the event stream
+SSE_HEADERS = {"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+
+# LLM completions allowed in flight per batch request
+BATCH_LLM_CONCURRENCY = int(os.getenv("BATCH_LLM_CONCURRENCY", "4"))
+
 def get_user_from_token(credentials: HTTPAuthorizationCredentials, db: Session) -> User:
     """Extract user from JWT token"""
     # TODO: Implement proper JWT validation
@@ -33,20 +66,40 @@ def get_user_from_token(credentials: HTTPAuthorizationCredentials, db: Session)
         raise HTTPException(status_code=401, detail="Invalid authentication")
     return user
 
-def generate_cache_key(user_id: int, query: str, k: int, model: str) -> str:
+def generate_cache_key(user_id: int, query: str, k: int, model: str, filters: Optional[SearchFilters] = None) -> str:
     """Generate cache key from request parameters"""
     cache_data = f"{user_id}:{query}:{k}:{model or 'default'}"
+    restriction = filters_key(filters)
+    if restriction:
+        cache_data += f":{restriction}"
     return hashlib.sha256(cache_data.encode()).hexdigest()
 
+def _load_cached_response(cached_data: Optional[str]) -> Optional[AnswerResponse]:
+    if not cached_data:
+        return None
+    cached_dict = json.loads(cached_data)
+    # Convert cost back to Decimal
+    cached_dict['cost_usd'] = Decimal(str(cached_dict['cost_usd']))
+    return AnswerResponse(**cached_dict)
+
+def _dump_response(response: AnswerResponse) -> str:
+    # Convert Decimal to string for JSON serialization; citation UUIDs become strings too
+    response_dict = response.dict()
+    response_dict['cost_usd'] = str(response_dict['cost_usd'])
+    return json.dumps(response_dict, default=str)
+
 def get_cached_response(cache_key: str) -> AnswerResponse:
     """Retrieve cached response from Redis"""
     try:
-        cached_data = redis_client.get(cache_key)
-        if cached_data:
-            cached_dict = json.loads(cached_data)
-            # Convert cost back to Decimal
-            cached_dict['cost_usd'] = Decimal(str(cached_dict['cost_usd']))
-            return AnswerResponse(**cached_dict)
+        return _load_cached_response(redis_client.get(cache_key))
+    except Exception as e:
+        logger.warning(f"Error retrieving cached response: {str(e)}")
+    return None
+
+async def get_cached_response_async(cache_key: str) -> Optional[AnswerResponse]:
+    """Retrieve cached response from Redis without blocking the event loop"""
+    try:
+        return _load_cached_response(await async_redis_client.get(cache_key))
     except Exception as e:
         logger.warning(f"Error retrieving cached response: {str(e)}")
     return None
@@ -54,14 +107,78 @@ def get_cached_response(cache_key: str) -> AnswerResponse:
 def cache_response(cache_key: str, response: AnswerResponse):
     """Cache response in Redis"""
     try:
-        # Convert Decimal to string for JSON serialization
-        response_dict = response.dict()
-        response_dict['cost_usd'] = str(response_dict['cost_usd'])
-        redis_client.setex(cache_key, CACHE_TTL, json.dumps(response_dict))
+        redis_client.setex(cache_key, CACHE_TTL, _dump_response(response))
+        logger.info(f"Cached response with key: {cache_key[:16]}...")
+    except Exception as e:
+        logger.warning(f"Error caching response: {str(e)}")
+
+async def cache_response_async(cache_key: str, response: AnswerResponse):
+    """Cache response in Redis without blocking the event loop"""
+    try:
+        await async_redis_client.setex(cache_key, CACHE_TTL, _dump_response(response))
         logger.info(f"Cached response with key: {cache_key[:16]}...")
     except Exception as e:
         logger.warning(f"Error caching response: {str(e)}")
 
+def answer_scope(user_id: int, k: int, model: str, filters: Optional[SearchFilters] = None) -> int:
+    """Parameters besides the question that an answer depends on, as in generate_cache_key"""
+    return scope_id(user_id, k, model or 'default', filters_key(filters))
+
+async def find_cached_answer(
+    cache_key: str,
+    scope: int,
+    query: str,
+    db: Session
+) -> Tuple[Optional[AnswerResponse], Optional[List[float]], Optional[int]]:
+    """Look for an exact cache hit while embedding the query, then for a paraphrase.
+
+    Returns (cached response or None, query embedding or None, corpus version).
+    Retrieval only runs on a miss, reusing the embedding; if embedding failed
+    it is retried there. The corpus version is read from the database so a
+    paraphrase never matches an answer generated before the corpus changed.
+    """
+    exact, query_embeddings, corpus_version = await asyncio.gather(
+        get_cached_response_async(cache_key),
+        embed_queries_async([query]),
+        run_in_threadpool(get_corpus_version, db),
+        return_exceptions=True
+    )
+    if isinstance(exact, AnswerResponse):
+        await semantic_cache.record("exact_hits")
+        return exact, None, None
+    if isinstance(corpus_version, BaseException):
+        logger.warning(f"Error reading corpus version: {str(corpus_version)}")
+        corpus_version = None
+    if isinstance(query_embeddings, BaseException) or not query_embeddings:
+        logger.warning(f"Query embedding failed during cache lookup: {str(query_embeddings)}")
+        await semantic_cache.record("misses")
+        return None, None, corpus_version
+    
+    query_embedding = query_embeddings[0]
+    if SEMANTIC_CACHE_ENABLED and corpus_version is not None:
+        similar_key = await semantic_cache.lookup(query_embedding, scope, corpus_version)
+        if similar_key and similar_key != cache_key:
+            similar_response = await get_cached_response_async(similar_key)
+            if similar_response:
+                await semantic_cache.record("semantic_hits")
+                logger.info(f"Semantic cache hit for query: {query[:50]}...")
+                return similar_response, query_embedding, corpus_version
+    
+    await semantic_cache.record("misses")
+    return None, query_embedding, corpus_version
+
+async def remember_answer(
+    cache_key: str,
+    response: AnswerResponse,
+    scope: int,
+    query_embedding: Optional[List[float]],
+    corpus_version: Optional[int]
+):
+    """Cache an answer under its exact key and index its query for paraphrase lookups"""
+    await cache_response_async(cache_key, response)
+    if SEMANTIC_CACHE_ENABLED and query_embedding is not None and corpus_version is not None:
+        await semantic_cache.put(query_embedding, scope, corpus_version, cache_key)
+
 def log_query_metrics(
     user_id: int,
     query: str,
@@ -94,6 +211,111 @@ def log_query_metrics(
         logger.error(f"Error logging query metrics: {str(e)}")
         db.rollback()
 
+def format_sse(event: str, data: dict) -> str:
+    """Encode one Server-Sent Event"""
+    return f"event: {event}\ndata: {json.dumps(data, default=str)}\n\n"
+
+def usage_event(response: AnswerResponse, cached: bool, first_token_ms: Optional[float] = None) -> dict:
+    """Payload of the final streaming event"""
+    return {
+        "provider": response.provider,
+        "model": response.model,
+        "tokens_in": response.tokens_in,
+        "tokens_out": response.tokens_out,
+        "cost_usd": str(response.cost_usd),
+        "latency_ms": response.latency_ms,
+        "first_token_ms": first_token_ms,
+        "cached": cached,
+        "partial": response.partial
+    }
+
+def log_query_metrics_detached(*args):
+    """log_query_metrics on a session of its own, for work that outlives the request's session"""
+    db = SessionLocal()
+    try:
+        log_query_metrics(*args, db)
+    finally:
+        db.close()
+
+def prepare_prompt(
+    query: str,
+    retrieval_items: List[RetrievalItem],
+    max_context_tokens: int,
+    model: str = None
+) -> tuple:
+    """Budget retrieved context and build the prompt; returns (prompt, budgeted items)"""
+    if not retrieval_items:
+        raise HTTPException(status_code=404, detail="No relevant documents found")
+    
+    # Trim context to token budget
+    budgeted_items = trim_context_to_token_budget(
+        retrieval_items, 
+        max_context_tokens, 
+        model or "gpt-4o-mini"
+    )
+    
+    if not budgeted_items:
+        raise HTTPException(status_code=400, detail="Context too large for token budget")
+    
+    # Build prompt
+    return build_prompt(query, budgeted_items), budgeted_items
+
+def build_citations(budgeted_items: List[RetrievalItem]) -> List[Citation]:
+    """Construct citations preserving item order"""
+    citations = []
+    for i, item in enumerate(budgeted_items):
+        citation = Citation(
+            doc_id=item.doc_id,
+            chunk_index=item.chunk_index,
+            snippet=item.snippet,
+            score=item.score
+        )
+        citations.append(citation)
+    return citations
+
+def build_answer(llm_response: dict, budgeted_items: List[RetrievalItem], partial: bool = False) -> AnswerResponse:
+    """Build the answer with citations in context order"""
+    return AnswerResponse(
+        answer=llm_response["text"],
+        citations=build_citations(budgeted_items),
+        provider=llm_response["provider"],
+        model=llm_response["model"],
+        tokens_in=llm_response["tokens_in"],
+        tokens_out=llm_response["tokens_out"],
+        cost_usd=Decimal(str(llm_response["cost_usd"])),
+        latency_ms=llm_response["latency_ms"],
+        cached=False,
+        partial=partial
+    )
+
+def answer_from_items(
+    query: str,
+    retrieval_items: List[RetrievalItem],
+    max_context_tokens: int,
+    model: str = None
+) -> AnswerResponse:
+    """Budget retrieved context, call the LLM and build the answer"""
+    prompt, budgeted_items = prepare_prompt(query, retrieval_items, max_context_tokens, model)
+    
+    # Get LLM response
+    llm_response = chat_complete(prompt, model)
+    
+    return build_answer(llm_response, budgeted_items, is_partial(retrieval_items))
+
+async def answer_from_items_async(
+    query: str,
+    retrieval_items: List[RetrievalItem],
+    max_context_tokens: int,
+    model: str = None
+) -> AnswerResponse:
+    """answer_from_items on the async LLM client"""
+    prompt, budgeted_items = prepare_prompt(query, retrieval_items, max_context_tokens, model)
+    
+    # Get LLM response
+    llm_response = await chat_complete_async(prompt, model)
+    
+    return build_answer(llm_response, budgeted_items, is_partial(retrieval_items))
+
 @router.post("/ask", response_model=AnswerResponse)
 async def ask_legal_question(
     request: AnswerRequest,
@@ -103,69 +325,59 @@ async def ask_legal_question(
     """Ask a legal question using RAG system"""
     
     # Get user from token
-    user = get_user_from_token(credentials, db)
+    user = await run_in_threadpool(get_user_from_token, credentials, db)
     
     # Generate cache key
-    cache_key = generate_cache_key(user.id, request.query, request.k, request.model)
+    cache_key = generate_cache_key(user.id, request.query, request.k, request.model, request.filters)
+    scope = answer_scope(user.id, request.k, request.model, request.filters)
     
-    # Check cache first
-    cached_response = get_cached_response(cache_key)
+    # Check the cache, exact then semantic, while the query is embedded
+    cached_response, query_embedding, corpus_version = await find_cached_answer(
+        cache_key, scope, request.query, db
+    )
     if cached_response:
         cached_response.cached = True
         logger.info(f"Returning cached response for query: {request.query[:50]}...")
         return cached_response
     
-    try:
-        # Retrieve top-k chunks
-        retrieval_items = retrieve_topk(request.query, request.k, db)
-        if not retrieval_items:
-            raise HTTPException(status_code=404, detail="No relevant documents found")
-        
-        # Trim context to token budget
-        budgeted_items = trim_context_to_token_budget(
-            retrieval_items, 
-            request.max_context_tokens, 
-            request.model or "gpt-4o-mini"
+    async def compute_answer() -> AnswerResponse:
+        retrieval_items = await retrieve_topk_async(
+            request.query,
+            request.k,
+            db,
+            nprobe=request.nprobe,
+            ef_search=request.ef_search,
+            query_embedding=query_embedding,
+            mode=request.retrieval_mode,
+            filters=request.filters
         )
-        
-        if not budgeted_items:
-            raise HTTPException(status_code=400, detail="Context too large for token budget")
-        
-        # Build prompt
-        prompt = build_prompt(request.query, budgeted_items)
-        
-        # Get LLM response
-        llm_response = chat_complete(prompt, request.model)
-        
-        # Construct citations preserving item order
-        citations = []
-        for i, item in enumerate(budgeted_items):
-            citation = Citation(
-                doc_id=item.doc_id,
-                chunk_index=item.chunk_index,
-                snippet=item.snippet,
-                score=item.score
-            )
-            citations.append(citation)
-        
-        # Build response
-        response = AnswerResponse(
-            answer=llm_response["text"],
-            citations=citations,
-            provider=llm_response["provider"],
-            model=llm_response["model"],
-            tokens_in=llm_response["tokens_in"],
-            tokens_out=llm_response["tokens_out"],
-            cost_usd=Decimal(str(llm_response["cost_usd"])),
-            latency_ms=llm_response["latency_ms"],
-            cached=False
+        response = await answer_from_items_async(
+            request.query,
+            retrieval_items,
+            request.max_context_tokens,
+            request.model
         )
         
-        # Cache response
-        cache_response(cache_key, response)
+        # Cache before the single-flight lock is released so waiters find it;
+        # answers missing index shards are served but never cached
+        if not response.partial:
+            await remember_answer(cache_key, response, scope, query_embedding, corpus_version)
+        return response
+    
+    try:
+        # Retrieve and answer once per burst of identical questions
+        response, shared = await answer_flight.do(
+            cache_key,
+            compute_answer,
+            lambda: get_cached_response_async(cache_key)
+        )
+        if shared:
+            logger.info(f"Returning coalesced response for query: {request.query[:50]}...")
+            return response.copy(update={"cached": True})
         
         # Log metrics
-        log_query_metrics(
+        await run_in_threadpool(
+            log_query_metrics,
             user.id,
             request.query,
             response.provider,
@@ -178,7 +390,7 @@ async def ask_legal_question(
             db
         )
         
-        logger.info(f"Generated RAG response for query: {request.query[:50]}... with {len(citations)} citations")
+        logger.info(f"Generated RAG response for query: {request.query[:50]}... with {len(response.citations)} citations")
         return response
         
     except HTTPException:
@@ -186,4 +398,208 @@ async def ask_legal_question(
         raise
     except Exception as e:
         logger.error(f"Error in RAG inference: {str(e)}")
-        raise HTTPException(status_code=500, detail=f"RAG inference failed: {str(e)}")
\ No newline at end of file
+        raise HTTPException(status_code=500, detail=f"RAG inference failed: {str(e)}")
+
+@router.post("/ask/stream")
+async def ask_legal_question_stream(
+    request: AnswerRequest,
+    credentials: HTTPAuthorizationCredentials = Depends(security),
+    db: Session = Depends(get_db)
+):
+    """Ask a legal question and stream the answer as Server-Sent Events.
+
+    Emits a citations event, token events as the LLM produces them, then a done
+    event with usage, cost and latency. Failures after streaming has started
+    arrive as an error event.
+    """
+    
+    # Get user from token
+    user = await run_in_threadpool(get_user_from_token, credentials, db)
+    
+    cache_key = generate_cache_key(user.id, request.query, request.k, request.model, request.filters)
+    scope = answer_scope(user.id, request.k, request.model, request.filters)
+    cached_response, query_embedding, corpus_version = await find_cached_answer(
+        cache_key, scope, request.query, db
+    )
+    
+    if cached_response:
+        async def replay_cached():
+            yield format_sse("citations", {"citations": [c.dict() for c in cached_response.citations]})
+            yield format_sse("token", {"text": cached_response.answer})
+            yield format_sse("done", usage_event(cached_response, cached=True))
+        logger.info(f"Streaming cached response for query: {request.query[:50]}...")
+        return StreamingResponse(replay_cached(), media_type="text/event-stream", headers=SSE_HEADERS)
+    
+    retrieval_items = await retrieve_topk_async(
+        request.query,
+        request.k,
+        db,
+        nprobe=request.nprobe,
+        ef_search=request.ef_search,
+        query_embedding=query_embedding,
+        mode=request.retrieval_mode,
+        filters=request.filters
+    )
+    
+    # Budget and prompt errors still surface as plain HTTP errors
+    prompt, budgeted_items = prepare_prompt(
+        request.query,
+        retrieval_items,
+        request.max_context_tokens,
+        request.model
+    )
+    citations = build_citations(budgeted_items)
+    
+    async def stream_answer():
+        yield format_sse("citations", {"citations": [c.dict() for c in citations]})
+        
+        final = None
+        try:
+            async for event in chat_stream_async(prompt, request.model):
+                if event["type"] == "token":
+                    yield format_sse("token", {"text": event["text"]})
+                else:
+                    final = event
+        except HTTPException as e:
+            yield format_sse("error", {"detail": e.detail})
+            return
+        except Exception as e:
+            logger.error(f"Error streaming RAG answer: {str(e)}")
+            yield format_sse("error", {"detail": f"RAG inference failed: {str(e)}"})
+            return
+        
+        response = build_answer(final, budgeted_items, is_partial(retrieval_items))
+        
+        # Persist before announcing completion: clients hang up on "done", which
+        # cancels this generator, so shield the writes from that cancellation
+        async def persist():
+            if not response.partial:
+                await remember_answer(cache_key, response, scope, query_embedding, corpus_version)
+            await run_in_threadpool(
+                log_query_metrics_detached,
+                user.id,
+                request.query,
+                response.provider,
+                response.model,
+                response.tokens_in,
+                response.tokens_out,
+                response.cost_usd,
+                response.latency_ms,
+                False
+            )
+        await asyncio.shield(asyncio.ensure_future(persist()))
+        
+        yield format_sse("done", usage_event(response, cached=False, first_token_ms=final["first_token_ms"]))
+        logger.info(f"Streamed RAG response for query: {request.query[:50]}... with {len(citations)} citations")
+    
+    return StreamingResponse(stream_answer(), media_type="text/event-stream", headers=SSE_HEADERS)
+
+@router.post("/ask/batch", response_model=BatchAnswerResponse)
+async def ask_legal_questions_batch(
+    request: BatchAnswerRequest,
+    credentials: HTTPAuthorizationCredentials = Depends(security),
+    db: Session = Depends(get_db)
+):
+    """Answer several legal questions with shared retrieval and bounded LLM concurrency"""
+    
+    # Get user from token
+    user = await run_in_threadpool(get_user_from_token, credentials, db)
+    
+    results = [BatchAnswerItem(query=query) for query in request.queries]
+    
+    # Validate each question, then answer what we can from the cache
+    valid = []
+    for i, query in enumerate(request.queries):
+        if not query.strip() or len(query) > 1000:
+            results[i].error = "Query must be between 1 and 1000 characters"
+        else:
+            valid.append(i)
+    
+    cached_responses = await asyncio.gather(*(
+        get_cached_response_async(generate_cache_key(user.id, request.queries[i], request.k, request.model, request.filters))
+        for i in valid
+    ))
+    pending = []
+    for i, cached_response in zip(valid, cached_responses):
+        if cached_response:
+            cached_response.cached = True
+            results[i].response = cached_response
+        else:
+            pending.append(i)
+    
+    if not pending:
+        return BatchAnswerResponse(results=results)
+    
+    # One embeddings call and one index pass for every uncached question
+    try:
+        retrieved = await run_in_threadpool(
+            retrieve_topk_batch,
+            [request.queries[i] for i in pending],
+            request.k,
+            db,
+            nprobe=request.nprobe,
+            ef_search=request.ef_search,
+            mode=request.retrieval_mode,
+            filters=request.filters
+        )
+    except Exception as e:
+        logger.error(f"Error in batch retrieval: {str(e)}")
+        raise HTTPException(status_code=500, detail=f"Batch retrieval failed: {str(e)}")
+    
+    semaphore = asyncio.Semaphore(BATCH_LLM_CONCURRENCY)
+    
+    async def answer(i: int, retrieval_items: List[RetrievalItem]):
+        async with semaphore:
+            try:
+                results[i].response = await answer_from_items_async(
+                    request.queries[i],
+                    retrieval_items,
+                    request.max_context_tokens,
+                    request.model
+                )
+            except HTTPException as e:
+                results[i].error = e.detail
+            except Exception as e:
+                logger.error(f"Error answering batch query {i}: {str(e)}")
+                results[i].error = f"RAG inference failed: {str(e)}"
+    
+    await asyncio.gather(*(answer(i, items) for i, items in zip(pending, retrieved)))
+    
+    # Cache and log sequentially; the session is not safe for concurrent use
+    for i in pending:
+        response = results[i].response
+        if response is None:
+            continue
+        if not response.partial:
+            await cache_response_async(generate_cache_key(user.id, request.queries[i], request.k, request.model, request.filters), response)
+        await run_in_threadpool(
+            log_query_metrics,
+            user.id,
+            request.queries[i],
+            response.provider,
+            response.model,
+            response.tokens_in,
+            response.tokens_out,
+            response.cost_usd,
+            response.latency_ms,
+            False,
+            db
+        )
+    
+    answered = sum(1 for item in results if item.response is not None)
+    logger.info(f"Answered {answered}/{len(results)} batch queries")
+    return BatchAnswerResponse(results=results)
+
+@router.get("/cache/stats")
+async def get_cache_stats(
+    credentials: HTTPAuthorizationCredentials = Depends(security),
+    db: Session = Depends(get_db)
+):
+    """Hit rates of the answer cache across workers and of this worker's query embedding, retrieval and tenant index caches"""
+    await run_in_threadpool(get_user_from_token, credentials, db)
+    return {
+        "answers": await semantic_cache.hit_rates(),
+        "query_embeddings": embedding_cache_stats(),
+        "retrieval": retrieval_cache_stats(),
+        "tenant_indexes": tenant_index_stats()
+    }
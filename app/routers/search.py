@@ -1,16 +1,105 @@
+import uuid
 from fastapi import APIRouter, Depends, Query, HTTPException
+from fastapi.concurrency import run_in_threadpool
 from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
 from sqlalchemy.orm import Session
-from typing import List
+from typing import List, Optional, Tuple
 
-from app.models.search import SearchQuery, SearchResponse, PrecedentResult
+from app.models.search import (
+    SearchFilters,
+    SearchQuery,
+    SearchResponse,
+    PrecedentResult,
+    BatchSearchQuery,
+    BatchSearchResult,
+    BatchSearchResponse,
+)
 from app.db.database import get_db
 from app.db.models import Document, DocumentChunk
-from app.utils.embedding import generate_embedding, cosine_similarity
+from app.utils.embedding import generate_embedding_async, embed_queries_async
+from app.utils.shards import Partial, is_partial
+from app.utils.metadata_filter import filter_document_ids
+from app.utils.retrieval import search_target
 
 router = APIRouter()
 security = HTTPBearer()
 
+# Number of precedents returned per search
+SEARCH_RESULT_LIMIT = 10
+
+def fetch_precedent_results(hits: List[Tuple[uuid.UUID, float]], db: Session) -> List[PrecedentResult]:
+    """Load the winning chunks and their documents in one query and build results in rank order"""
+    return fetch_precedent_results_batch([hits], db)[0]
+
+def fetch_precedent_results_batch(
+    hits_per_query: List[List[Tuple[uuid.UUID, float]]],
+    db: Session
+) -> List[List[PrecedentResult]]:
+    """Load the winners of several queries with one joined query; partial rankings stay Partial"""
+    winner_ids = {chunk_id for hits in hits_per_query for chunk_id, _ in hits}
+    if not winner_ids:
+        return [Partial() if is_partial(hits) else [] for hits in hits_per_query]
+    
+    rows = db.query(
+        DocumentChunk.id,
+        DocumentChunk.doc_id,
+        DocumentChunk.content,
+        Document.filename,
+        Document.court,
+        Document.decision_year
+    ).outerjoin(
+        Document, Document.id == DocumentChunk.doc_id
+    ).filter(
+        DocumentChunk.id.in_(list(winner_ids))
+    ).all()
+    rows_by_id = {row.id: row for row in rows}
+    
+    results_per_query = []
+    for hits in hits_per_query:
+        results = []
+        for chunk_id, similarity in hits:
+            row = rows_by_id.get(chunk_id)
+            if row is None:
+                continue
+            results.append(PrecedentResult(
+                id=str(row.id),
+                title=row.filename or f"Document {row.doc_id}",
+                court=row.court or "Unknown Court",
+                year=row.decision_year or 2024,  # Placeholder until documents carry a decision year
+                summary=row.content[:200] + "..." if len(row.content) > 200 else row.content,
+                relevance_score=similarity
+            ))
+        results_per_query.append(Partial(results) if is_partial(hits) else results)
+    return results_per_query
+
+def find_precedents(
+    query_embedding: List[float],
+    db: Session,
+    filters: Optional[SearchFilters] = None
+) -> List[PrecedentResult]:
+    """Score every chunk, or only the filtered documents' chunks, and load the top results"""
+    index = search_target(db, filters)
+    doc_ids = filter_document_ids(db, filters)
+    if doc_ids is None:
+        hits = index.search(query_embedding, SEARCH_RESULT_LIMIT)
+    else:
+        hits = index.search_documents([query_embedding], doc_ids, SEARCH_RESULT_LIMIT)[0]
+    return fetch_precedent_results(hits, db)
+
+def find_precedents_batch(
+    query_embeddings: List[List[float]],
+    db: Session,
+    filters: Optional[SearchFilters] = None
+) -> List[List[PrecedentResult]]:
+    """One matrix-matrix product scores every query against every chunk the filters allow"""
+    index = search_target(db, filters)
+    doc_ids = filter_document_ids(db, filters)
+    if doc_ids is None:
+        hits_per_query = index.search_batch(query_embeddings, SEARCH_RESULT_LIMIT)
+    else:
+        hits_per_query = index.search_documents(query_embeddings, doc_ids, SEARCH_RESULT_LIMIT)
+    return fetch_precedent_results_batch(hits_per_query, db)
+
 @router.post("/precedents", response_model=SearchResponse)
 async def search_legal_precedents(
     query: SearchQuery,
@@ -20,52 +109,56 @@ async def search_legal_precedents(
     """Search for legal precedents using RAG system"""
     try:
         # Generate query embedding
-        query_embedding = generate_embedding(query.query)
-        
-        # Get all chunks with embeddings
-        chunks = db.query(DocumentChunk).filter(
-            DocumentChunk.embedding.isnot(None)
-        ).all()
-        
-        if not chunks:
-            return SearchResponse(
-                query=query.query,
-                results=[],
-                total_count=0
-            )
-        
-        # Calculate similarities and create results
-        results = []
-        for chunk in chunks:
-            if chunk.embedding:
-                similarity = cosine_similarity(query_embedding, chunk.embedding)
-                
-                # Get document info
-                document = db.query(Document).filter(Document.id == chunk.doc_id).first()
-                
-                result = PrecedentResult(
-                    id=str(chunk.id),
-                    title=document.filename if document else f"Document {chunk.doc_id}",
-                    court="Unknown Court",  # Placeholder
-                    year=2024,  # Placeholder
-                    summary=chunk.content[:200] + "..." if len(chunk.content) > 200 else chunk.content,
-                    relevance_score=similarity
-                )
-                results.append(result)
+        query_embedding = await generate_embedding_async(query.query)
         
-        # Sort by relevance and return top results
-        results.sort(key=lambda x: x.relevance_score, reverse=True)
-        top_results = results[:10]  # Limit to top 10
+        # Index search and row fetch block, so keep them off the event loop
+        top_results = await run_in_threadpool(find_precedents, query_embedding, db, query.filters)
         
         return SearchResponse(
             query=query.query,
             results=top_results,
-            total_count=len(top_results)
+            total_count=len(top_results),
+            partial=is_partial(top_results)
         )
         
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Search failed: {str(e)}")
 
+@router.post("/precedents/batch", response_model=BatchSearchResponse)
+async def search_legal_precedents_batch(
+    batch: BatchSearchQuery,
+    credentials: HTTPAuthorizationCredentials = Depends(security),
+    db: Session = Depends(get_db)
+):
+    """Search precedents for several queries with one embeddings call and one index pass"""
+    results = [BatchSearchResult(query=query) for query in batch.queries]
+    valid = []
+    for i, query in enumerate(batch.queries):
+        if query.strip():
+            valid.append(i)
+        else:
+            results[i].error = "Query must be a non-empty string"
+    
+    if not valid:
+        return BatchSearchResponse(results=results)
+    
+    try:
+        query_embeddings = await embed_queries_async([batch.queries[i] for i in valid])
+        if len(query_embeddings) != len(valid):
+            raise RuntimeError("embedding backend returned the wrong number of vectors")
+        
+        precedents_per_query = await run_in_threadpool(find_precedents_batch, query_embeddings, db, batch.filters)
+        
+        for i, precedents in zip(valid, precedents_per_query):
+            results[i].results = precedents
+            results[i].total_count = len(precedents)
+            results[i].partial = is_partial(precedents)
+        
+        return BatchSearchResponse(results=results)
+        
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Batch search failed: {str(e)}")
+
 @router.get("/precedents/suggest")
 async def get_search_suggestions(
     q: str = Query(..., min_length=2),
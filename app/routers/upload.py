@@ -1,13 +1,18 @@
+import hashlib
 import os
+import tempfile
 import uuid
 from pathlib import Path
-from fastapi import APIRouter, UploadFile, File, HTTPException, Depends
-from fastapi.security import HTTPBearer
+from typing import Optional
+from fastapi import APIRouter, UploadFile, File, Form, HTTPException, Depends
+from fastapi.concurrency import run_in_threadpool
+from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
 from sqlalchemy.orm import Session
 
 from app.models.upload import DocumentUploadResponse, DocumentStatusResponse, DocumentStatus
 from app.db.database import get_db
 from app.db.models import Document
+from app.utils.ingest import ingest_queue
 
 router = APIRouter()
 security = HTTPBearer()
@@ -17,14 +22,29 @@ MAX_FILE_SIZE = 20 * 1024 * 1024  # 20MB
 UPLOAD_DIR = Path("uploads")
 ALLOWED_MIME_TYPES = ["application/pdf"]
 ALLOWED_EXTENSIONS = [".pdf"]
+# Uploads are copied to disk this many bytes at a time
+UPLOAD_BLOCK_SIZE = 1024 * 1024
+# Every PDF starts with this signature
+PDF_MAGIC = b"%PDF-"
+# Stored document statuses and ingestion job statuses as reported by the status endpoint
+DOCUMENT_STATUSES = {
+    "uploaded": DocumentStatus.UPLOADED,
+    "processing": DocumentStatus.PROCESSING,
+    "parsed": DocumentStatus.COMPLETED,
+    "failed": DocumentStatus.FAILED
+}
+JOB_STATUSES = {
+    "queued": DocumentStatus.QUEUED,
+    "processing": DocumentStatus.PROCESSING,
+    "completed": DocumentStatus.COMPLETED,
+    "failed": DocumentStatus.FAILED
+}
 
 def validate_pdf_file(file: UploadFile) -> None:
     """Validate PDF file type and size"""
+    # The declared size is only a shortcut; save_uploaded_file enforces the limit on the bytes themselves
     if file.size and file.size > MAX_FILE_SIZE:
-        raise HTTPException(
-            status_code=413, 
-            detail=f"File size exceeds maximum limit of {MAX_FILE_SIZE // (1024*1024)}MB"
-        )
+        raise file_too_large()
     
     if file.content_type not in ALLOWED_MIME_TYPES:
         raise HTTPException(
@@ -39,41 +59,74 @@ def validate_pdf_file(file: UploadFile) -> None:
             detail="Invalid file extension. Only .pdf files are allowed"
         )
 
-def save_uploaded_file(file: UploadFile) -> tuple[str, str]:
-    """Save uploaded file and return UUID filename and file path"""
+def file_too_large() -> HTTPException:
+    return HTTPException(
+        status_code=413, 
+        detail=f"File size exceeds maximum limit of {MAX_FILE_SIZE // (1024*1024)}MB"
+    )
+
+def save_uploaded_file(file: UploadFile) -> tuple[str, str, str]:
+    """Stream the upload to disk; returns UUID filename, file path and SHA-256 hex digest.
+
+    Blocks are copied through a temp file in the upload directory, hashed on
+    the way, and renamed into place only once complete, so a failed or
+    rejected upload never leaves a partial PDF behind. The size limit and the
+    PDF signature are checked while copying, aborting at the first bad block.
+    """
     # Generate unique filename
     file_uuid = str(uuid.uuid4())
-    filename = f"{file_uuid}.pdf"
-    file_path = UPLOAD_DIR / filename
+    file_path = UPLOAD_DIR / f"{file_uuid}.pdf"
     
     # Ensure upload directory exists
     UPLOAD_DIR.mkdir(exist_ok=True)
     
-    # Save file
+    digest = hashlib.sha256()
+    size = 0
+    temp = tempfile.NamedTemporaryFile(dir=UPLOAD_DIR, prefix=f".{file_uuid}.", suffix=".part", delete=False)
     try:
-        with open(file_path, "wb") as buffer:
-            content = file.file.read()
-            buffer.write(content)
+        with temp:
+            while block := file.file.read(UPLOAD_BLOCK_SIZE):
+                if size == 0 and not block.startswith(PDF_MAGIC):
+                    raise HTTPException(status_code=400, detail="File is not a PDF document")
+                size += len(block)
+                if size > MAX_FILE_SIZE:
+                    raise file_too_large()
+                digest.update(block)
+                temp.write(block)
+            if size == 0:
+                raise HTTPException(status_code=400, detail="Uploaded file is empty")
+            temp.flush()
+            os.fsync(temp.fileno())
+        os.replace(temp.name, file_path)
+    except HTTPException:
+        os.unlink(temp.name)
+        raise
     except Exception as e:
+        try:
+            os.unlink(temp.name)
+        except OSError:
+            pass
         raise HTTPException(
             status_code=500, 
             detail=f"Failed to save file: {str(e)}"
         )
     
-    return file_uuid, str(file_path)
+    return file_uuid, str(file_path), digest.hexdigest()
 
 @router.post("/", response_model=DocumentUploadResponse)
 async def upload_document(
     file: UploadFile = File(...),
+    court: Optional[str] = Form(None, max_length=200),
+    decision_year: Optional[int] = Form(None, ge=1600, le=2100),
     credentials: HTTPAuthorizationCredentials = Depends(security),
     db: Session = Depends(get_db)
 ):
-    """Upload legal document for processing"""
+    """Upload legal document for processing; court and decision year make it filterable in search"""
     # Validate file
     validate_pdf_file(file)
     
-    # Save file to disk
-    file_uuid, file_path = save_uploaded_file(file)
+    # Save file to disk off the event loop
+    file_uuid, file_path, content_hash = await run_in_threadpool(save_uploaded_file, file)
     
     # Create document record in database
     try:
@@ -81,7 +134,10 @@ async def upload_document(
             id=uuid.UUID(file_uuid),
             filename=file.filename,
             file_path=file_path,
-            status="uploaded"
+            status="uploaded",
+            content_hash=content_hash,
+            court=court,
+            decision_year=decision_year
         )
         db.add(document)
         db.commit()
@@ -99,7 +155,8 @@ async def upload_document(
     
     return DocumentUploadResponse(
         id=document.id,
-        status=DocumentStatus.UPLOADED
+        status=DocumentStatus.UPLOADED,
+        content_hash=content_hash
     )
 
 @router.get("/{document_id}/status", response_model=DocumentStatusResponse)
@@ -118,11 +175,26 @@ async def get_document_status(
     if not document:
         raise HTTPException(status_code=404, detail="Document not found")
     
-    # TODO: Implement actual progress tracking
-    progress = 50 if document.status == "processing" else 100
+    # The latest ingestion job carries live progress; without one the stored status is final
+    try:
+        job = ingest_queue.latest(doc_uuid)
+    except Exception:
+        job = None
+    if job is None or (not ingest_queue.is_active(job) and job["status"] != "failed"):
+        status = DOCUMENT_STATUSES.get(document.status, DocumentStatus.UPLOADED)
+        return DocumentStatusResponse(
+            document_id=document.id,
+            status=status,
+            progress=100 if status == DocumentStatus.COMPLETED else 0
+        )
     
     return DocumentStatusResponse(
         document_id=document.id,
-        status=DocumentStatus(document.status),
-        progress=progress
-    )
\ No newline at end of file
+        status=JOB_STATUSES[job["status"]],
+        progress=job["progress"],
+        job_id=job["job_id"],
+        stage=job["stage"],
+        pages_done=job["pages_done"],
+        pages_total=job["pages_total"],
+        error=job["error"] or None
+    )
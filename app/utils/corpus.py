@@ -0,0 +1,47 @@
+import uuid
+from typing import List, Tuple
+from sqlalchemy.orm import Session
+from sqlalchemy.dialects.postgresql import insert
+import logging
+
+from app.db.models import CorpusVersion, CorpusChange
+
+logger = logging.getLogger(__name__)
+
+# The counter lives in a single row
+CORPUS_VERSION_ROW = 1
+
+def get_corpus_version(db: Session) -> int:
+    """Get the current corpus version; 0 before any document was indexed"""
+    version = db.query(CorpusVersion.version).filter(CorpusVersion.id == CORPUS_VERSION_ROW).scalar()
+    return version or 0
+
+def bump_corpus_version(db: Session) -> int:
+    """Increment the corpus version inside the caller's transaction and return it.
+
+    Call this in the same transaction that adds or removes chunks so the new
+    version becomes visible exactly when the chunk changes do.
+    """
+    statement = insert(CorpusVersion).values(id=CORPUS_VERSION_ROW, version=1).on_conflict_do_update(
+        index_elements=[CorpusVersion.id],
+        set_={"version": CorpusVersion.version + 1}
+    ).returning(CorpusVersion.version)
+    return db.execute(statement).scalar_one()
+
+def record_corpus_change(db: Session, doc_id: uuid.UUID) -> int:
+    """Bump the corpus version for a change to one document's chunks and log it.
+
+    The log lets workers replay versions they missed instead of rebuilding
+    their whole index. Runs inside the caller's transaction, like bump_corpus_version.
+    """
+    version = bump_corpus_version(db)
+    db.execute(insert(CorpusChange).values(version=version, doc_id=doc_id))
+    return version
+
+def get_corpus_changes(db: Session, after: int, upto: int) -> List[Tuple[int, uuid.UUID]]:
+    """(version, doc_id) pairs for versions in (after, upto], oldest first"""
+    rows = db.query(CorpusChange.version, CorpusChange.doc_id).filter(
+        CorpusChange.version > after,
+        CorpusChange.version <= upto
+    ).order_by(CorpusChange.version).all()
+    return [(row.version, row.doc_id) for row in rows]
@@ -1,69 +1,572 @@
+import asyncio
+import hashlib
+import math
 import os
-from typing import List
+import random
+import re
+import threading
+import time
+import unicodedata
+import weakref
+from collections import OrderedDict
+from concurrent.futures import FIRST_EXCEPTION, ThreadPoolExecutor, wait
+from typing import Dict, List, Optional, Tuple
 import numpy as np
 import logging
-from openai import OpenAI
+import redis
+import redis.asyncio
+from openai import OpenAI, AsyncOpenAI, RateLimitError, APITimeoutError, APIConnectionError, InternalServerError
 import faiss
 from dotenv import load_dotenv
 
+from app.utils.vector_codec import normalize_vectors
+
 load_dotenv()
 
 logger = logging.getLogger(__name__)
 
-# Initialize OpenAI client
+# Initialize OpenAI clients
 client = OpenAI(api_key=os.getenv("OPENAI_API_KEY"))
+async_client = AsyncOpenAI(api_key=os.getenv("OPENAI_API_KEY"))
+
+EMBEDDING_MODEL = os.getenv("EMBEDDING_MODEL", "text-embedding-3-small")
+
+# Query embedding cache configuration
+EMBEDDING_CACHE_SIZE = int(os.getenv("EMBEDDING_CACHE_SIZE", "10000"))
+EMBEDDING_CACHE_TTL = int(os.getenv("EMBEDDING_CACHE_TTL", str(7 * 24 * 3600)))  # 1 week
+
+# Chunk embedding request limits; the API caps inputs at 2048 items per request
+EMBEDDING_BATCH_MAX_ITEMS = int(os.getenv("EMBEDDING_BATCH_MAX_ITEMS", "512"))
+EMBEDDING_BATCH_MAX_TOKENS = int(os.getenv("EMBEDDING_BATCH_MAX_TOKENS", "100000"))
+# Concurrent embedding requests per process, shared by all callers
+EMBEDDING_CONCURRENCY = int(os.getenv("EMBEDDING_CONCURRENCY", "4"))
+EMBEDDING_MAX_RETRIES = int(os.getenv("EMBEDDING_MAX_RETRIES", "5"))
+EMBEDDING_RETRY_BASE_DELAY = float(os.getenv("EMBEDDING_RETRY_BASE_DELAY", "1.0"))
+EMBEDDING_RETRY_MAX_DELAY = 30.0
+
+# Transient API failures worth retrying
+RETRYABLE_EMBEDDING_ERRORS = (RateLimitError, APITimeoutError, APIConnectionError, InternalServerError)
+
+_embedding_slots = threading.BoundedSemaphore(EMBEDDING_CONCURRENCY)
+# Async counterpart; asyncio primitives belong to one event loop, so one per loop
+_async_embedding_slots: "weakref.WeakKeyDictionary[asyncio.AbstractEventLoop, asyncio.Semaphore]" = weakref.WeakKeyDictionary()
+
+def _async_slots() -> asyncio.Semaphore:
+    loop = asyncio.get_running_loop()
+    slots = _async_embedding_slots.get(loop)
+    if slots is None:
+        slots = _async_embedding_slots[loop] = asyncio.Semaphore(EMBEDDING_CONCURRENCY)
+    return slots
+
+_whitespace = re.compile(r'\s+')
+
+def normalize_query_text(text: str) -> str:
+    """Canonical form of a query for cache keys: NFKC, casefolded, single-spaced"""
+    return _whitespace.sub(' ', unicodedata.normalize("NFKC", text)).strip().casefold()
+
+class EmbeddingCache:
+    """Two-tier query embedding cache: a bounded in-process LRU in front of Redis.
+
+    Redis holds raw little-endian float32 bytes so entries are shared across
+    workers and survive restarts. Redis failures are logged and treated as misses.
+    The *_async methods use async_redis_client so the event loop never blocks.
+    """
+
+    def __init__(
+        self,
+        max_size: int,
+        redis_client: Optional[redis.Redis] = None,
+        ttl: int = EMBEDDING_CACHE_TTL,
+        async_redis_client: Optional[redis.asyncio.Redis] = None
+    ):
+        self.max_size = max_size
+        self.redis_client = redis_client
+        self.async_redis_client = async_redis_client
+        self.ttl = ttl
+        self._entries: "OrderedDict[str, np.ndarray]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.stats = {"local_hits": 0, "redis_hits": 0, "misses": 0}
+
+    @staticmethod
+    def key(text: str, model: str) -> str:
+        digest = hashlib.sha256(f"{model}\0{normalize_query_text(text)}".encode()).hexdigest()
+        return f"emb:{digest}"
+
+    def _remember(self, key: str, vector: np.ndarray) -> None:
+        with self._lock:
+            self._entries[key] = vector
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+
+    def _get_local(self, keys: List[str]) -> List[Optional[np.ndarray]]:
+        found: List[Optional[np.ndarray]] = [None] * len(keys)
+        with self._lock:
+            for i, key in enumerate(keys):
+                vector = self._entries.get(key)
+                if vector is not None:
+                    self._entries.move_to_end(key)
+                    found[i] = vector
+                    self.stats["local_hits"] += 1
+        return found
+
+    def _merge_remote(self, keys: List[str], found: List[Optional[np.ndarray]], remote: List[int], blobs: list) -> None:
+        redis_hits = 0
+        for i, blob in zip(remote, blobs):
+            if blob:
+                found[i] = np.frombuffer(blob, dtype='<f4').astype(np.float32)
+                self._remember(keys[i], found[i])
+                redis_hits += 1
+        misses = sum(1 for vector in found if vector is None)
+        # Callers run on threadpool workers, so counters change under the lock
+        with self._lock:
+            self.stats["redis_hits"] += redis_hits
+            self.stats["misses"] += misses
+
+    def _put_local(self, texts: List[str], model: str, vectors: List[List[float]]) -> Dict[str, bytes]:
+        entries = {}
+        for text, vector in zip(texts, vectors):
+            key = self.key(text, model)
+            array = np.asarray(vector, dtype='<f4')
+            self._remember(key, array.astype(np.float32))
+            entries[key] = array.tobytes()
+        return entries
+
+    def get_many(self, texts: List[str], model: str) -> List[Optional[np.ndarray]]:
+        """Look texts up locally, then fetch the rest from Redis in one round trip"""
+        keys = [self.key(text, model) for text in texts]
+        found = self._get_local(keys)
+
+        remote = [i for i, vector in enumerate(found) if vector is None]
+        blobs = [None] * len(remote)
+        if remote and self.redis_client is not None:
+            try:
+                blobs = self.redis_client.mget([keys[i] for i in remote])
+            except Exception as e:
+                logger.warning(f"Error reading embedding cache: {str(e)}")
+        self._merge_remote(keys, found, remote, blobs)
+        return found
+
+    async def get_many_async(self, texts: List[str], model: str) -> List[Optional[np.ndarray]]:
+        """get_many over the async Redis client"""
+        keys = [self.key(text, model) for text in texts]
+        found = self._get_local(keys)
+
+        remote = [i for i, vector in enumerate(found) if vector is None]
+        blobs = [None] * len(remote)
+        if remote and self.async_redis_client is not None:
+            try:
+                blobs = await self.async_redis_client.mget([keys[i] for i in remote])
+            except Exception as e:
+                logger.warning(f"Error reading embedding cache: {str(e)}")
+        self._merge_remote(keys, found, remote, blobs)
+        return found
+
+    def put_many(self, texts: List[str], model: str, vectors: List[List[float]]) -> None:
+        """Store vectors in both tiers"""
+        entries = self._put_local(texts, model, vectors)
+
+        if entries and self.redis_client is not None:
+            try:
+                pipeline = self.redis_client.pipeline(transaction=False)
+                for key, blob in entries.items():
+                    pipeline.setex(key, self.ttl, blob)
+                pipeline.execute()
+            except Exception as e:
+                logger.warning(f"Error writing embedding cache: {str(e)}")
+
+    async def put_many_async(self, texts: List[str], model: str, vectors: List[List[float]]) -> None:
+        """put_many over the async Redis client"""
+        entries = self._put_local(texts, model, vectors)
+
+        if entries and self.async_redis_client is not None:
+            try:
+                pipeline = self.async_redis_client.pipeline(transaction=False)
+                for key, blob in entries.items():
+                    pipeline.setex(key, self.ttl, blob)
+                await pipeline.execute()
+            except Exception as e:
+                logger.warning(f"Error writing embedding cache: {str(e)}")
+
+    def clear(self) -> None:
+        """Drop the in-process tier"""
+        with self._lock:
+            self._entries.clear()
+
+# Binary clients: vectors are stored as raw bytes, not decoded strings
+_cache_redis = redis.Redis.from_url(
+    os.getenv("REDIS_URL", "redis://localhost:6379"),
+    socket_connect_timeout=0.5,
+    socket_timeout=0.5
+)
+_cache_redis_async = redis.asyncio.Redis.from_url(
+    os.getenv("REDIS_URL", "redis://localhost:6379"),
+    socket_connect_timeout=0.5,
+    socket_timeout=0.5
+)
+query_embedding_cache = EmbeddingCache(EMBEDDING_CACHE_SIZE, _cache_redis, async_redis_client=_cache_redis_async)
+
+def embedding_cache_stats() -> Dict[str, int]:
+    """Hit and miss counters of the query embedding cache"""
+    with query_embedding_cache._lock:
+        return dict(query_embedding_cache.stats)
+
+def embed_queries(queries: List[str], model: str = EMBEDDING_MODEL) -> List[List[float]]:
+    """Embed search queries, serving repeats from the query embedding cache"""
+    if not queries:
+        return []
+    
+    cached = query_embedding_cache.get_many(queries, model)
+    
+    # Embed each distinct missing query once
+    missing: Dict[str, List[int]] = {}
+    for i, vector in enumerate(cached):
+        if vector is None:
+            missing.setdefault(EmbeddingCache.key(queries[i], model), []).append(i)
+    
+    if missing:
+        positions = list(missing.values())
+        texts = [queries[indices[0]] for indices in positions]
+        fresh = embed_chunks(texts, model)
+        if len(fresh) != len(texts):
+            raise RuntimeError("embedding backend returned the wrong number of vectors")
+        query_embedding_cache.put_many(texts, model, fresh)
+        for indices, vector in zip(positions, fresh):
+            for i in indices:
+                cached[i] = vector
+    
+    return [vector if isinstance(vector, list) else vector.tolist() for vector in cached]
+
+async def embed_queries_async(queries: List[str], model: str = EMBEDDING_MODEL) -> List[List[float]]:
+    """embed_queries over the async Redis and OpenAI clients"""
+    if not queries:
+        return []
+    
+    cached = await query_embedding_cache.get_many_async(queries, model)
+    
+    # Embed each distinct missing query once
+    missing: Dict[str, List[int]] = {}
+    for i, vector in enumerate(cached):
+        if vector is None:
+            missing.setdefault(EmbeddingCache.key(queries[i], model), []).append(i)
+    
+    if missing:
+        positions = list(missing.values())
+        texts = [queries[indices[0]] for indices in positions]
+        fresh = await embed_chunks_async(texts, model)
+        if len(fresh) != len(texts):
+            raise RuntimeError("embedding backend returned the wrong number of vectors")
+        await query_embedding_cache.put_many_async(texts, model, fresh)
+        for indices, vector in zip(positions, fresh):
+            for i in indices:
+                cached[i] = vector
+    
+    return [vector if isinstance(vector, list) else vector.tolist() for vector in cached]
 
 def generate_embedding(text: str) -> List[float]:
-    """Generate a single embedding. Thin wrapper around embed_chunks for parity with callers."""
+    """Generate a single query embedding, using the query embedding cache"""
+    if not isinstance(text, str) or not text.strip():
+        raise ValueError("text must be a non-empty string")
+    vecs = embed_queries([text])
+    if not vecs or not isinstance(vecs[0], list):
+        raise RuntimeError("embedding backend returned an empty or invalid vector")
+    return vecs[0]
+
+async def generate_embedding_async(text: str) -> List[float]:
+    """generate_embedding over the async Redis and OpenAI clients"""
     if not isinstance(text, str) or not text.strip():
         raise ValueError("text must be a non-empty string")
-    vecs = embed_chunks([text])
+    vecs = await embed_queries_async([text])
     if not vecs or not isinstance(vecs[0], list):
         raise RuntimeError("embedding backend returned an empty or invalid vector")
     return vecs[0]
 
-def embed_chunks(chunks: List[str]) -> List[List[float]]:
-    """Generate embeddings for text chunks using OpenAI text-embedding-3-small"""
+def estimate_tokens(text: str) -> int:
+    """Estimate tokens: approximately 4 characters per token"""
+    return max(1, math.ceil(len(text) / 4))
+
+def plan_embedding_batches(
+    chunks: List[str],
+    max_items: int = EMBEDDING_BATCH_MAX_ITEMS,
+    max_tokens: int = EMBEDDING_BATCH_MAX_TOKENS
+) -> List[Tuple[int, int]]:
+    """Split chunks into contiguous [start, end) batches within the item and token limits"""
+    batches = []
+    start = 0
+    batch_tokens = 0
+    for i, chunk in enumerate(chunks):
+        tokens = estimate_tokens(chunk)
+        if i > start and (i - start >= max_items or batch_tokens + tokens > max_tokens):
+            batches.append((start, i))
+            start = i
+            batch_tokens = 0
+        batch_tokens += tokens
+    if start < len(chunks):
+        batches.append((start, len(chunks)))
+    return batches
+
+def _retry_delay(error: Exception, attempt: int) -> float:
+    # Honour the server's Retry-After on rate limits, otherwise back off exponentially with full jitter
+    response = getattr(error, "response", None)
+    retry_after = response.headers.get("retry-after") if response is not None else None
+    if retry_after:
+        try:
+            return min(float(retry_after), EMBEDDING_RETRY_MAX_DELAY)
+        except ValueError:
+            pass
+    return random.uniform(0, min(EMBEDDING_RETRY_MAX_DELAY, EMBEDDING_RETRY_BASE_DELAY * 2 ** attempt))
+
+def _embed_batch(texts: List[str], model: str) -> List[List[float]]:
+    """Embed one request's worth of texts, retrying transient failures"""
+    attempt = 0
+    while True:
+        try:
+            with _embedding_slots:
+                response = client.embeddings.create(model=model, input=texts)
+            embeddings = [data.embedding for data in response.data]
+            if len(embeddings) != len(texts):
+                raise RuntimeError("embedding backend returned the wrong number of vectors")
+            return embeddings
+        except RETRYABLE_EMBEDDING_ERRORS as e:
+            if attempt >= EMBEDDING_MAX_RETRIES:
+                raise
+            delay = _retry_delay(e, attempt)
+            attempt += 1
+            logger.warning(f"Embedding request failed ({type(e).__name__}), retry {attempt}/{EMBEDDING_MAX_RETRIES} in {delay:.1f}s")
+            time.sleep(delay)
+
+def embed_chunks(chunks: List[str], model: str = EMBEDDING_MODEL) -> List[List[float]]:
+    """Generate embeddings for text chunks, split into concurrent requests within API limits"""
     if not chunks:
         return []
     
     try:
-        # Batch process chunks for efficiency
-        response = client.embeddings.create(
-            model="text-embedding-3-small",
-            input=chunks
-        )
+        batches = plan_embedding_batches(chunks, EMBEDDING_BATCH_MAX_ITEMS, EMBEDDING_BATCH_MAX_TOKENS)
+        if len(batches) == 1:
+            embeddings = _embed_batch(chunks, model)
+        else:
+            results: List[Optional[List[List[float]]]] = [None] * len(batches)
+            executor = ThreadPoolExecutor(max_workers=min(EMBEDDING_CONCURRENCY, len(batches)))
+            try:
+                futures = {
+                    executor.submit(_embed_batch, chunks[start:end], model): i
+                    for i, (start, end) in enumerate(batches)
+                }
+                # Fail fast: the first error is raised and pending batches are cancelled
+                done, _ = wait(futures, return_when=FIRST_EXCEPTION)
+                for future in done:
+                    future.result()
+                for future, i in futures.items():
+                    results[i] = future.result()
+            finally:
+                executor.shutdown(wait=True, cancel_futures=True)
+            
+            # Reassemble in input order
+            embeddings = [vector for batch in results for vector in batch]
         
-        embeddings = [data.embedding for data in response.data]
-        logger.info(f"Generated embeddings for {len(chunks)} chunks")
+        logger.info(f"Generated embeddings for {len(chunks)} chunks in {len(batches)} requests")
         return embeddings
         
     except Exception as e:
         logger.error(f"Error generating embeddings: {str(e)}")
         raise
 
-def create_faiss_index(embeddings: List[List[float]], dimension: int = 1536) -> faiss.Index:
-    """Create FAISS index for vector similarity search"""
+async def _embed_batch_async(texts: List[str], model: str) -> List[List[float]]:
+    """Async _embed_batch: embed one request's worth of texts, retrying transient failures"""
+    attempt = 0
+    while True:
+        try:
+            async with _async_slots():
+                response = await async_client.embeddings.create(model=model, input=texts)
+            embeddings = [data.embedding for data in response.data]
+            if len(embeddings) != len(texts):
+                raise RuntimeError("embedding backend returned the wrong number of vectors")
+            return embeddings
+        except RETRYABLE_EMBEDDING_ERRORS as e:
+            if attempt >= EMBEDDING_MAX_RETRIES:
+                raise
+            delay = _retry_delay(e, attempt)
+            attempt += 1
+            logger.warning(f"Embedding request failed ({type(e).__name__}), retry {attempt}/{EMBEDDING_MAX_RETRIES} in {delay:.1f}s")
+            await asyncio.sleep(delay)
+
+async def embed_chunks_async(chunks: List[str], model: str = EMBEDDING_MODEL) -> List[List[float]]:
+    """embed_chunks on the async client; requests from all callers share the EMBEDDING_CONCURRENCY cap"""
+    if not chunks:
+        return []
+    
+    try:
+        batches = plan_embedding_batches(chunks, EMBEDDING_BATCH_MAX_ITEMS, EMBEDDING_BATCH_MAX_TOKENS)
+        results = await asyncio.gather(*(
+            _embed_batch_async(chunks[start:end], model) for start, end in batches
+        ))
+        
+        # gather keeps input order
+        embeddings = [vector for batch in results for vector in batch]
+        logger.info(f"Generated embeddings for {len(chunks)} chunks in {len(batches)} requests")
+        return embeddings
+        
+    except Exception as e:
+        logger.error(f"Error generating embeddings: {str(e)}")
+        raise
+
+# Index types supported by create_faiss_index
+INDEX_TYPES = ("flat", "ivf_flat", "ivf_pq", "hnsw")
+
+def default_nlist(num_vectors: int) -> int:
+    """Pick an IVF list count: ~4*sqrt(N), keeping >= 39 training points per list"""
+    nlist = int(4 * np.sqrt(max(num_vectors, 1)))
+    return max(1, min(nlist, num_vectors // 39))
+
+def create_faiss_index(
+    embeddings: List[List[float]],
+    dimension: int = 1536,
+    index_type: str = "flat",
+    nlist: Optional[int] = None,
+    pq_m: int = 64,
+    pq_nbits: int = 8,
+    hnsw_m: int = 32,
+    ef_construction: int = 80,
+    trained_index: Optional[faiss.Index] = None
+) -> faiss.Index:
+    """Create FAISS index for vector similarity search.
+
+    index_type is one of "flat" (exact), "ivf_flat", "ivf_pq" or "hnsw". IVF
+    indexes are trained on the given vectors unless an already-trained empty
+    index is passed as trained_index, e.g. one restored by load_faiss_index.
+    """
+    if index_type not in INDEX_TYPES:
+        raise ValueError(f"Unknown index type '{index_type}', expected one of {INDEX_TYPES}")
+    
     try:
         # Convert to numpy array
         vectors = np.array(embeddings).astype('float32')
         
-        # Create FAISS index
-        index = faiss.IndexFlatIP(dimension)  # Inner product for cosine similarity
+        if trained_index is not None:
+            if trained_index.d != dimension or not trained_index.is_trained:
+                raise ValueError("trained_index must be a trained index of the same dimension")
+            index = faiss.clone_index(trained_index)
+            index.reset()
+        elif index_type == "flat":
+            index = faiss.IndexFlatIP(dimension)  # Inner product for cosine similarity
+        elif index_type == "hnsw":
+            index = faiss.IndexHNSWFlat(dimension, hnsw_m, faiss.METRIC_INNER_PRODUCT)
+            index.hnsw.efConstruction = ef_construction
+        else:
+            lists = nlist or default_nlist(len(vectors))
+            quantizer = faiss.IndexFlatIP(dimension)
+            if index_type == "ivf_flat":
+                index = faiss.IndexIVFFlat(quantizer, dimension, lists, faiss.METRIC_INNER_PRODUCT)
+            else:
+                if dimension % pq_m != 0:
+                    raise ValueError(f"dimension {dimension} must be divisible by pq_m {pq_m}")
+                index = faiss.IndexIVFPQ(quantizer, dimension, lists, pq_m, pq_nbits, faiss.METRIC_INNER_PRODUCT)
+            index.train(vectors)
+        
         index.add(vectors)
         
-        logger.info(f"Created FAISS index with {len(embeddings)} vectors")
+        logger.info(f"Created FAISS {index_type} index with {len(embeddings)} vectors")
         return index
         
     except Exception as e:
         logger.error(f"Error creating FAISS index: {str(e)}")
         raise
 
-def search_similar_chunks(query_embedding: List[float], index: faiss.Index, k: int = 5) -> tuple:
+def save_faiss_index(index: faiss.Index, path: str, trained_only: bool = False) -> None:
+    """Write a FAISS index to disk; trained_only stores the trained structure without vectors"""
+    if trained_only:
+        index = faiss.clone_index(index)
+        index.reset()
+    faiss.write_index(index, str(path))
+    logger.info(f"Saved FAISS index with {index.ntotal} vectors to {path}")
+
+def load_faiss_index(path: str, mmap: bool = False) -> faiss.Index:
+    """Read a FAISS index from disk, optionally memory-mapped"""
+    flags = faiss.IO_FLAG_MMAP if mmap else 0
+    return faiss.read_index(str(path), flags)
+
+def faiss_search_params(
+    index: faiss.Index,
+    nprobe: Optional[int] = None,
+    ef_search: Optional[int] = None,
+    selector: Optional[faiss.IDSelector] = None
+) -> Optional[faiss.SearchParameters]:
+    """Build per-call search parameters so shared indexes are never mutated"""
+    if faiss.try_extract_index_ivf(index) is not None:
+        params = faiss.SearchParametersIVF()
+        if nprobe:
+            params.nprobe = nprobe
+        else:
+            params.nprobe = faiss.try_extract_index_ivf(index).nprobe
+    elif isinstance(index, faiss.IndexHNSW):
+        params = faiss.SearchParametersHNSW()
+        params.efSearch = ef_search or index.hnsw.efSearch
+    elif selector is not None:
+        params = faiss.SearchParameters()
+    else:
+        return None
+    if selector is not None:
+        params.sel = selector
+    return params
+
+# faiss 1.7.x reads efSearch from the HNSW object rather than the per-call
+# parameters, so every HNSW search goes through this gate: searches sharing an
+# efSearch value run concurrently, and the value only changes while none run
+_hnsw_ef_cond = threading.Condition()
+# index -> [efSearch in use, running searches, default efSearch]
+_hnsw_ef_active: "weakref.WeakKeyDictionary[faiss.Index, List[int]]" = weakref.WeakKeyDictionary()
+
+def _search_hnsw(index: faiss.Index, query_vectors: np.ndarray, k: int, ef_search: Optional[int], params) -> tuple:
+    key = index
+    with _hnsw_ef_cond:
+        if key not in _hnsw_ef_active:
+            # Remember the index's own default the first time it is searched
+            _hnsw_ef_active[key] = [index.hnsw.efSearch, 0, index.hnsw.efSearch]
+        wanted = ef_search or _hnsw_ef_active[key][2]
+        while _hnsw_ef_active[key][1] and _hnsw_ef_active[key][0] != wanted:
+            _hnsw_ef_cond.wait()
+        state = _hnsw_ef_active[key]
+        if state[0] != wanted:
+            index.hnsw.efSearch = wanted
+            state[0] = wanted
+        state[1] += 1
+    try:
+        if params is None:
+            return index.search(query_vectors, k)
+        return index.search(query_vectors, k, params=params)
+    finally:
+        with _hnsw_ef_cond:
+            state[1] -= 1
+            if not state[1]:
+                _hnsw_ef_cond.notify_all()
+
+def search_faiss_index(
+    index: faiss.Index,
+    query_vectors: np.ndarray,
+    k: int,
+    nprobe: Optional[int] = None,
+    ef_search: Optional[int] = None,
+    selector: Optional[faiss.IDSelector] = None
+) -> tuple:
+    """Search any FAISS index with per-call tuning; returns (scores, indices) arrays"""
+    params = faiss_search_params(index, nprobe, ef_search, selector)
+    if isinstance(index, faiss.IndexHNSW):
+        return _search_hnsw(index, query_vectors, k, ef_search, params)
+    if params is None:
+        return index.search(query_vectors, k)
+    return index.search(query_vectors, k, params=params)
+
+def search_similar_chunks(
+    query_embedding: List[float],
+    index: faiss.Index,
+    k: int = 5,
+    nprobe: Optional[int] = None,
+    ef_search: Optional[int] = None
+) -> tuple:
     """Search for similar chunks using FAISS index"""
     try:
         query_vector = np.array([query_embedding]).astype('float32')
-        scores, indices = index.search(query_vector, k)
+        scores, indices = search_faiss_index(index, query_vector, k, nprobe, ef_search)
         
         return scores[0].tolist(), indices[0].tolist()
         
@@ -83,4 +586,4 @@ def cosine_similarity(vec1: List[float], vec2: List[float]) -> float:
     if norm1 == 0 or norm2 == 0:
         return 0.0
     
-    return dot_product / (norm1 * norm2)
\ No newline at end of file
+    return dot_product / (norm1 * norm2)
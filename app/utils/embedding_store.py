@@ -0,0 +1,74 @@
+import hashlib
+from typing import Dict, List
+from sqlalchemy.orm import Session
+from sqlalchemy.dialects.postgresql import insert
+import logging
+
+from app.db.models import StoredEmbedding
+from app.utils.embedding import EMBEDDING_MODEL, embed_chunks
+from app.utils.vector_codec import EMBEDDING_STORAGE_DTYPE, decode_embedding, encode_embedding
+
+logger = logging.getLogger(__name__)
+
+# Hashes per IN (...) lookup
+LOOKUP_BATCH_SIZE = 1000
+
+def content_hash(text: str, model: str = EMBEDDING_MODEL) -> str:
+    """Content address of a chunk embedding: sha256 of the model name, a newline and the text"""
+    return hashlib.sha256(f"{model}\n{text}".encode("utf-8")).hexdigest()
+
+def lookup_embeddings(hashes: List[str], db: Session) -> Dict[str, List[float]]:
+    """Fetch stored embeddings for the given content hashes"""
+    found = {}
+    for start in range(0, len(hashes), LOOKUP_BATCH_SIZE):
+        batch = hashes[start:start + LOOKUP_BATCH_SIZE]
+        rows = db.query(
+            StoredEmbedding.content_hash,
+            StoredEmbedding.embedding_bin,
+            StoredEmbedding.embedding_dtype
+        ).filter(StoredEmbedding.content_hash.in_(batch)).all()
+        for row in rows:
+            found[row.content_hash] = decode_embedding(row.embedding_bin, row.embedding_dtype).tolist()
+    return found
+
+def store_embeddings(entries: Dict[str, List[float]], model: str, db: Session) -> None:
+    """Add embeddings to the store inside the caller's transaction"""
+    if not entries:
+        return
+    statement = insert(StoredEmbedding).values([
+        {
+            "content_hash": digest,
+            "model": model,
+            "embedding_bin": encode_embedding(vector, EMBEDDING_STORAGE_DTYPE),
+            "embedding_dtype": EMBEDDING_STORAGE_DTYPE,
+        }
+        for digest, vector in entries.items()
+    ]).on_conflict_do_nothing(index_elements=[StoredEmbedding.content_hash])
+    db.execute(statement)
+
+def embed_chunks_deduplicated(chunks: List[str], db: Session, model: str = EMBEDDING_MODEL) -> List[List[float]]:
+    """Embed chunks, sending only text the store has never seen to the embeddings API.
+
+    New embeddings are added to the store in the caller's transaction, so they
+    persist when the caller commits.
+    """
+    if not chunks:
+        return []
+    
+    hashes = [content_hash(chunk, model) for chunk in chunks]
+    unique_hashes = list(dict.fromkeys(hashes))
+    known = lookup_embeddings(unique_hashes, db)
+    
+    # Embed each novel text once, even if it repeats within the document
+    novel = [digest for digest in unique_hashes if digest not in known]
+    if novel:
+        text_of = dict(zip(hashes, chunks))
+        fresh = embed_chunks([text_of[digest] for digest in novel], model)
+        if len(fresh) != len(novel):
+            raise RuntimeError("embedding backend returned the wrong number of vectors")
+        fresh_by_hash = dict(zip(novel, fresh))
+        store_embeddings(fresh_by_hash, model, db)
+        known.update(fresh_by_hash)
+    
+    logger.info(f"Embedded {len(novel)} novel chunks, reused {len(chunks) - len(novel)} of {len(chunks)}")
+    return [known[digest] for digest in hashes]
@@ -0,0 +1,397 @@
+import argparse
+import os
+import queue
+import threading
+import time
+import uuid
+from itertools import islice
+from pathlib import Path
+from typing import Dict, Iterable, Iterator, List, Optional, Tuple
+import logging
+import numpy as np
+import redis
+from sqlalchemy import insert
+from sqlalchemy.orm import Session
+
+from app.db.database import SessionLocal
+from app.db.models import Document, DocumentChunk
+from app.utils.parser import iter_chunks_from_pdf
+from app.utils.embedding_store import embed_chunks_deduplicated
+from app.utils.vector_codec import EMBEDDING_STORAGE_DTYPE, encode_embedding
+from app.utils.vector_index import get_vector_index
+from app.utils.lexical_index import get_lexical_index
+from app.utils.tenant_index import tenant_indexes
+from app.utils.corpus import record_corpus_change
+from app.utils.retrieval import build_snippet
+from app.utils.tokenizer import get_tokenizer
+
+logger = logging.getLogger(__name__)
+
+# "redis" shares the queue and job records across processes; "local" keeps them in this process
+INGEST_QUEUE_BACKEND = os.getenv("INGEST_QUEUE_BACKEND", "redis")
+# Documents one process ingests at once
+INGEST_CONCURRENCY = int(os.getenv("INGEST_CONCURRENCY", "2"))
+# Run ingestion workers inside the API processes; turn off when `python -m app.utils.ingest` workers run
+INGEST_IN_PROCESS_WORKERS = os.getenv("INGEST_IN_PROCESS_WORKERS", "true").lower() == "true"
+# How long job records stay queryable after their last update
+INGEST_JOB_TTL = int(os.getenv("INGEST_JOB_TTL_SECONDS", "86400"))
+# Chunks embedded and inserted together while the rest of the document is still being read
+INGEST_BATCH_CHUNKS = int(os.getenv("INGEST_BATCH_CHUNKS", "128"))
+# Chunk size in tokens, overlapping by a sixth; 0 keeps 600-character chunks
+INGEST_CHUNK_TOKENS = int(os.getenv("INGEST_CHUNK_TOKENS", "0"))
+# A queued or running job silent for this long is presumed lost, so the document may be queued again
+INGEST_STALE_SECONDS = float(os.getenv("INGEST_STALE_SECONDS", "600"))
+
+QUEUE_KEY = "ingest:queue"
+ACTIVE_STATUSES = ("queued", "processing")
+# Progress once every page is read, embedded and inserted; the commit and index update take the rest
+EXTRACTION_PROGRESS = 95
+INT_FIELDS = ("progress", "pages_done", "pages_total", "chunks")
+FLOAT_FIELDS = ("created_at", "updated_at")
+
+class IngestError(Exception):
+    """A document that cannot be ingested as requested; status_code is the matching HTTP status"""
+
+    def __init__(self, status_code: int, detail: str):
+        super().__init__(detail)
+        self.status_code = status_code
+        self.detail = detail
+
+def check_parseable(db: Session, document_uuid: uuid.UUID, force: bool) -> Tuple[Document, int]:
+    """Return the document and its current chunk count, or raise IngestError if it cannot be parsed"""
+    document = db.query(Document).filter(Document.id == document_uuid).first()
+    if not document:
+        raise IngestError(404, "Document not found")
+    if not Path(document.file_path).exists():
+        raise IngestError(404, "Document file not found on disk")
+    existing_chunks = db.query(DocumentChunk).filter(DocumentChunk.doc_id == document_uuid).count()
+    if existing_chunks > 0 and not force:
+        raise IngestError(409, "Document already parsed")
+    return document, existing_chunks
+
+def sync_vector_index(
+    document_uuid: uuid.UUID,
+    corpus_version: int,
+    replaced: bool,
+    chunk_ids: Optional[List[uuid.UUID]] = None,
+    embeddings: Optional[List[List[float]]] = None,
+    contents: Optional[List[str]] = None,
+    owner_id: Optional[int] = None
+) -> None:
+    """Apply a committed change to the resident vector and lexical indexes; unloaded ones pick rows up on first load.
+
+    The owner's tenant index is updated too when this worker holds it.
+    Failures are logged, not raised: the version check rebuilds a worker whose index fell behind.
+    """
+    indexes = [get_vector_index()]
+    if owner_id is not None:
+        indexes.append(tenant_indexes.resident(owner_id))
+    for index in indexes:
+        if index is None or not index.loaded:
+            continue
+        try:
+            if replaced:
+                index.remove_document(document_uuid)
+            if chunk_ids:
+                index.add(chunk_ids, document_uuid, embeddings)
+            index.advance_version(corpus_version)
+            index.schedule_snapshot()
+        except Exception as e:
+            logger.error(f"Error updating vector index for document {document_uuid}: {str(e)}")
+
+    lexical = get_lexical_index()
+    if lexical.loaded:
+        try:
+            if replaced:
+                lexical.remove_document(document_uuid)
+            if chunk_ids:
+                lexical.add(chunk_ids, document_uuid, contents)
+            lexical.advance_version(corpus_version)
+        except Exception as e:
+            logger.error(f"Error updating lexical index for document {document_uuid}: {str(e)}")
+
+def ingest_document(db: Session, document_uuid: uuid.UUID, force: bool, report=None) -> int:
+    """Extract, embed and store a document's chunks, then update the indexes; returns the chunk count.
+
+    Chunks are embedded and inserted in batches while later pages are still
+    being read, inside one transaction committed at the end. report(**fields),
+    when given, receives progress updates, including one per extracted page.
+    """
+    report = report or (lambda **fields: None)
+    document, existing_chunks = check_parseable(db, document_uuid, force)
+
+    def on_page(pages_done: int, pages_total: int) -> None:
+        report(
+            stage="extracting",
+            pages_done=pages_done,
+            pages_total=pages_total,
+            progress=EXTRACTION_PROGRESS * pages_done // pages_total
+        )
+
+    # Kept for the in-memory indexes, which take the new rows after the commit
+    chunk_ids: List[uuid.UUID] = []
+    contents: List[str] = []
+    vectors: List[np.ndarray] = []
+    try:
+        report(stage="extracting", progress=0)
+        # Replace previous chunks when re-parsing
+        if existing_chunks > 0:
+            db.query(DocumentChunk).filter(DocumentChunk.doc_id == document_uuid).delete(synchronize_session=False)
+
+        tokenizer = get_tokenizer()
+        if INGEST_CHUNK_TOKENS > 0:
+            chunks = iter_chunks_from_pdf(
+                document.file_path, INGEST_CHUNK_TOKENS, INGEST_CHUNK_TOKENS // 6, on_page=on_page, tokenizer=tokenizer
+            )
+        else:
+            chunks = iter_chunks_from_pdf(document.file_path, on_page=on_page)
+        for batch in iter_batches(chunks, INGEST_BATCH_CHUNKS):
+            # Embed chunks, reusing stored vectors for known text
+            embeddings = embed_chunks_deduplicated(batch, db)
+            if len(embeddings) != len(batch):
+                raise IngestError(500, "Embedding generation failed")
+
+            # Ids are assigned up front so the index can be updated without reloading rows
+            batch_ids = [uuid.uuid4() for _ in batch]
+            db.execute(insert(DocumentChunk), [
+                {
+                    "id": chunk_id,
+                    "doc_id": document_uuid,
+                    "chunk_index": len(chunk_ids) + i,
+                    "content": chunk_content,
+                    "embedding_bin": encode_embedding(embedding, EMBEDDING_STORAGE_DTYPE),
+                    "embedding_dtype": EMBEDDING_STORAGE_DTYPE,
+                    # Counted once here so prompt budgeting is a sum of stored integers
+                    "context_tokens": tokenizer.count(build_snippet(chunk_content))
+                }
+                for i, (chunk_id, chunk_content, embedding) in enumerate(zip(batch_ids, batch, embeddings))
+            ])
+            chunk_ids.extend(batch_ids)
+            contents.extend(batch)
+            vectors.append(np.asarray(embeddings, dtype=np.float32))
+            report(chunks=len(chunk_ids))
+
+        if not chunk_ids:
+            raise IngestError(422, "No text content extracted from PDF")
+
+        report(stage="storing", progress=EXTRACTION_PROGRESS)
+        document.status = "parsed"
+        corpus_version = record_corpus_change(db, document_uuid)
+        db.commit()
+    except Exception:
+        db.rollback()
+        raise
+
+    # The parse is committed from here on; index trouble must not fail the job
+    sync_vector_index(
+        document_uuid,
+        corpus_version,
+        replaced=existing_chunks > 0,
+        chunk_ids=chunk_ids,
+        embeddings=np.concatenate(vectors),
+        contents=contents,
+        owner_id=document.user_id
+    )
+    logger.info(f"Ingested document {document_uuid} into {len(chunk_ids)} chunks")
+    return len(chunk_ids)
+
+def iter_batches(items: Iterable, size: int) -> Iterator[list]:
+    """Consecutive lists of up to size items"""
+    iterator = iter(items)
+    while batch := list(islice(iterator, size)):
+        yield batch
+
+class IngestQueue:
+    """Queue of document ingestion jobs with progress records.
+
+    With a Redis client, job ids go through a Redis list and job records are
+    Redis hashes, so any process can enqueue, work or report status. Without
+    one, a local queue and dict stand in, visible to this process only.
+    Each process works at most `concurrency` jobs at a time.
+    """
+
+    def __init__(self, redis_client: Optional[redis.Redis] = None, concurrency: int = INGEST_CONCURRENCY):
+        self.redis_client = redis_client
+        self.concurrency = concurrency
+        self._queue: "queue.Queue[str]" = queue.Queue()
+        self._jobs: Dict[str, dict] = {}
+        self._latest: Dict[str, str] = {}
+        self._lock = threading.Lock()
+        self._workers: List[threading.Thread] = []
+
+    @staticmethod
+    def _job_key(job_id: str) -> str:
+        return f"ingest:job:{job_id}"
+
+    @staticmethod
+    def _document_key(doc_id: str) -> str:
+        return f"ingest:doc:{doc_id}"
+
+    @staticmethod
+    def _decode(fields: dict) -> dict:
+        job = dict(fields)
+        for name in INT_FIELDS:
+            if job.get(name) not in (None, ""):
+                job[name] = int(job[name])
+        for name in FLOAT_FIELDS:
+            if job.get(name) not in (None, ""):
+                job[name] = float(job[name])
+        job["force"] = job.get("force") in (True, "1")
+        return job
+
+    def get(self, job_id: str) -> Optional[dict]:
+        """The job record, or None if unknown or expired"""
+        if self.redis_client is None:
+            with self._lock:
+                job = self._jobs.get(job_id)
+                return dict(job) if job is not None else None
+        fields = self.redis_client.hgetall(self._job_key(job_id))
+        return self._decode(fields) if fields else None
+
+    def latest(self, doc_id: uuid.UUID) -> Optional[dict]:
+        """The most recent job for a document"""
+        if self.redis_client is None:
+            with self._lock:
+                job_id = self._latest.get(str(doc_id))
+        else:
+            job_id = self.redis_client.get(self._document_key(str(doc_id)))
+        return self.get(job_id) if job_id else None
+
+    @staticmethod
+    def is_active(job: dict) -> bool:
+        """Queued or running, and recently heard from"""
+        return job["status"] in ACTIVE_STATUSES and time.time() - job["updated_at"] < INGEST_STALE_SECONDS
+
+    def update(self, job_id: str, **fields) -> None:
+        fields["updated_at"] = time.time()
+        if self.redis_client is None:
+            with self._lock:
+                self._jobs[job_id].update(fields)
+            return
+        key = self._job_key(job_id)
+        pipe = self.redis_client.pipeline()
+        pipe.hset(key, mapping={name: int(value) if isinstance(value, bool) else value for name, value in fields.items()})
+        pipe.expire(key, INGEST_JOB_TTL)
+        pipe.execute()
+
+    def enqueue(self, doc_id: uuid.UUID, force: bool = False) -> dict:
+        """Record a queued job for the document and hand it to the workers"""
+        now = time.time()
+        job = {
+            "job_id": uuid.uuid4().hex,
+            "doc_id": str(doc_id),
+            "status": "queued",
+            "stage": "queued",
+            "progress": 0,
+            "pages_done": 0,
+            "pages_total": 0,
+            "chunks": 0,
+            "error": "",
+            "force": force,
+            "created_at": now,
+            "updated_at": now
+        }
+        if self.redis_client is None:
+            with self._lock:
+                self._jobs[job["job_id"]] = dict(job)
+                self._latest[job["doc_id"]] = job["job_id"]
+            self._queue.put(job["job_id"])
+        else:
+            key = self._job_key(job["job_id"])
+            pipe = self.redis_client.pipeline()
+            pipe.hset(key, mapping={**job, "force": int(force)})
+            pipe.expire(key, INGEST_JOB_TTL)
+            pipe.set(self._document_key(job["doc_id"]), job["job_id"], ex=INGEST_JOB_TTL)
+            pipe.lpush(QUEUE_KEY, job["job_id"])
+            pipe.execute()
+        logger.info(f"Queued ingestion job {job['job_id']} for document {doc_id}")
+        return job
+
+    def _next(self, timeout: float) -> Optional[str]:
+        if self.redis_client is None:
+            try:
+                return self._queue.get(timeout=timeout)
+            except queue.Empty:
+                return None
+        item = self.redis_client.brpop(QUEUE_KEY, timeout=max(1, int(timeout)))
+        return item[1] if item else None
+
+    def run(self, job_id: str) -> None:
+        """Work one job on a session of its own"""
+        job = self.get(job_id)
+        if job is None:
+            logger.warning(f"Ingestion job {job_id} expired before it ran")
+            return
+        doc_id = uuid.UUID(job["doc_id"])
+        self.update(job_id, status="processing", stage="extracting")
+        db = SessionLocal()
+        try:
+            chunks = ingest_document(db, doc_id, job["force"], lambda **fields: self.update(job_id, **fields))
+            self.update(job_id, status="completed", stage="completed", progress=100, chunks=chunks)
+        except Exception as e:
+            detail = e.detail if isinstance(e, IngestError) else f"Document parsing failed: {str(e)}"
+            logger.error(f"Ingestion job {job_id} for document {doc_id} failed: {detail}")
+            self.update(job_id, status="failed", error=detail)
+            self._settle_failed_document(db, doc_id)
+        finally:
+            db.close()
+
+    @staticmethod
+    def _settle_failed_document(db: Session, doc_id: uuid.UUID) -> None:
+        """A failed re-parse keeps the previous chunks, so only documents without any are marked failed"""
+        try:
+            document = db.query(Document).filter(Document.id == doc_id).first()
+            if document is not None:
+                has_chunks = db.query(DocumentChunk).filter(DocumentChunk.doc_id == doc_id).count() > 0
+                document.status = "parsed" if has_chunks else "failed"
+                db.commit()
+        except Exception as e:
+            db.rollback()
+            logger.error(f"Error recording failed ingestion of document {doc_id}: {str(e)}")
+
+    def _work(self) -> None:
+        while True:
+            try:
+                job_id = self._next(timeout=1.0)
+            except Exception as e:
+                logger.error(f"Error reading the ingestion queue: {str(e)}")
+                time.sleep(1.0)
+                continue
+            if job_id is not None:
+                self.run(job_id)
+
+    def start_workers(self) -> None:
+        """Start this process's worker threads once"""
+        with self._lock:
+            if self._workers:
+                return
+            for i in range(self.concurrency):
+                worker = threading.Thread(target=self._work, name=f"ingest-worker-{i}", daemon=True)
+                worker.start()
+                self._workers.append(worker)
+        logger.info(f"Started {self.concurrency} ingestion workers")
+
+def _queue_redis() -> Optional[redis.Redis]:
+    if INGEST_QUEUE_BACKEND != "redis":
+        return None
+    # No socket timeout: workers block on BRPOP
+    return redis.Redis.from_url(
+        os.getenv("REDIS_URL", "redis://localhost:6379"),
+        decode_responses=True,
+        socket_connect_timeout=0.5
+    )
+
+ingest_queue = IngestQueue(_queue_redis())
+
+def main():
+    parser = argparse.ArgumentParser(description="Run document ingestion workers")
+    parser.add_argument("--concurrency", type=int, default=INGEST_CONCURRENCY)
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO)
+    ingest_queue.concurrency = args.concurrency
+    ingest_queue.start_workers()
+    while True:
+        time.sleep(3600)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,319 @@
+import math
+import os
+import re
+import threading
+import time
+import uuid
+from array import array
+from collections import Counter
+from typing import Dict, List, Optional, Tuple
+import numpy as np
+import logging
+from sqlalchemy.orm import Session
+
+from app.db.database import SessionLocal
+from app.db.models import DocumentChunk
+from app.utils.corpus import get_corpus_version, get_corpus_changes
+from app.utils.vector_index import (
+    CATCH_UP_MAX_CHANGES,
+    COMPACTION_THRESHOLD,
+    LOAD_BATCH_SIZE,
+    VERSION_CHECK_INTERVAL,
+    top_k_indices,
+)
+
+logger = logging.getLogger(__name__)
+
+# BM25 term-frequency saturation and document-length normalisation
+BM25_K1 = float(os.getenv("BM25_K1", "1.2"))
+BM25_B = float(os.getenv("BM25_B", "0.75"))
+
+# Words and numbers, keeping joined identifiers such as "2:21-cv-01234" or "u.s.c" whole
+TOKEN_PATTERN = re.compile(r"\w+(?:[-.:/]\w+)*")
+MAX_TERM_FREQUENCY = 0xFFFF
+
+def tokenize(text: str) -> List[str]:
+    """Lowercased lexical terms of a text"""
+    return TOKEN_PATTERN.findall(text.lower())
+
+class _LexicalState:
+    """Postings and row metadata of the lexical index.
+
+    Each term maps to two parallel compact arrays: uint32 row numbers and
+    uint16 term frequencies. Rows are appended in order, so postings stay
+    sorted; deleted rows are only marked dead until the next compaction.
+    """
+
+    def __init__(self):
+        self.postings: Dict[str, Tuple[array, array]] = {}
+        self.lengths = array('I')
+        self.alive = bytearray()
+        self.chunk_ids: List[uuid.UUID] = []
+        self.doc_ids: List[uuid.UUID] = []
+        self.row_of: Dict[uuid.UUID, int] = {}
+        self.rows_by_doc: Dict[uuid.UUID, List[int]] = {}
+        self.live_length = 0
+        self.dead = 0
+
+    @property
+    def size(self) -> int:
+        return len(self.chunk_ids)
+
+    def append(self, chunk_id: uuid.UUID, doc_id: uuid.UUID, content: str) -> None:
+        row = self.size
+        terms = Counter(tokenize(content))
+        for term, frequency in terms.items():
+            rows, frequencies = self.postings.setdefault(term, (array('I'), array('H')))
+            rows.append(row)
+            frequencies.append(min(frequency, MAX_TERM_FREQUENCY))
+        length = sum(terms.values())
+        self.lengths.append(length)
+        self.alive.append(1)
+        self.chunk_ids.append(chunk_id)
+        self.doc_ids.append(doc_id)
+        self.row_of[chunk_id] = row
+        self.rows_by_doc.setdefault(doc_id, []).append(row)
+        self.live_length += length
+
+    def tombstone(self, rows: List[int]) -> None:
+        for row in rows:
+            self.alive[row] = 0
+            self.row_of.pop(self.chunk_ids[row], None)
+            self.live_length -= self.lengths[row]
+        self.rows_by_doc.pop(self.doc_ids[rows[0]], None)
+        self.dead += len(rows)
+
+    def compacted(self) -> "_LexicalState":
+        """Copy without dead rows, renumbering postings with one vectorised pass per term"""
+        alive = np.frombuffer(self.alive, dtype=np.uint8).astype(bool)
+        new_row = np.cumsum(alive, dtype=np.int64) - 1
+        state = _LexicalState()
+        for term, (rows, frequencies) in self.postings.items():
+            old_rows = np.frombuffer(rows, dtype=np.uint32)
+            keep = alive[old_rows]
+            if keep.any():
+                state.postings[term] = (
+                    array('I', new_row[old_rows[keep]].astype(np.uint32).tobytes()),
+                    array('H', np.frombuffer(frequencies, dtype=np.uint16)[keep].tobytes())
+                )
+        live_rows = np.flatnonzero(alive)
+        state.lengths = array('I', np.frombuffer(self.lengths, dtype=np.uint32)[live_rows].tobytes())
+        state.alive = bytearray(b'\x01' * len(live_rows))
+        for row in live_rows.tolist():
+            state.chunk_ids.append(self.chunk_ids[row])
+            state.doc_ids.append(self.doc_ids[row])
+        state.row_of = {chunk_id: row for row, chunk_id in enumerate(state.chunk_ids)}
+        for row, doc_id in enumerate(state.doc_ids):
+            state.rows_by_doc.setdefault(doc_id, []).append(row)
+        state.live_length = self.live_length
+        return state
+
+class LexicalIndex:
+    """Process-wide BM25 inverted index over chunk content.
+
+    Built from Postgres on first use, then kept current the same way as the
+    vector index: parsing appends and tombstones rows in place, and workers
+    that fall behind replay the corpus change log or reload. Searches and
+    writes share one lock; scoring touches only the postings of the query's
+    terms, so it is held for milliseconds.
+    """
+
+    def __init__(self, k1: float = BM25_K1, b: float = BM25_B):
+        self.k1 = k1
+        self.b = b
+        self._lock = threading.Lock()
+        self._load_lock = threading.Lock()
+        self._refreshing = False
+        self._loaded = False
+        self._state = _LexicalState()
+        # Corpus version the contents reflect; -1 until loaded
+        self.version = -1
+        self._version_checked_at = 0.0
+
+    @property
+    def loaded(self) -> bool:
+        return self._loaded
+
+    @property
+    def size(self) -> int:
+        """Number of live chunks"""
+        state = self._state
+        return state.size - state.dead
+
+    def build(self, chunk_ids: List[uuid.UUID], doc_ids: List[uuid.UUID], contents: List[str], version: int = 0) -> None:
+        """Replace index contents with the given chunks"""
+        state = _LexicalState()
+        for chunk_id, doc_id, content in zip(chunk_ids, doc_ids, contents):
+            state.append(chunk_id, doc_id, content)
+        with self._lock:
+            self._state = state
+            self.version = version
+            self._loaded = True
+        logger.info(f"Built lexical index with {state.size} chunks and {len(state.postings)} terms at corpus version {version}")
+
+    @staticmethod
+    def _fetch_contents(db: Session, *filters) -> Tuple[List[uuid.UUID], List[uuid.UUID], List[str]]:
+        rows = db.query(DocumentChunk.id, DocumentChunk.doc_id, DocumentChunk.content).filter(
+            *filters
+        ).yield_per(LOAD_BATCH_SIZE)
+        chunk_ids, doc_ids, contents = [], [], []
+        for chunk_id, doc_id, content in rows:
+            chunk_ids.append(chunk_id)
+            doc_ids.append(doc_id)
+            contents.append(content or "")
+        return chunk_ids, doc_ids, contents
+
+    def load(self, db: Session) -> None:
+        """Build the index from all chunks stored in the database"""
+        # Read the version first: rows committed meanwhile only make it look older
+        version = get_corpus_version(db)
+        chunk_ids, doc_ids, contents = self._fetch_contents(db)
+        self.build(chunk_ids, doc_ids, contents, version)
+
+    def catch_up(self, db: Session, target: int) -> bool:
+        """Replay logged corpus changes up to `target`; False if the log cannot bridge the gap"""
+        start = self.version
+        if not self._loaded or start < 0 or target < start:
+            return False
+        if target == start:
+            return True
+        if target - start > CATCH_UP_MAX_CHANGES:
+            return False
+
+        changes = get_corpus_changes(db, start, target)
+        if [version for version, _ in changes] != list(range(start + 1, target + 1)):
+            return False
+
+        for doc_id in dict.fromkeys(doc_id for _, doc_id in changes):
+            chunk_ids, _, contents = self._fetch_contents(db, DocumentChunk.doc_id == doc_id)
+            self.remove_document(doc_id)
+            self.add(chunk_ids, doc_id, contents)
+
+        with self._lock:
+            if self.version == start:
+                self.version = target
+        logger.info(f"Caught lexical index up from corpus version {start} to {target} ({len(changes)} changes)")
+        return True
+
+    def refresh(self, db: Session) -> None:
+        """Bring the index up to the database's corpus version"""
+        if not self.catch_up(db, get_corpus_version(db)):
+            self.load(db)
+
+    def ensure_loaded(self, db: Session) -> None:
+        """Load the index on first use, then periodically check it is current"""
+        if not self._loaded:
+            with self._load_lock:
+                if not self._loaded:
+                    self.load(db)
+            return
+
+        now = time.monotonic()
+        if now - self._version_checked_at < VERSION_CHECK_INTERVAL:
+            return
+        self._version_checked_at = now
+        if get_corpus_version(db) != self.version:
+            self._refresh_in_background()
+
+    def _refresh_in_background(self) -> None:
+        """Refresh a stale index while searches keep using the current contents"""
+        with self._lock:
+            if self._refreshing:
+                return
+            self._refreshing = True
+
+        def run():
+            db = SessionLocal()
+            try:
+                with self._load_lock:
+                    self.refresh(db)
+            except Exception as e:
+                logger.error(f"Lexical index refresh failed: {str(e)}")
+            finally:
+                db.close()
+                self._refreshing = False
+
+        threading.Thread(target=run, name="lexical-index-refresh", daemon=True).start()
+
+    def advance_version(self, version: int) -> None:
+        """Record that this process applied the change that produced `version`"""
+        with self._lock:
+            if self.version == version - 1:
+                self.version = version
+
+    def add(self, chunk_ids: List[uuid.UUID], doc_id: uuid.UUID, contents: List[str]) -> int:
+        """Index a document's new chunks; returns the number of rows added"""
+        if len(chunk_ids) != len(contents):
+            raise ValueError("chunk_ids and contents must have the same length")
+        with self._lock:
+            state = self._state
+            added = 0
+            for chunk_id, content in zip(chunk_ids, contents):
+                # The initial load may already have picked these rows up
+                if chunk_id not in state.row_of:
+                    state.append(chunk_id, doc_id, content)
+                    added += 1
+        return added
+
+    def remove_document(self, doc_id: uuid.UUID) -> int:
+        """Tombstone all chunks of a document; returns the number of rows removed"""
+        with self._lock:
+            state = self._state
+            rows = list(state.rows_by_doc.get(doc_id, []))
+            if not rows:
+                return 0
+            state.tombstone(rows)
+            if state.dead / state.size >= COMPACTION_THRESHOLD:
+                self._state = state.compacted()
+                logger.info(f"Compacted lexical index: {self._state.size} chunks remain")
+        return len(rows)
+
+    def _scores(self, state: _LexicalState, terms: List[str]) -> np.ndarray:
+        """BM25 score of every row; call with the lock held.
+
+        Buffer views of the postings must not outlive the lock, or the next
+        append could not grow the arrays, so they stay local to this call.
+        """
+        size = state.size
+        live = size - state.dead
+        average_length = state.live_length / live if live else 0.0
+        lengths = np.frombuffer(state.lengths, dtype=np.uint32)
+        row_parts, score_parts = [], []
+        for term in terms:
+            posting = state.postings.get(term)
+            if posting is None:
+                continue
+            rows = np.frombuffer(posting[0], dtype=np.uint32)
+            frequencies = np.frombuffer(posting[1], dtype=np.uint16).astype(np.float32)
+            # Document frequency counts tombstoned rows until the next compaction
+            idf = math.log(1.0 + (size - len(rows) + 0.5) / (len(rows) + 0.5))
+            norm = self.k1 * (1.0 - self.b + self.b * lengths[rows] / max(average_length, 1e-9))
+            row_parts.append(rows)
+            score_parts.append(idf * frequencies * (self.k1 + 1.0) / (frequencies + norm))
+        if not row_parts:
+            return np.zeros(0, dtype=np.float64)
+        scores = np.bincount(np.concatenate(row_parts), weights=np.concatenate(score_parts), minlength=size)
+        scores[np.frombuffer(state.alive, dtype=np.uint8) == 0] = 0.0
+        return scores
+
+    def search(self, query: str, k: int, doc_ids: Optional[List[uuid.UUID]] = None) -> List[Tuple[uuid.UUID, float]]:
+        """Return up to k (chunk_id, BM25 score) pairs for chunks sharing a term with the query, best first.
+
+        doc_ids restricts the results to those documents' chunks.
+        """
+        terms = list(dict.fromkeys(tokenize(query)))
+        with self._lock:
+            state = self._state
+            scores = self._scores(state, terms)
+            matched = np.flatnonzero(scores > 0)
+            if doc_ids is not None and matched.size:
+                allowed = [row for doc_id in doc_ids for row in state.rows_by_doc.get(doc_id, ())]
+                matched = matched[np.isin(matched, allowed)]
+            best = matched[top_k_indices(scores[matched], k)]
+            return [(state.chunk_ids[row], float(scores[row])) for row in best]
+
+_lexical_index = LexicalIndex()
+
+def get_lexical_index() -> LexicalIndex:
+    """Get the process-wide lexical index"""
+    return _lexical_index
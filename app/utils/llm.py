@@ -1,7 +1,9 @@
+import math
 import os
 import time
-from typing import Dict, Any
-from openai import OpenAI
+from functools import lru_cache
+from typing import Dict, Any, AsyncIterator
+from openai import OpenAI, AsyncOpenAI
 from fastapi import HTTPException
 import logging
 from dotenv import load_dotenv
@@ -28,6 +30,42 @@ def get_openai_config() -> Dict[str, Any]:
         "price_out": float(os.getenv("OPENAI_PRICE_OUT", DEFAULT_PRICE_OUT))
     }
 
+@lru_cache(maxsize=4)
+def get_async_client(api_key: str) -> AsyncOpenAI:
+    """Shared async client per API key so concurrent requests reuse one connection pool"""
+    return AsyncOpenAI(api_key=api_key)
+
+def _completion_messages(prompt: str) -> list:
+    return [
+        {"role": "user", "content": prompt}
+    ]
+
+def _completion_result(response, model: str, config: Dict[str, Any], start_time: float) -> Dict[str, Any]:
+    """Turn a chat completion into the answer dict with cost and latency"""
+    # Calculate metrics
+    latency_ms = (time.time() - start_time) * 1000
+    tokens_in = response.usage.prompt_tokens
+    tokens_out = response.usage.completion_tokens
+    
+    # Calculate cost
+    cost_usd = _usage_cost(tokens_in, tokens_out, config)
+    
+    result = {
+        "text": response.choices[0].message.content,
+        "tokens_in": tokens_in,
+        "tokens_out": tokens_out,
+        "cost_usd": round(cost_usd, 6),
+        "latency_ms": round(latency_ms, 2),
+        "model": model,
+        "provider": "openai"
+    }
+    
+    logger.info(f"LLM completion: {tokens_in}+{tokens_out} tokens, ${cost_usd:.6f}, {latency_ms:.2f}ms")
+    return result
+
+def _usage_cost(tokens_in: int, tokens_out: int, config: Dict[str, Any]) -> float:
+    return (tokens_in * config["price_in"] / 1000) + (tokens_out * config["price_out"] / 1000)
+
 def chat_complete(prompt: str, model: str = None) -> Dict[str, Any]:
     """Complete chat using OpenAI API with cost and latency tracking"""
     start_time = time.time()
@@ -42,37 +80,124 @@ def chat_complete(prompt: str, model: str = None) -> Dict[str, Any]:
         # Make API call
         response = client.chat.completions.create(
             model=model_to_use,
-            messages=[
-                {"role": "user", "content": prompt}
-            ],
+            messages=_completion_messages(prompt),
             temperature=0.1,  # Low temperature for consistent legal answers
             max_tokens=1000
         )
         
-        # Calculate metrics
-        latency_ms = (time.time() - start_time) * 1000
-        tokens_in = response.usage.prompt_tokens
-        tokens_out = response.usage.completion_tokens
+        return _completion_result(response, model_to_use, config, start_time)
         
-        # Calculate cost
-        cost_usd = (tokens_in * config["price_in"] / 1000) + (tokens_out * config["price_out"] / 1000)
+    except HTTPException:
+        # Re-raise HTTP exceptions
+        raise
+    except Exception as e:
+        logger.error(f"Error in chat_complete: {str(e)}")
+        raise HTTPException(status_code=503, detail=f"LLM service error: {str(e)}")
+
+async def chat_complete_async(prompt: str, model: str = None) -> Dict[str, Any]:
+    """Async chat_complete that does not block the event loop while the LLM responds"""
+    start_time = time.time()
+    
+    try:
+        config = get_openai_config()
+        client = get_async_client(config["api_key"])
+        
+        # Use provided model or default
+        model_to_use = model or config["model"]
         
-        result = {
-            "text": response.choices[0].message.content,
-            "tokens_in": tokens_in,
-            "tokens_out": tokens_out,
-            "cost_usd": round(cost_usd, 6),
-            "latency_ms": round(latency_ms, 2),
-            "model": model_to_use,
-            "provider": "openai"
-        }
+        response = await client.chat.completions.create(
+            model=model_to_use,
+            messages=_completion_messages(prompt),
+            temperature=0.1,  # Low temperature for consistent legal answers
+            max_tokens=1000
+        )
         
-        logger.info(f"LLM completion: {tokens_in}+{tokens_out} tokens, ${cost_usd:.6f}, {latency_ms:.2f}ms")
-        return result
+        return _completion_result(response, model_to_use, config, start_time)
         
     except HTTPException:
         # Re-raise HTTP exceptions
         raise
     except Exception as e:
-        logger.error(f"Error in chat_complete: {str(e)}")
-        raise HTTPException(status_code=503, detail=f"LLM service error: {str(e)}")
\ No newline at end of file
+        logger.error(f"Error in chat_complete_async: {str(e)}")
+        raise HTTPException(status_code=503, detail=f"LLM service error: {str(e)}")
+
+def _estimate_tokens(text: str) -> int:
+    # Approximately 4 characters per token, used when the API reports no usage
+    return math.ceil(len(text) / 4)
+
+def _stream_usage(chunk):
+    usage = getattr(chunk, "usage", None)
+    if isinstance(usage, dict):
+        return usage.get("prompt_tokens"), usage.get("completion_tokens")
+    if usage is not None:
+        return getattr(usage, "prompt_tokens", None), getattr(usage, "completion_tokens", None)
+    return None, None
+
+async def chat_stream_async(prompt: str, model: str = None) -> AsyncIterator[Dict[str, Any]]:
+    """Stream a chat completion.
+
+    Yields {"type": "token", "text": ...} per content delta, then one
+    {"type": "done", ...} dict shaped like chat_complete's result plus
+    first_token_ms. Usage comes from the API's final usage chunk when it sends
+    one and is estimated from text length otherwise.
+    """
+    start_time = time.time()
+    
+    try:
+        config = get_openai_config()
+        client = get_async_client(config["api_key"])
+        
+        # Use provided model or default
+        model_to_use = model or config["model"]
+        
+        stream = await client.chat.completions.create(
+            model=model_to_use,
+            messages=_completion_messages(prompt),
+            temperature=0.1,  # Low temperature for consistent legal answers
+            max_tokens=1000,
+            stream=True,
+            # Not a named parameter in this client version; asks for a final usage chunk
+            extra_body={"stream_options": {"include_usage": True}}
+        )
+    except HTTPException:
+        # Re-raise HTTP exceptions
+        raise
+    except Exception as e:
+        logger.error(f"Error in chat_stream_async: {str(e)}")
+        raise HTTPException(status_code=503, detail=f"LLM service error: {str(e)}")
+    
+    parts = []
+    first_token_ms = None
+    tokens_in = tokens_out = None
+    async for chunk in stream:
+        reported_in, reported_out = _stream_usage(chunk)
+        if reported_in is not None:
+            tokens_in, tokens_out = reported_in, reported_out
+        if not chunk.choices:
+            continue
+        text = chunk.choices[0].delta.content
+        if text:
+            if first_token_ms is None:
+                first_token_ms = round((time.time() - start_time) * 1000, 2)
+            parts.append(text)
+            yield {"type": "token", "text": text}
+    
+    answer = "".join(parts)
+    if tokens_in is None:
+        tokens_in = _estimate_tokens(prompt)
+        tokens_out = _estimate_tokens(answer)
+    
+    latency_ms = (time.time() - start_time) * 1000
+    cost_usd = _usage_cost(tokens_in, tokens_out, config)
+    logger.info(f"LLM stream: {tokens_in}+{tokens_out} tokens, ${cost_usd:.6f}, first token {first_token_ms}ms, total {latency_ms:.2f}ms")
+    yield {
+        "type": "done",
+        "text": answer,
+        "tokens_in": tokens_in,
+        "tokens_out": tokens_out,
+        "cost_usd": round(cost_usd, 6),
+        "latency_ms": round(latency_ms, 2),
+        "first_token_ms": first_token_ms,
+        "model": model_to_use,
+        "provider": "openai"
+    }
@@ -0,0 +1,47 @@
+import uuid
+from typing import List, Optional
+from sqlalchemy.orm import Session
+import logging
+
+from app.db.models import Document
+from app.models.search import SearchFilters
+
+logger = logging.getLogger(__name__)
+
+def filters_key(filters: Optional[SearchFilters]) -> str:
+    """Canonical text of the filters for cache keys; empty when nothing is restricted"""
+    if filters is None:
+        return ""
+    fields = filters.model_dump(exclude_none=True, mode="json")
+    if "doc_ids" in fields:
+        fields["doc_ids"] = sorted(fields["doc_ids"])
+    return repr(sorted(fields.items())) if fields else ""
+
+def filter_document_ids(db: Session, filters: Optional[SearchFilters]) -> Optional[List[uuid.UUID]]:
+    """Ids of the documents matching every filter, or None when no filter is set.
+
+    Resolved against the indexed document columns, so the vector index only
+    has to scan the rows of the matching documents.
+    """
+    if not filters_key(filters):
+        return None
+
+    conditions = []
+    if filters.doc_ids is not None:
+        conditions.append(Document.id.in_(filters.doc_ids))
+    if filters.owner_id is not None:
+        conditions.append(Document.user_id == filters.owner_id)
+    if filters.court is not None:
+        conditions.append(Document.court == filters.court)
+    if filters.year_from is not None:
+        conditions.append(Document.decision_year >= filters.year_from)
+    if filters.year_to is not None:
+        conditions.append(Document.decision_year <= filters.year_to)
+    if filters.uploaded_after is not None:
+        conditions.append(Document.upload_time >= filters.uploaded_after)
+    if filters.uploaded_before is not None:
+        conditions.append(Document.upload_time < filters.uploaded_before)
+
+    doc_ids = [row.id for row in db.query(Document.id).filter(*conditions).all()]
+    logger.info(f"Filters matched {len(doc_ids)} documents")
+    return doc_ids
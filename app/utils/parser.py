@@ -1,87 +1,338 @@
 import fitz  # PyMuPDF
+import multiprocessing
+import os
 import re
-from typing import List
+import threading
+from bisect import bisect_left
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from typing import Callable, Iterable, Iterator, List, Optional, Tuple
 from pathlib import Path
 import logging
 
+from app.utils.tokenizer import Tokenizer
+
 logger = logging.getLogger(__name__)
 
+# Documents with at least this many pages are extracted by a process pool
+PARALLEL_EXTRACTION_MIN_PAGES = int(os.getenv("PARALLEL_EXTRACTION_MIN_PAGES", "200"))
+# Extraction processes; below 2 every document is extracted serially
+PARALLEL_EXTRACTION_WORKERS = int(os.getenv("PARALLEL_EXTRACTION_WORKERS", str(os.cpu_count() or 1)))
+# Page ranges handed out per worker; more ranges balance uneven pages and report progress more often
+PARALLEL_EXTRACTION_RANGES_PER_WORKER = 4
+
+_extraction_pool: Optional[ProcessPoolExecutor] = None
+_extraction_pool_lock = threading.Lock()
+
+# Compiled once; the streaming cleaner applies them page by page
+WHITESPACE_RUN = re.compile(r'\s+')
+PAGE_NUMBER_LINE = re.compile(r'^\d+\s*$', re.MULTILINE)
+DIGITS = re.compile(r'\d+')
+
 def clean_text(text: str) -> str:
     """Clean extracted text by removing extra whitespace and normalizing"""
     # Remove excessive whitespace
-    text = re.sub(r'\s+', ' ', text)
+    text = WHITESPACE_RUN.sub(' ', text)
     # Remove page numbers and headers
-    text = re.sub(r'^\d+\s*$', '', text, flags=re.MULTILINE)
+    text = PAGE_NUMBER_LINE.sub('', text)
     # Strip leading/trailing whitespace
     text = text.strip()
     return text
 
-def create_chunks(text: str, chunk_size: int = 600, overlap: int = 100) -> List[str]:
-    """Split text into overlapping chunks of specified size"""
-    if len(text) <= chunk_size:
-        return [text] if text.strip() else []
+def iter_clean_text(pieces: Iterable[str]) -> Iterator[str]:
+    """Clean text arriving in pieces; the output joins to clean_text of the joined input.
+
+    Whitespace runs spanning pieces collapse to one space and the ends are
+    stripped. Text made of nothing but one number is dropped as a page
+    number, so output is held back until something else shows up.
+    """
+    started = False
+    pending_space = False
+    # Whether the text so far could still be one bare number, and the output withheld meanwhile
+    candidate_number = None
+    held: List[str] = []
+    for piece in pieces:
+        piece = WHITESPACE_RUN.sub(' ', piece)
+        if not piece:
+            continue
+        if candidate_number is None:
+            candidate_number = piece[0] != ' '
+        if piece[0] == ' ':
+            pending_space = started
+            piece = piece[1:]
+            if not piece:
+                continue
+        trailing_space = piece[-1] == ' '
+        if trailing_space:
+            piece = piece[:-1]
+        out = ' ' + piece if pending_space else piece
+        started = True
+        pending_space = trailing_space
+        
+        if candidate_number:
+            if DIGITS.fullmatch(out):
+                held.append(out)
+                continue
+            candidate_number = False
+            out = ''.join(held) + out
+        yield out
+
+def chunk_end(text: str, start: int, chunk_size: int) -> int:
+    """End of the chunk starting at start, pulled back to a sentence boundary when one is near"""
+    end = start + chunk_size
     
-    chunks = []
+    # Try to break at sentence boundaries
+    if end < len(text):
+        # Look for sentence endings within the last 100 characters
+        search_start = max(start + chunk_size - 100, start)
+        sentence_end = text.rfind('.', search_start, end)
+        if sentence_end > start + chunk_size // 2:  # Only break if we find a reasonable sentence boundary
+            end = sentence_end + 1
+    return end
+
+def iter_chunks(
+    pieces: Iterable[str],
+    chunk_size: int = 600,
+    overlap: int = 100,
+    tokenizer: Optional[Tokenizer] = None
+) -> Iterator[str]:
+    """Split text arriving in pieces into overlapping chunks, yielding each as soon as it is final.
+
+    Only the unchunked tail of the text is buffered. The chunks are those
+    create_chunks makes from the joined pieces. With a tokenizer, chunk_size
+    and overlap count tokens instead of characters.
+    """
+    if tokenizer is not None:
+        yield from iter_token_chunks(pieces, chunk_size, overlap, tokenizer)
+        return
+    
+    buffer = ""
     start = 0
+    emitted = False
+    for piece in pieces:
+        buffer = buffer[start:] + piece
+        start = 0
+        # Text past the window proves the chunk is not the last, as create_chunks checks
+        while len(buffer) - start > chunk_size:
+            end = chunk_end(buffer, start, chunk_size)
+            chunk = buffer[start:end].strip()
+            if chunk:
+                yield chunk
+            emitted = True
+            # Move start position with overlap
+            start = end - overlap
     
-    while start < len(text):
-        end = start + chunk_size
-        
-        # Try to break at sentence boundaries
-        if end < len(text):
-            # Look for sentence endings within the last 100 characters
-            search_start = max(start + chunk_size - 100, start)
-            sentence_end = text.rfind('.', search_start, end)
-            if sentence_end > start + chunk_size // 2:  # Only break if we find a reasonable sentence boundary
-                end = sentence_end + 1
-        
-        chunk = text[start:end].strip()
+    if not emitted:
+        # Text no longer than one chunk is kept whole
+        if buffer.strip():
+            yield buffer
+        return
+    
+    while start < len(buffer):
+        end = chunk_end(buffer, start, chunk_size)
+        chunk = buffer[start:end].strip()
         if chunk:
-            chunks.append(chunk)
-        
-        # Move start position with overlap
+            yield chunk
         start = end - overlap
-        if start >= len(text):
-            break
+
+def token_chunk_end(text: str, offsets: List[int], first: int, chunk_size: int, overlap: int) -> Tuple[int, int]:
+    """End character of the chunk starting at token first, and the token the next chunk starts at.
+
+    As with characters, the chunk is pulled back to a sentence end found in
+    the last sixth of the window, if that keeps it over half full.
+    """
+    end = first + chunk_size
+    if end >= len(offsets):
+        return len(text), max(end - overlap, first + 1)
+    end_char = offsets[end]
+    search_start = offsets[first + chunk_size - chunk_size // 6]
+    sentence_end = text.rfind('.', search_start, end_char)
+    if sentence_end > offsets[first + chunk_size // 2]:
+        end_char = sentence_end + 1
+        end = bisect_left(offsets, end_char)
+    return end_char, max(end - overlap, first + 1)
+
+def iter_token_chunks(pieces: Iterable[str], chunk_size: int, overlap: int, tokenizer: Tokenizer) -> Iterator[str]:
+    """iter_chunks measured in tokens; each arriving piece is tokenized once with the buffered tail"""
+    buffer = ""
+    start = 0
+    emitted = False
+    for piece in pieces:
+        buffer = buffer[start:] + piece
+        offsets = tokenizer.token_offsets(buffer)
+        first = 0
+        # The last token may still grow with the next piece, so a chunk needs one token past it
+        while len(offsets) - first > chunk_size + 1:
+            end_char, first_next = token_chunk_end(buffer, offsets, first, chunk_size, overlap)
+            chunk = buffer[offsets[first]:end_char].strip()
+            if chunk:
+                yield chunk
+            emitted = True
+            first = first_next
+        start = offsets[first] if first < len(offsets) else len(buffer)
+    
+    buffer = buffer[start:]
+    offsets = tokenizer.token_offsets(buffer)
+    if not emitted and len(offsets) <= chunk_size:
+        # Text no longer than one chunk is kept whole
+        if buffer.strip():
+            yield buffer
+        return
     
-    return chunks
+    first = 0
+    while first < len(offsets):
+        end_char, first_next = token_chunk_end(buffer, offsets, first, chunk_size, overlap)
+        chunk = buffer[offsets[first]:end_char].strip()
+        if chunk:
+            yield chunk
+        first = first_next
+
+def create_chunks(
+    text: str,
+    chunk_size: int = 600,
+    overlap: int = 100,
+    tokenizer: Optional[Tokenizer] = None
+) -> List[str]:
+    """Split text into overlapping chunks of specified size, in tokens when a tokenizer is given"""
+    return list(iter_chunks([text], chunk_size, overlap, tokenizer))
+
+def get_extraction_pool() -> ProcessPoolExecutor:
+    """Process-wide extraction pool, started on first use.
 
-def extract_chunks_from_pdf(pdf_path: str, chunk_size: int = 600, overlap: int = 100) -> List[str]:
-    """Extract text from PDF and split into chunks"""
+    Spawned rather than forked: callers run on threads of the API and
+    ingestion workers, and forking a threaded process is unsafe.
+    """
+    global _extraction_pool
+    with _extraction_pool_lock:
+        if _extraction_pool is None:
+            _extraction_pool = ProcessPoolExecutor(
+                max_workers=PARALLEL_EXTRACTION_WORKERS,
+                mp_context=multiprocessing.get_context("spawn")
+            )
+        return _extraction_pool
+
+def _reset_extraction_pool() -> None:
+    global _extraction_pool
+    with _extraction_pool_lock:
+        if _extraction_pool is not None:
+            _extraction_pool.shutdown(wait=False, cancel_futures=True)
+        _extraction_pool = None
+
+def page_ranges(page_count: int, parts: int) -> List[range]:
+    """Split pages into at most `parts` contiguous ranges of near-equal size"""
+    parts = max(1, min(parts, page_count))
+    step, extra = divmod(page_count, parts)
+    ranges, start = [], 0
+    for i in range(parts):
+        stop = start + step + (1 if i < extra else 0)
+        ranges.append(range(start, stop))
+        start = stop
+    return ranges
+
+def extract_page_range(pdf_path: str, start: int, stop: int) -> List[str]:
+    """Text of pages [start, stop), read through a document handle of this process's own"""
+    with fitz.open(pdf_path) as doc:
+        return [doc.load_page(page_num).get_text() for page_num in range(start, stop)]
+
+def iter_pages_parallel(
+    pdf_path: str,
+    page_count: int,
+    on_page: Optional[Callable[[int, int], None]] = None
+) -> Iterator[str]:
+    """Page texts in page order, extracted by the process pool.
+
+    Only a window of ranges is in flight, so a slow consumer holds a bounded
+    amount of extracted text rather than the whole document.
+    """
+    ranges = page_ranges(page_count, PARALLEL_EXTRACTION_WORKERS * PARALLEL_EXTRACTION_RANGES_PER_WORKER)
+    pool = get_extraction_pool()
+    window = 2 * PARALLEL_EXTRACTION_WORKERS
+    in_flight = deque()
+    next_range = 0
+    try:
+        while next_range < len(ranges) or in_flight:
+            while next_range < len(ranges) and len(in_flight) < window:
+                pages = ranges[next_range]
+                in_flight.append((
+                    pages,
+                    pool.submit(extract_page_range, pdf_path, pages.start, pages.stop)
+                ))
+                next_range += 1
+            pages, future = in_flight.popleft()
+            texts = future.result()
+            if on_page is not None:
+                on_page(pages.stop, page_count)
+            yield from texts
+    finally:
+        for _, future in in_flight:
+            future.cancel()
+
+def iter_page_texts(doc, pdf_path: str, on_page: Optional[Callable[[int, int], None]] = None) -> Iterator[str]:
+    """Text of each page in order, from the process pool for long documents"""
+    next_page = 0
+    if doc.page_count >= PARALLEL_EXTRACTION_MIN_PAGES and PARALLEL_EXTRACTION_WORKERS > 1:
+        try:
+            for text in iter_pages_parallel(pdf_path, doc.page_count, on_page):
+                next_page += 1
+                yield text
+        except BrokenProcessPool as e:
+            # Carry on serially from the first page not yet handed out
+            logger.warning(f"Extraction pool failed, extracting {pdf_path} serially from page {next_page + 1}: {str(e)}")
+            _reset_extraction_pool()
+    
+    for page_num in range(next_page, doc.page_count):
+        page = doc.load_page(page_num)
+        yield page.get_text()
+        if on_page is not None:
+            on_page(page_num + 1, doc.page_count)
+
+def iter_chunks_from_pdf(
+    pdf_path: str,
+    chunk_size: int = 600,
+    overlap: int = 100,
+    on_page: Optional[Callable[[int, int], None]] = None,
+    tokenizer: Optional[Tokenizer] = None
+) -> Iterator[str]:
+    """Yield a PDF's chunks while its pages are still being read.
+
+    Pages stream through the cleaner into the chunker, so memory holds a
+    page or so of text however long the document. Pages are joined with a
+    space, as in extract_chunks_from_pdf, so chunks still break at sentences
+    that run across page boundaries.
+    """
+    pdf_path = Path(pdf_path)
+    if not pdf_path.exists():
+        raise FileNotFoundError(f"PDF file not found: {pdf_path}")
+    
+    # Open PDF with PyMuPDF
+    doc = fitz.open(pdf_path)
     try:
-        pdf_path = Path(pdf_path)
-        if not pdf_path.exists():
-            raise FileNotFoundError(f"PDF file not found: {pdf_path}")
-        
-        # Open PDF with PyMuPDF
-        doc = fitz.open(pdf_path)
-        
         if doc.page_count == 0:
             logger.warning(f"PDF has no pages: {pdf_path}")
-            return []
-        
-        # Extract text from all pages
-        full_text = ""
-        for page_num in range(doc.page_count):
-            page = doc.load_page(page_num)
-            text = page.get_text()
-            full_text += text + " "
-        
+            return
+        pages = (text + " " for text in iter_page_texts(doc, str(pdf_path), on_page))
+        yield from iter_chunks(iter_clean_text(pages), chunk_size, overlap, tokenizer)
+    finally:
         doc.close()
-        
-        # Clean the extracted text
-        cleaned_text = clean_text(full_text)
-        
-        if not cleaned_text:
+
+def extract_chunks_from_pdf(
+    pdf_path: str,
+    chunk_size: int = 600,
+    overlap: int = 100,
+    on_page: Optional[Callable[[int, int], None]] = None,
+    tokenizer: Optional[Tokenizer] = None
+) -> List[str]:
+    """Extract text from PDF and split into chunks; on_page(pages_done, page_count) reports progress"""
+    try:
+        chunks = list(iter_chunks_from_pdf(pdf_path, chunk_size, overlap, on_page, tokenizer))
+        if not chunks:
             logger.warning(f"No text extracted from PDF: {pdf_path}")
             return []
         
-        # Create chunks
-        chunks = create_chunks(cleaned_text, chunk_size, overlap)
-        
         logger.info(f"Extracted {len(chunks)} chunks from {pdf_path}")
         return chunks
         
     except Exception as e:
         logger.error(f"Error extracting chunks from PDF {pdf_path}: {str(e)}")
-        raise
\ No newline at end of file
+        raise
@@ -1,103 +1,435 @@
-import math
-from typing import List
+import hashlib
+import os
+import threading
+import uuid
+from collections import OrderedDict
+from typing import Dict, List, Optional, Tuple
+import numpy as np
 from sqlalchemy.orm import Session
 from sqlalchemy import text
+from fastapi.concurrency import run_in_threadpool
 import logging
 
 from app.models.rag import RetrievalItem
 from app.db.models import DocumentChunk
-from app.utils.embedding import embed_chunks, cosine_similarity
+from app.utils.embedding import embed_queries, embed_queries_async
+from app.utils.vector_index import VectorIndex, get_vector_index
+from app.utils.shards import Partial, is_partial
+from app.utils.tenant_index import owner_scope, tenant_indexes
+from app.utils.lexical_index import get_lexical_index
+from app.utils.metadata_filter import filter_document_ids, filters_key
+from app.utils.tokenizer import get_tokenizer
+from app.models.search import SearchFilters
 
 logger = logging.getLogger(__name__)
 
-def retrieve_topk(query: str, k: int, db: Session) -> List[RetrievalItem]:
-    """Retrieve top-k chunks for a query using vector similarity"""
+# "vector" scores every chunk by embedding; "hybrid" fuses BM25 and vector rankings;
+# "prefilter" vector-scores only the chunks BM25 matched
+RETRIEVAL_MODES = ("vector", "hybrid", "prefilter")
+RETRIEVAL_MODE = os.getenv("RETRIEVAL_MODE", "vector")
+# Reciprocal rank fusion constant; larger values flatten the weight of top ranks
+HYBRID_RRF_K = int(os.getenv("HYBRID_RRF_K", "60"))
+# Depth of each ranking fed into fusion
+HYBRID_CANDIDATES = int(os.getenv("HYBRID_CANDIDATES", "50"))
+# Lexical hits whose vectors are scored in prefilter mode
+PREFILTER_CANDIDATES = int(os.getenv("LEXICAL_PREFILTER_CANDIDATES", "1000"))
+
+# Ranked hits remembered per worker, for the corpus version its index reflects
+RETRIEVAL_CACHE_SIZE = int(os.getenv("RETRIEVAL_CACHE_SIZE", "2048"))
+
+Hits = List[Tuple[uuid.UUID, float]]
+
+class RetrievalCache:
+    """Bounded LRU of ranked (chunk id, score) hits per query embedding and search parameters.
+
+    Entries belong to the corpus version the index reflected when they were
+    computed. The first lookup or store at a newer version drops them all, so
+    answers that differ only in model or context budget reuse the ranking
+    until the corpus changes, without a TTL.
+    """
+
+    def __init__(self, max_size: int):
+        self.max_size = max_size
+        self.version = -1
+        self._entries: "OrderedDict[str, Hits]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.stats = {"hits": 0, "misses": 0}
+
+    @staticmethod
+    def key(
+        query_embedding: List[float],
+        k: int,
+        nprobe: Optional[int],
+        ef_search: Optional[int],
+        mode: str = "vector",
+        filters: str = ""
+    ) -> str:
+        digest = hashlib.sha256(np.asarray(query_embedding, dtype='<f4').tobytes())
+        digest.update(f"{k}:{nprobe}:{ef_search}:{mode}:{filters}".encode())
+        return digest.hexdigest()
+
+    def _advance(self, version: int) -> None:
+        if version > self.version:
+            self._entries.clear()
+            self.version = version
+
+    def get(self, key: str, version: int) -> Optional[Hits]:
+        with self._lock:
+            self._advance(version)
+            hits = self._entries.get(key) if version == self.version else None
+            if hits is None:
+                self.stats["misses"] += 1
+                return None
+            self._entries.move_to_end(key)
+            self.stats["hits"] += 1
+            return hits
+
+    def put(self, key: str, version: int, hits: Hits) -> None:
+        with self._lock:
+            self._advance(version)
+            # Results from an index that has since moved on are not worth keeping
+            if version != self.version:
+                return
+            self._entries[key] = hits
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+
+    def clear(self) -> None:
+        """Drop every cached ranking"""
+        with self._lock:
+            self._entries.clear()
+            self.version = -1
+
+retrieval_cache = RetrievalCache(RETRIEVAL_CACHE_SIZE)
+
+def retrieval_cache_stats() -> Dict[str, float]:
+    """Hit counters and hit rate of this worker's retrieval cache"""
+    with retrieval_cache._lock:
+        stats = dict(retrieval_cache.stats)
+        stats["entries"] = len(retrieval_cache._entries)
+        stats["corpus_version"] = retrieval_cache.version
+    total = stats["hits"] + stats["misses"]
+    stats["hit_rate"] = stats["hits"] / total if total else 0.0
+    return stats
+
+def fuse_rankings(rankings: List[Hits], k: int, rrf_k: int = HYBRID_RRF_K) -> Hits:
+    """Reciprocal rank fusion: each chunk scores the sum of 1 / (rrf_k + rank) over the rankings"""
+    fused: Dict[uuid.UUID, float] = {}
+    for hits in rankings:
+        for rank, (chunk_id, _) in enumerate(hits, 1):
+            fused[chunk_id] = fused.get(chunk_id, 0.0) + 1.0 / (rrf_k + rank)
+    return sorted(fused.items(), key=lambda hit: hit[1], reverse=True)[:k]
+
+def search_index(
+    index: VectorIndex,
+    query_embeddings: List[List[float]],
+    k: int,
+    nprobe: Optional[int] = None,
+    ef_search: Optional[int] = None,
+    queries: Optional[List[str]] = None,
+    mode: str = "vector",
+    doc_ids: Optional[List[uuid.UUID]] = None
+) -> List[Hits]:
+    """Rank chunks for each query in the given retrieval mode; lexical modes need the query texts.
+
+    doc_ids, typically from filter_document_ids, restricts every mode to those documents' chunks.
+    """
+    def vector_search(embeddings: List[List[float]], depth: int) -> List[Hits]:
+        if doc_ids is not None:
+            return index.search_documents(embeddings, doc_ids, depth, nprobe=nprobe, ef_search=ef_search)
+        if len(embeddings) == 1:
+            return [index.search(embeddings[0], depth, nprobe=nprobe, ef_search=ef_search)]
+        return index.search_batch(embeddings, depth, nprobe=nprobe, ef_search=ef_search)
+
+    if mode == "vector" or queries is None:
+        return vector_search(query_embeddings, k)
+
+    lexical = get_lexical_index()
+    if mode == "hybrid":
+        depth = max(k, HYBRID_CANDIDATES)
+        fused = []
+        for query, hits in zip(queries, vector_search(query_embeddings, depth)):
+            ranking = fuse_rankings([hits, lexical.search(query, depth, doc_ids)], k)
+            fused.append(Partial(ranking) if is_partial(hits) else ranking)
+        return fused
+
+    results = []
+    for query, query_embedding in zip(queries, query_embeddings):
+        candidates = lexical.search(query, PREFILTER_CANDIDATES, doc_ids)
+        if candidates:
+            results.append(index.search_candidates(query_embedding, [chunk_id for chunk_id, _ in candidates], k))
+        else:
+            # Nothing matched lexically, e.g. a purely conceptual question
+            results.append(vector_search([query_embedding], k)[0])
+    return results
+
+def search_cached(
+    index: VectorIndex,
+    query_embeddings: List[List[float]],
+    k: int,
+    nprobe: Optional[int] = None,
+    ef_search: Optional[int] = None,
+    queries: Optional[List[str]] = None,
+    mode: str = "vector",
+    filters: Optional[SearchFilters] = None,
+    doc_ids: Optional[List[uuid.UUID]] = None
+) -> List[Hits]:
+    """search_index for only those queries whose ranking is not cached at the index's current version.
+
+    filters identifies the restriction in cache keys; doc_ids is what it resolved to.
+    """
+    if queries is None:
+        mode = "vector"
+    # Read the version before searching: a concurrent refresh only makes entries look older
+    version = index.version
+    restriction = filters_key(filters)
+    keys = [RetrievalCache.key(embedding, k, nprobe, ef_search, mode, restriction) for embedding in query_embeddings]
+    hits_per_query = [retrieval_cache.get(key, version) for key in keys]
+    missing = [i for i, hits in enumerate(hits_per_query) if hits is None]
+    if missing:
+        searched = search_index(
+            index,
+            [query_embeddings[i] for i in missing],
+            k,
+            nprobe,
+            ef_search,
+            [queries[i] for i in missing] if queries is not None else None,
+            mode,
+            doc_ids
+        )
+        for i, hits in zip(missing, searched):
+            hits_per_query[i] = hits
+            # A later search may reach the shards this one missed
+            if not is_partial(hits):
+                retrieval_cache.put(keys[i], version, hits)
+    return hits_per_query
+
+def search_target(db: Session, filters: Optional[SearchFilters] = None) -> VectorIndex:
+    """The loaded index to search: the owner's own when the filters name one, else the shared index"""
+    owner_id = owner_scope(filters)
+    index = get_vector_index() if owner_id is None else tenant_indexes.get(db, owner_id)
+    index.ensure_loaded(db)
+    return index
+
+def resolve_mode(mode: Optional[str]) -> str:
+    """Requested retrieval mode, or the configured default"""
+    mode = mode or RETRIEVAL_MODE
+    if mode not in RETRIEVAL_MODES:
+        raise ValueError(f"Unknown retrieval mode: {mode}")
+    return mode
+
+def build_snippet(content: str) -> str:
+    """Create a snippet around the middle of the chunk content (300-400 chars)"""
+    snippet_length = min(350, len(content))
+    start = max(0, (len(content) - snippet_length) // 2)
+    snippet = content[start:start + snippet_length]
+    
+    # Add ellipsis if truncated
+    if start > 0:
+        snippet = "..." + snippet
+    if start + snippet_length < len(content):
+        snippet = snippet + "..."
+    return snippet
+
+def materialize_hits(hits_per_query: List[List[Tuple[uuid.UUID, float]]], db: Session) -> List[List[RetrievalItem]]:
+    """Fetch the winning rows for one or more queries in a single round trip; partial rankings stay Partial"""
+    winner_ids = {chunk_id for hits in hits_per_query for chunk_id, _ in hits}
+    if not winner_ids:
+        return [Partial() if is_partial(hits) else [] for hits in hits_per_query]
+    
+    # Fetch only the winning rows, without their embeddings
+    rows = db.query(
+        DocumentChunk.id,
+        DocumentChunk.doc_id,
+        DocumentChunk.chunk_index,
+        DocumentChunk.content,
+        DocumentChunk.context_tokens
+    ).filter(DocumentChunk.id.in_(list(winner_ids))).all()
+    rows_by_id = {row.id: row for row in rows}
+    
+    # Preserve index ranking; skip chunks deleted since the index was built
+    items_per_query = []
+    for hits in hits_per_query:
+        items = []
+        for chunk_id, score in hits:
+            row = rows_by_id.get(chunk_id)
+            if row is None:
+                continue
+            items.append(RetrievalItem(
+                doc_id=row.doc_id,
+                chunk_index=row.chunk_index,
+                score=score,
+                snippet=build_snippet(row.content),
+                context_tokens=row.context_tokens
+            ))
+        items_per_query.append(Partial(items) if is_partial(hits) else items)
+    return items_per_query
+
+def retrieve_topk_by_embedding(
+    query_embedding: List[float],
+    k: int,
+    db: Session,
+    nprobe: Optional[int] = None,
+    ef_search: Optional[int] = None,
+    query: Optional[str] = None,
+    mode: Optional[str] = None,
+    filters: Optional[SearchFilters] = None
+) -> List[RetrievalItem]:
+    """Search the resident index with a query embedding and load the winning chunks.
+
+    The lexical modes also need the query text; without it the search is vector only.
+    Filters are resolved to documents first, so only their chunks are scored.
+    """
+    mode = resolve_mode(mode)
+    # Score against the resident index instead of scanning the table
+    index = search_target(db, filters)
+    if mode != "vector":
+        get_lexical_index().ensure_loaded(db)
+    hits = search_cached(
+        index,
+        [query_embedding],
+        k,
+        nprobe,
+        ef_search,
+        [query] if query is not None else None,
+        mode,
+        filters,
+        filter_document_ids(db, filters)
+    )[0]
+    
+    if not hits:
+        logger.warning("No chunks with embeddings found in index")
+    
+    return materialize_hits([hits], db)[0]
+
+def retrieve_topk(
+    query: str,
+    k: int,
+    db: Session,
+    nprobe: Optional[int] = None,
+    ef_search: Optional[int] = None,
+    mode: Optional[str] = None,
+    filters: Optional[SearchFilters] = None
+) -> List[RetrievalItem]:
+    """Retrieve top-k chunks for a query using vector similarity.
+
+    nprobe and ef_search tune approximate index types for this query only;
+    mode picks vector, hybrid or prefilter retrieval (RETRIEVAL_MODE by default);
+    filters restrict it to matching documents.
+    """
     try:
         # Generate query embedding
-        query_embeddings = embed_chunks([query])
+        query_embeddings = embed_queries([query])
         if not query_embeddings:
             logger.error("Failed to generate query embedding")
             return []
         
-        query_embedding = query_embeddings[0]
+        top_items = retrieve_topk_by_embedding(query_embeddings[0], k, db, nprobe, ef_search, query, mode, filters)
         
-        # Get all chunks with embeddings from database
-        chunks = db.query(DocumentChunk).filter(
-            DocumentChunk.embedding.isnot(None)
-        ).all()
-        
-        if not chunks:
-            logger.warning("No chunks with embeddings found in database")
-            return []
+        logger.info(f"Retrieved {len(top_items)} chunks for query: {query[:50]}...")
+        return top_items
         
-        # Calculate similarities and create retrieval items
-        retrieval_items = []
-        for chunk in chunks:
-            if chunk.embedding:
-                similarity = cosine_similarity(query_embedding, chunk.embedding)
-                
-                # Create snippet around chunk content (300-400 chars)
-                content = chunk.content
-                snippet_length = min(350, len(content))
-                start = max(0, (len(content) - snippet_length) // 2)
-                snippet = content[start:start + snippet_length]
-                
-                # Add ellipsis if truncated
-                if start > 0:
-                    snippet = "..." + snippet
-                if start + snippet_length < len(content):
-                    snippet = snippet + "..."
-                
-                retrieval_items.append(RetrievalItem(
-                    doc_id=chunk.doc_id,
-                    chunk_index=chunk.chunk_index,
-                    score=similarity,
-                    snippet=snippet
-                ))
+    except Exception as e:
+        logger.error(f"Error in retrieve_topk: {str(e)}")
+        return []
+
+async def retrieve_topk_async(
+    query: str,
+    k: int,
+    db: Session,
+    nprobe: Optional[int] = None,
+    ef_search: Optional[int] = None,
+    query_embedding: Optional[List[float]] = None,
+    mode: Optional[str] = None,
+    filters: Optional[SearchFilters] = None
+) -> List[RetrievalItem]:
+    """retrieve_topk that awaits the embedding and runs the index search and DB fetch off the event loop.
+
+    Pass query_embedding when the caller already embedded the query.
+    """
+    try:
+        if query_embedding is None:
+            query_embeddings = await embed_queries_async([query])
+            if not query_embeddings:
+                logger.error("Failed to generate query embedding")
+                return []
+            query_embedding = query_embeddings[0]
         
-        # Sort by score (descending) and return top-k
-        retrieval_items.sort(key=lambda x: x.score, reverse=True)
-        top_items = retrieval_items[:k]
+        top_items = await run_in_threadpool(
+            retrieve_topk_by_embedding, query_embedding, k, db, nprobe, ef_search, query, mode, filters
+        )
         
         logger.info(f"Retrieved {len(top_items)} chunks for query: {query[:50]}...")
         return top_items
         
     except Exception as e:
-        logger.error(f"Error in retrieve_topk: {str(e)}")
+        logger.error(f"Error in retrieve_topk_async: {str(e)}")
         return []
 
+def retrieve_topk_batch(
+    queries: List[str],
+    k: int,
+    db: Session,
+    nprobe: Optional[int] = None,
+    ef_search: Optional[int] = None,
+    mode: Optional[str] = None,
+    filters: Optional[SearchFilters] = None
+) -> List[List[RetrievalItem]]:
+    """Retrieve top-k chunks for several queries with one embeddings call and one index pass.
+
+    Unlike retrieve_topk, failures raise so batch callers can report them.
+    """
+    if not queries:
+        return []
+    
+    query_embeddings = embed_queries(queries)
+    if len(query_embeddings) != len(queries):
+        raise RuntimeError("embedding backend returned the wrong number of vectors")
+    
+    mode = resolve_mode(mode)
+    index = search_target(db, filters)
+    if mode != "vector":
+        get_lexical_index().ensure_loaded(db)
+    hits_per_query = search_cached(
+        index, query_embeddings, k, nprobe, ef_search, queries, mode, filters, filter_document_ids(db, filters)
+    )
+    
+    items_per_query = materialize_hits(hits_per_query, db)
+    logger.info(f"Retrieved chunks for a batch of {len(queries)} queries")
+    return items_per_query
+
 def trim_context_to_token_budget(items: List[RetrievalItem], budget_tokens: int, model: str) -> List[RetrievalItem]:
-    """Trim context to fit within token budget"""
+    """Trim context to fit within token budget.
+
+    Snippet counts stored at parse time make this an integer sum; only chunks
+    parsed before counts were kept are tokenized here.
+    """
     if not items:
         return []
     
-    # Estimate tokens: approximately 4 characters per token
-    chars_per_token = 4
-    
+    tokenizer = get_tokenizer()
     budgeted_items = []
     current_tokens = 0
     
     for item in items:
-        # Estimate tokens for this item
-        item_tokens = math.ceil(len(item.snippet) / chars_per_token)
+        item_tokens = item.context_tokens if item.context_tokens is not None else tokenizer.count(item.snippet)
         
         # Check if adding this item would exceed budget
         if current_tokens + item_tokens <= budget_tokens:
             budgeted_items.append(item)
             current_tokens += item_tokens
         else:
-            # Try to fit a truncated version if it's the first item
-            if not budgeted_items and item_tokens <= budget_tokens:
-                # Truncate the snippet to fit budget
-                max_chars = budget_tokens * chars_per_token
-                truncated_snippet = item.snippet[:max_chars] + "..."
-                truncated_item = RetrievalItem(
-                    doc_id=item.doc_id,
-                    chunk_index=item.chunk_index,
-                    score=item.score,
-                    snippet=truncated_snippet
-                )
-                budgeted_items.append(truncated_item)
+            # A first item too large for the whole budget is cut at a token boundary
+            if not budgeted_items:
+                keep_tokens = budget_tokens - tokenizer.count("...")
+                if keep_tokens > 0:
+                    truncated_item = item.model_copy(update={
+                        "snippet": tokenizer.truncate(item.snippet, keep_tokens) + "...",
+                        "context_tokens": None
+                    })
+                    budgeted_items.append(truncated_item)
+                    current_tokens = tokenizer.count(truncated_item.snippet)
             break
     
     logger.info(f"Trimmed context from {len(items)} to {len(budgeted_items)} items, using {current_tokens}/{budget_tokens} tokens")
@@ -0,0 +1,191 @@
+import hashlib
+import os
+import threading
+import time
+from typing import Dict, List, Optional
+import numpy as np
+import logging
+import redis.asyncio
+
+from app.utils.vector_codec import normalize_vectors
+
+logger = logging.getLogger(__name__)
+
+# Minimum cosine similarity between a new query and a cached one to reuse its answer
+SEMANTIC_CACHE_THRESHOLD = float(os.getenv("SEMANTIC_CACHE_THRESHOLD", "0.95"))
+# Cached queries remembered; the shared stream is trimmed to roughly this length too
+SEMANTIC_CACHE_SIZE = int(os.getenv("SEMANTIC_CACHE_SIZE", "5000"))
+SEMANTIC_CACHE_ENABLED = os.getenv("SEMANTIC_CACHE_ENABLED", "true").lower() == "true"
+
+# Redis keys shared by every worker
+ENTRY_STREAM = "semcache:entries"
+STATS_KEY = "semcache:stats"
+
+OUTCOMES = ("exact_hits", "semantic_hits", "misses")
+
+def scope_id(*parts) -> int:
+    """Stable 63-bit id for the parameters an answer depends on besides the question"""
+    digest = hashlib.sha256(":".join(str(part) for part in parts).encode()).digest()
+    return int.from_bytes(digest[:8], "little") & 0x7FFFFFFFFFFFFFFF
+
+class SemanticCache:
+    """Maps query embeddings to the exact-match cache keys of their answers.
+
+    Each cached answer's query embedding, parameter scope and corpus version are
+    appended to a Redis stream next to the answer itself. Every worker mirrors
+    the stream into a fixed-size ring matrix, reading only entries it has not
+    seen, so a lookup is one matrix-vector product over the ring. A row only
+    matches within the same scope, at the same corpus version and while its
+    answer is still inside ttl. Hit counters are kept in Redis as well.
+
+    Without a Redis client the cache works per process.
+    """
+
+    def __init__(
+        self,
+        redis_client: Optional[redis.asyncio.Redis] = None,
+        ttl: float = 600,
+        capacity: int = SEMANTIC_CACHE_SIZE,
+        threshold: float = SEMANTIC_CACHE_THRESHOLD
+    ):
+        self.redis_client = redis_client
+        self.ttl = ttl
+        self.capacity = capacity
+        self.threshold = threshold
+        self._matrix: Optional[np.ndarray] = None
+        self._scopes = np.zeros(capacity, dtype=np.int64)
+        self._versions = np.full(capacity, -1, dtype=np.int64)
+        self._inserted = np.zeros(capacity, dtype=np.float64)
+        self._keys: List[Optional[str]] = [None] * capacity
+        self._row_of: Dict[str, int] = {}
+        self._next = 0
+        self._size = 0
+        self._last_id = "0-0"
+        self._lock = threading.Lock()
+        self.stats = dict.fromkeys(OUTCOMES, 0)
+
+    def _insert(self, cache_key: str, vector: np.ndarray, scope: int, corpus_version: int, inserted_at: float) -> None:
+        with self._lock:
+            if self._matrix is None or self._matrix.shape[1] != vector.shape[0]:
+                # First entry, or the embedding model changed dimension
+                self._matrix = np.zeros((self.capacity, vector.shape[0]), dtype=np.float32)
+                self._reset()
+
+            row = self._row_of.get(cache_key)
+            if row is None:
+                row = self._next
+                self._next = (self._next + 1) % self.capacity
+                self._size = min(self._size + 1, self.capacity)
+                evicted = self._keys[row]
+                if evicted is not None:
+                    del self._row_of[evicted]
+                self._keys[row] = cache_key
+                self._row_of[cache_key] = row
+
+            self._matrix[row] = vector
+            self._scopes[row] = scope
+            self._versions[row] = corpus_version
+            self._inserted[row] = inserted_at
+
+    def _reset(self) -> None:
+        self._versions.fill(-1)
+        self._keys = [None] * self.capacity
+        self._row_of.clear()
+        self._next = 0
+        self._size = 0
+
+    async def _sync(self) -> None:
+        """Mirror stream entries added since the last sync, including other workers'"""
+        if self.redis_client is None:
+            return
+        try:
+            response = await self.redis_client.xread({ENTRY_STREAM: self._last_id}, count=self.capacity)
+        except Exception as e:
+            logger.warning(f"Error reading semantic cache entries: {str(e)}")
+            return
+        for _, entries in response or []:
+            for entry_id, fields in entries:
+                entry_id = entry_id.decode() if isinstance(entry_id, bytes) else entry_id
+                fields = {(k.decode() if isinstance(k, bytes) else k): v for k, v in fields.items()}
+                key = fields["key"]
+                self._insert(
+                    key.decode() if isinstance(key, bytes) else key,
+                    np.frombuffer(fields["vec"], dtype="<f4").astype(np.float32),
+                    int(fields["scope"]),
+                    int(fields["version"]),
+                    # Stream ids start with the insert time in milliseconds
+                    int(entry_id.split("-")[0]) / 1000
+                )
+                self._last_id = entry_id
+
+    async def lookup(self, query_embedding: List[float], scope: int, corpus_version: int) -> Optional[str]:
+        """Return the cache key of the closest cached query above the threshold, if any"""
+        await self._sync()
+        query = normalize_vectors(np.asarray(query_embedding, dtype=np.float32))
+        with self._lock:
+            if self._size == 0 or self._matrix is None or query.shape[0] != self._matrix.shape[1]:
+                return None
+            n = self._size
+            scores = self._matrix[:n] @ query
+            valid = (
+                (self._scopes[:n] == scope)
+                & (self._versions[:n] == corpus_version)
+                & (self._inserted[:n] >= time.time() - self.ttl)
+            )
+            scores = np.where(valid, scores, -np.inf)
+            best = int(np.argmax(scores))
+            if scores[best] < self.threshold:
+                return None
+            logger.info(f"Semantic cache match with similarity {scores[best]:.4f}")
+            return self._keys[best]
+
+    async def put(self, query_embedding: List[float], scope: int, corpus_version: int, cache_key: str) -> None:
+        """Record that cache_key answers this query embedding, for every worker"""
+        vector = normalize_vectors(np.asarray(query_embedding, dtype=np.float32))
+        self._insert(cache_key, vector, scope, corpus_version, time.time())
+        if self.redis_client is None:
+            return
+        try:
+            await self.redis_client.xadd(
+                ENTRY_STREAM,
+                {"key": cache_key, "scope": scope, "version": corpus_version, "vec": vector.astype("<f4").tobytes()},
+                maxlen=self.capacity,
+                approximate=True
+            )
+        except Exception as e:
+            logger.warning(f"Error writing semantic cache entry: {str(e)}")
+
+    async def record(self, outcome: str) -> None:
+        """Count an exact_hits, semantic_hits or misses outcome"""
+        with self._lock:
+            self.stats[outcome] += 1
+        if self.redis_client is None:
+            return
+        try:
+            await self.redis_client.hincrby(STATS_KEY, outcome, 1)
+        except Exception as e:
+            logger.warning(f"Error updating semantic cache stats: {str(e)}")
+
+    async def hit_rates(self) -> Dict[str, float]:
+        """Counters across all workers (this worker's if Redis is unavailable) plus hit rates"""
+        with self._lock:
+            stats = dict(self.stats)
+            entries = self._size
+        if self.redis_client is not None:
+            try:
+                shared = await self.redis_client.hgetall(STATS_KEY)
+                shared = {(k.decode() if isinstance(k, bytes) else k): int(v) for k, v in shared.items()}
+                stats = {outcome: shared.get(outcome, 0) for outcome in OUTCOMES}
+            except Exception as e:
+                logger.warning(f"Error reading semantic cache stats: {str(e)}")
+        total = sum(stats[outcome] for outcome in OUTCOMES)
+        stats["entries"] = entries
+        stats["exact_hit_rate"] = stats["exact_hits"] / total if total else 0.0
+        stats["semantic_hit_rate"] = stats["semantic_hits"] / total if total else 0.0
+        return stats
+
+    def clear(self) -> None:
+        """Forget this worker's mirror of cached queries; the next sync reloads the stream"""
+        with self._lock:
+            self._reset()
+            self._last_id = "0-0"
@@ -0,0 +1,421 @@
+import argparse
+import heapq
+import itertools
+import multiprocessing
+import os
+import secrets
+import threading
+import time
+import uuid
+from concurrent.futures import Future, ThreadPoolExecutor, wait
+from multiprocessing.connection import Client, Connection, Listener
+from operator import itemgetter
+from typing import Callable, Dict, List, Optional, Tuple
+import numpy as np
+import logging
+from sqlalchemy import func
+from sqlalchemy.orm import Session
+
+from app.db.database import SessionLocal
+from app.db.models import DocumentChunk
+from app.utils import vector_index
+from app.utils.vector_index import INDEX_TYPE, VECTOR_SHARDS, VERSION_CHECK_INTERVAL, VectorIndex
+
+logger = logging.getLogger(__name__)
+
+# host:port of running shard servers, in shard order; empty spawns local shard processes
+SHARD_ADDRESSES = [address.strip() for address in os.getenv("VECTOR_SHARD_ADDRESSES", "").split(",") if address.strip()]
+# Shared secret between API workers and shard servers; required with VECTOR_SHARD_ADDRESSES
+SHARD_AUTHKEY = os.getenv("VECTOR_SHARD_AUTHKEY", "")
+# How long a search waits for the slowest shard before returning what the others found
+SHARD_TIMEOUT = float(os.getenv("VECTOR_SHARD_TIMEOUT_SECONDS", "2"))
+# Searches one shard server runs at once; numpy releases the GIL while scoring
+SHARD_SERVER_THREADS = int(os.getenv("VECTOR_SHARD_SERVER_THREADS", "4"))
+
+Hits = List[Tuple[uuid.UUID, float]]
+
+class Partial(list):
+    """Results missing the contributions of shards that timed out or failed"""
+
+def is_partial(results) -> bool:
+    return isinstance(results, Partial)
+
+def shard_of(doc_id: uuid.UUID, shards: int) -> int:
+    """Shard holding a document's chunks: the low 16 bits of its id, which are random for uuid4"""
+    return int.from_bytes(doc_id.bytes[-2:], "big") % shards
+
+def shard_condition(doc_id_column, shard: int, shards: int):
+    """SQL form of shard_of, so each shard reads only its own rows"""
+    raw = func.uuid_send(doc_id_column)
+    return (func.get_byte(raw, 14) * 256 + func.get_byte(raw, 15)) % shards == shard
+
+class ShardIndex(VectorIndex):
+    """The part of the vector index holding documents whose id hashes to one shard.
+
+    Loads, change-log replays and snapshots all go through the shard filter,
+    so a shard server never holds more than its own slice of the matrix.
+    """
+
+    def __init__(self, shard: int, shards: int, index_type: str = INDEX_TYPE):
+        super().__init__(index_type)
+        self.shard = shard
+        self.shards = shards
+
+    @property
+    def snapshot_dir(self) -> str:
+        if not vector_index.SNAPSHOT_DIR:
+            return ""
+        return os.path.join(vector_index.SNAPSHOT_DIR, f"shard-{self.shard}-of-{self.shards}")
+
+    def _fetch_vectors(self, db: Session, *filters):
+        return super()._fetch_vectors(db, shard_condition(DocumentChunk.doc_id, self.shard, self.shards), *filters)
+
+# What clients may call on a shard; each returns one ranking per query
+SHARD_METHODS: Dict[str, Callable] = {
+    "search_batch": lambda index, embeddings, k, nprobe, ef_search: index.search_batch(
+        embeddings, k, nprobe, ef_search
+    ),
+    "search_documents": lambda index, embeddings, doc_ids, k, nprobe, ef_search: index.search_documents(
+        embeddings, doc_ids, k, nprobe, ef_search
+    ),
+    "search_candidates": lambda index, embeddings, chunk_ids, k: [
+        index.search_candidates(embedding, chunk_ids, k) for embedding in embeddings
+    ],
+}
+
+def _keep_current(index: ShardIndex) -> None:
+    """Poll the corpus version so the shard replays changes made by any worker"""
+    while True:
+        time.sleep(VERSION_CHECK_INTERVAL)
+        db = SessionLocal()
+        try:
+            index.ensure_loaded(db)
+        except Exception as e:
+            logger.error(f"Shard {index.shard} version check failed: {str(e)}")
+        finally:
+            db.close()
+
+def _serve_connection(index: VectorIndex, conn: Connection, executor: ThreadPoolExecutor) -> None:
+    """Answer one client's requests concurrently; responses carry the request id"""
+    send_lock = threading.Lock()
+
+    def run(request_id: int, method: str, args: tuple) -> None:
+        try:
+            response = (request_id, index.version, True, SHARD_METHODS[method](index, *args))
+        except Exception as e:
+            response = (request_id, index.version, False, f"{type(e).__name__}: {str(e)}")
+        try:
+            with send_lock:
+                conn.send(response)
+        except (OSError, ValueError):
+            # The client went away; its reader has already failed the request
+            pass
+
+    try:
+        while True:
+            request_id, method, args = conn.recv()
+            executor.submit(run, request_id, method, args)
+    except (EOFError, OSError):
+        pass
+    finally:
+        conn.close()
+
+def serve_index(
+    index: VectorIndex,
+    address: Tuple[str, int],
+    authkey: bytes,
+    ready: Optional[Connection] = None
+) -> None:
+    """Serve searches of a loaded index on `address` until the process exits.
+
+    `ready`, when given, receives the bound address, which is how spawned
+    local shards report the port they picked.
+    """
+    executor = ThreadPoolExecutor(max_workers=SHARD_SERVER_THREADS, thread_name_prefix="vector-shard-search")
+    with Listener(address, authkey=authkey) as listener:
+        logger.info(f"Vector shard serving {index.size} vectors on {listener.address}")
+        if ready is not None:
+            ready.send(listener.address)
+            ready.close()
+        while True:
+            try:
+                conn = listener.accept()
+            except (OSError, multiprocessing.AuthenticationError) as e:
+                logger.warning(f"Rejected shard connection: {str(e)}")
+                continue
+            threading.Thread(
+                target=_serve_connection, args=(index, conn, executor), name="vector-shard-connection", daemon=True
+            ).start()
+
+def serve_shard(
+    shard: int,
+    shards: int,
+    address: Tuple[str, int],
+    authkey: bytes,
+    ready: Optional[Connection] = None
+) -> None:
+    """Load one shard from the database and serve it, replaying corpus changes as they land.
+
+    The listener only opens once the shard is loaded.
+    """
+    index = ShardIndex(shard, shards)
+    db = SessionLocal()
+    try:
+        index.refresh(db)
+    finally:
+        db.close()
+    threading.Thread(target=_keep_current, args=(index,), name="vector-shard-version-check", daemon=True).start()
+    serve_index(index, address, authkey, ready)
+
+class ShardClient:
+    """One API worker's connection to a shard server.
+
+    Concurrent calls share the connection and are matched to responses by
+    request id, so a slow search never holds up the others. A broken
+    connection fails its outstanding calls and is reopened on the next one.
+    """
+
+    def __init__(self, shard: int, connect: Callable[[], Connection]):
+        self.shard = shard
+        self._connect = connect
+        self._conn: Optional[Connection] = None
+        self._pending: Dict[int, Future] = {}
+        self._ids = itertools.count()
+        self._lock = threading.Lock()
+        # Corpus version the shard last reported; -1 until it answers
+        self.version = -1
+
+    def call(self, method: str, *args) -> Future:
+        future = Future()
+        with self._lock:
+            try:
+                if self._conn is None:
+                    self._conn = self._connect()
+                    threading.Thread(
+                        target=self._read, args=(self._conn,), name=f"vector-shard-{self.shard}-reader", daemon=True
+                    ).start()
+                request_id = next(self._ids)
+                self._pending[request_id] = future
+                self._conn.send((request_id, method, args))
+            except Exception as e:
+                self._disconnect(self._conn, e)
+                if not future.done():
+                    future.set_exception(e)
+        return future
+
+    def _read(self, conn: Connection) -> None:
+        try:
+            while True:
+                request_id, version, ok, payload = conn.recv()
+                with self._lock:
+                    future = self._pending.pop(request_id, None)
+                self.version = version
+                if future is None:
+                    continue
+                if ok:
+                    future.set_result(payload)
+                else:
+                    future.set_exception(RuntimeError(payload))
+        except (EOFError, OSError) as e:
+            with self._lock:
+                self._disconnect(conn, ConnectionError(f"vector shard {self.shard} disconnected: {str(e)}"))
+
+    def _disconnect(self, conn: Optional[Connection], error: Exception) -> None:
+        """Drop a broken connection and fail the calls waiting on it; call with the lock held"""
+        if conn is None or conn is not self._conn:
+            return
+        self._conn = None
+        try:
+            conn.close()
+        except OSError:
+            pass
+        pending, self._pending = self._pending, {}
+        for future in pending.values():
+            future.set_exception(error)
+
+class ShardedVectorIndex:
+    """Scatter-gather front end to the shard servers, searched like a VectorIndex.
+
+    Every query goes to each shard that can hold a match, and the per-shard
+    top-k lists are merged with a heap. Shards that miss SHARD_TIMEOUT or
+    fail are left out, and the affected rankings come back as Partial
+    lists so callers can flag them and keep them out of caches.
+    """
+
+    def __init__(self, clients: List[ShardClient], timeout: float = SHARD_TIMEOUT):
+        self.clients = clients
+        self.timeout = timeout
+
+    @property
+    def loaded(self) -> bool:
+        # Shards replay the corpus change log themselves; there is nothing to
+        # apply in this process after a parse
+        return False
+
+    @property
+    def version(self) -> int:
+        """Oldest corpus version any shard reported; -1 until all have answered"""
+        return min(client.version for client in self.clients)
+
+    def ensure_loaded(self, db: Session) -> None:
+        """Shards load and refresh themselves"""
+
+    def _scatter(self, calls: Dict[int, tuple], queries: int, k: int) -> List[Hits]:
+        """Send calls[shard] = (method, *args) to each shard and merge the answers per query"""
+        futures = {shard: self.clients[shard].call(*call) for shard, call in calls.items()}
+        wait(futures.values(), timeout=self.timeout)
+
+        answers, missing = [], []
+        for shard, future in futures.items():
+            if future.done() and future.exception() is None:
+                answers.append(future.result())
+            else:
+                missing.append(shard)
+                if future.done():
+                    logger.warning(f"Vector shard {shard} failed: {str(future.exception())}")
+        if calls and not answers:
+            raise RuntimeError(f"No vector shard answered within {self.timeout}s")
+        if missing:
+            logger.warning(f"Vector shards {missing} missed the search; returning partial results")
+
+        merged = (
+            heapq.nlargest(k, itertools.chain.from_iterable(answer[query] for answer in answers), key=itemgetter(1))
+            for query in range(queries)
+        )
+        return [Partial(hits) if missing else hits for hits in merged]
+
+    def search(
+        self,
+        query_embedding: List[float],
+        k: int,
+        nprobe: Optional[int] = None,
+        ef_search: Optional[int] = None
+    ) -> Hits:
+        return self.search_batch([query_embedding], k, nprobe, ef_search)[0]
+
+    def search_batch(
+        self,
+        query_embeddings: List[List[float]],
+        k: int,
+        nprobe: Optional[int] = None,
+        ef_search: Optional[int] = None
+    ) -> List[Hits]:
+        if len(query_embeddings) == 0:
+            return []
+        embeddings = np.asarray(query_embeddings, dtype=np.float32)
+        calls = {shard: ("search_batch", embeddings, k, nprobe, ef_search) for shard in range(len(self.clients))}
+        return self._scatter(calls, len(embeddings), k)
+
+    def search_documents(
+        self,
+        query_embeddings: List[List[float]],
+        doc_ids: List[uuid.UUID],
+        k: int,
+        nprobe: Optional[int] = None,
+        ef_search: Optional[int] = None
+    ) -> List[Hits]:
+        """Only the shards owning one of the documents are asked"""
+        if len(query_embeddings) == 0:
+            return []
+        by_shard: Dict[int, List[uuid.UUID]] = {}
+        for doc_id in doc_ids:
+            by_shard.setdefault(shard_of(doc_id, len(self.clients)), []).append(doc_id)
+        if not by_shard:
+            return [[] for _ in query_embeddings]
+        embeddings = np.asarray(query_embeddings, dtype=np.float32)
+        calls = {
+            shard: ("search_documents", embeddings, shard_doc_ids, k, nprobe, ef_search)
+            for shard, shard_doc_ids in by_shard.items()
+        }
+        return self._scatter(calls, len(embeddings), k)
+
+    def search_candidates(
+        self,
+        query_embedding: List[float],
+        chunk_ids: List[uuid.UUID],
+        k: int
+    ) -> Hits:
+        """Chunk ids do not name their shard, so every shard scores the ones it holds"""
+        embeddings = np.asarray([query_embedding], dtype=np.float32)
+        calls = {shard: ("search_candidates", embeddings, chunk_ids, k) for shard in range(len(self.clients))}
+        return self._scatter(calls, 1, k)[0]
+
+def _remote_connector(address: str, authkey: bytes) -> Callable[[], Connection]:
+    host, port = address.rsplit(":", 1)
+    return lambda: Client((host, int(port)), authkey=authkey)
+
+def _local_connector(shard: int, ready: Connection, authkey: bytes) -> Callable[[], Connection]:
+    """Connect once the spawned shard has loaded and reported its port"""
+    address = None
+
+    def connect() -> Connection:
+        nonlocal address
+        if address is None:
+            if not ready.poll():
+                raise ConnectionError(f"vector shard {shard} is still loading")
+            address = ready.recv()
+        return Client(address, authkey=authkey)
+
+    return connect
+
+def start_local_shards(shards: int) -> List[ShardClient]:
+    """Spawn one shard server process per shard on this machine.
+
+    Each API worker spawns its own set, so this suits development and
+    single-worker deployments; larger ones run `python -m app.utils.shards`
+    per shard and list them in VECTOR_SHARD_ADDRESSES.
+    """
+    context = multiprocessing.get_context("spawn")
+    authkey = SHARD_AUTHKEY.encode() or secrets.token_bytes(32)
+    clients = []
+    for shard in range(shards):
+        ready, report = context.Pipe(duplex=False)
+        context.Process(
+            target=serve_shard,
+            args=(shard, shards, ("127.0.0.1", 0), authkey, report),
+            name=f"vector-shard-{shard}",
+            daemon=True
+        ).start()
+        report.close()
+        clients.append(ShardClient(shard, _local_connector(shard, ready, authkey)))
+    logger.info(f"Started {shards} local vector shard processes")
+    return clients
+
+_sharded_index: Optional[ShardedVectorIndex] = None
+_sharded_index_lock = threading.Lock()
+
+def get_sharded_index() -> ShardedVectorIndex:
+    """Get the process-wide front end to the configured shards, starting local ones on first use"""
+    global _sharded_index
+    with _sharded_index_lock:
+        if _sharded_index is None:
+            if SHARD_ADDRESSES:
+                if len(SHARD_ADDRESSES) != VECTOR_SHARDS:
+                    raise ValueError(f"VECTOR_SHARD_ADDRESSES lists {len(SHARD_ADDRESSES)} shards, VECTOR_SHARDS is {VECTOR_SHARDS}")
+                if not SHARD_AUTHKEY:
+                    raise ValueError("VECTOR_SHARD_AUTHKEY is required with VECTOR_SHARD_ADDRESSES")
+                clients = [
+                    ShardClient(shard, _remote_connector(address, SHARD_AUTHKEY.encode()))
+                    for shard, address in enumerate(SHARD_ADDRESSES)
+                ]
+            else:
+                clients = start_local_shards(VECTOR_SHARDS)
+            _sharded_index = ShardedVectorIndex(clients)
+        return _sharded_index
+
+def main():
+    parser = argparse.ArgumentParser(description="Serve one shard of the vector index")
+    parser.add_argument("--shard", type=int, required=True)
+    parser.add_argument("--shards", type=int, default=VECTOR_SHARDS)
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, required=True)
+    args = parser.parse_args()
+    if not SHARD_AUTHKEY:
+        parser.error("set VECTOR_SHARD_AUTHKEY")
+    if not 0 <= args.shard < args.shards:
+        parser.error("--shard must be between 0 and --shards - 1")
+    logging.basicConfig(level=logging.INFO)
+    serve_shard(args.shard, args.shards, (args.host, args.port), SHARD_AUTHKEY.encode())
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,139 @@
+import asyncio
+import os
+import uuid
+from typing import Any, Awaitable, Callable, Dict, Optional, Tuple
+import logging
+import redis.asyncio
+
+logger = logging.getLogger(__name__)
+
+# Cross-worker lock lifetime; must outlast retrieval plus an LLM completion
+SINGLEFLIGHT_LOCK_TTL = float(os.getenv("SINGLEFLIGHT_LOCK_TTL_SECONDS", "60"))
+# How long a waiter follows another computation before computing on its own
+SINGLEFLIGHT_WAIT_TIMEOUT = float(os.getenv("SINGLEFLIGHT_WAIT_TIMEOUT_SECONDS", "30"))
+SINGLEFLIGHT_POLL_INTERVAL = float(os.getenv("SINGLEFLIGHT_POLL_INTERVAL_SECONDS", "0.05"))
+
+# Delete the lock only if this caller still holds it
+RELEASE_SCRIPT = """
+if redis.call("get", KEYS[1]) == ARGV[1] then
+    return redis.call("del", KEYS[1])
+end
+return 0
+"""
+
+class SingleFlight:
+    """Coalesces concurrent computations of the same key.
+
+    Within a worker, callers of an in-flight key await the leader's future.
+    Across workers, the leader holds a Redis SET NX PX lock while it computes
+    and publishes its result through the caller's shared cache; other workers
+    poll that cache until the result lands, the lock disappears or the wait
+    times out, and only then compute themselves. Errors and timeouts degrade
+    to computing independently, never to failing the request.
+    """
+
+    def __init__(
+        self,
+        redis_client: Optional[redis.asyncio.Redis] = None,
+        lock_ttl: float = SINGLEFLIGHT_LOCK_TTL,
+        wait_timeout: float = SINGLEFLIGHT_WAIT_TIMEOUT,
+        poll_interval: float = SINGLEFLIGHT_POLL_INTERVAL
+    ):
+        self.redis_client = redis_client
+        self.lock_ttl = lock_ttl
+        self.wait_timeout = wait_timeout
+        self.poll_interval = poll_interval
+        self._inflight: Dict[str, asyncio.Future] = {}
+
+    async def do(
+        self,
+        key: str,
+        compute: Callable[[], Awaitable[Any]],
+        load_shared: Callable[[], Awaitable[Optional[Any]]]
+    ) -> Tuple[Any, bool]:
+        """Run compute once for concurrent callers of key.
+
+        compute must store its result where load_shared finds it before
+        returning. Returns (result, shared), where shared is True when the
+        result came from another caller's computation.
+        """
+        while True:
+            future = self._inflight.get(key)
+            if future is None:
+                break
+            try:
+                return await asyncio.wait_for(asyncio.shield(future), self.wait_timeout), True
+            except asyncio.TimeoutError:
+                logger.warning(f"Timed out waiting for in-flight computation of {key[:16]}")
+                return await compute(), False
+            except asyncio.CancelledError:
+                if not future.cancelled():
+                    raise
+                # The leader was cancelled; take over
+
+        future = asyncio.get_running_loop().create_future()
+        self._inflight[key] = future
+        try:
+            result, shared = await self._lead(key, compute, load_shared)
+        except asyncio.CancelledError:
+            future.cancel()
+            raise
+        except BaseException as e:
+            future.set_exception(e)
+            # Followers re-raise it; don't warn when there are none
+            future.exception()
+            raise
+        finally:
+            del self._inflight[key]
+        future.set_result(result)
+        return result, shared
+
+    async def _lead(
+        self,
+        key: str,
+        compute: Callable[[], Awaitable[Any]],
+        load_shared: Callable[[], Awaitable[Optional[Any]]]
+    ) -> Tuple[Any, bool]:
+        if self.redis_client is None:
+            return await compute(), False
+
+        lock_key = f"singleflight:{key}"
+        token = uuid.uuid4().hex
+        try:
+            acquired = await self.redis_client.set(lock_key, token, nx=True, px=int(self.lock_ttl * 1000))
+        except Exception as e:
+            logger.warning(f"Error acquiring single-flight lock: {str(e)}")
+            return await compute(), False
+
+        if acquired:
+            try:
+                return await compute(), False
+            finally:
+                await self._release(lock_key, token)
+
+        # Another worker is computing; wait for its result to land in the shared cache
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + self.wait_timeout
+        try:
+            while loop.time() < deadline:
+                await asyncio.sleep(self.poll_interval)
+                result = await load_shared()
+                if result is not None:
+                    return result, True
+                if not await self.redis_client.exists(lock_key):
+                    # Released without a result (the leader failed), or released just after storing it
+                    result = await load_shared()
+                    if result is not None:
+                        return result, True
+                    break
+            else:
+                logger.warning(f"Timed out waiting for another worker to compute {key[:16]}")
+        except Exception as e:
+            logger.warning(f"Error waiting on single-flight lock: {str(e)}")
+        return await compute(), False
+
+    async def _release(self, lock_key: str, token: str) -> None:
+        try:
+            await self.redis_client.eval(RELEASE_SCRIPT, 1, lock_key, token)
+        except Exception as e:
+            logger.warning(f"Error releasing single-flight lock: {str(e)}")
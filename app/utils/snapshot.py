@@ -0,0 +1,141 @@
+import fcntl
+import json
+import os
+import shutil
+import time
+import uuid
+from contextlib import contextmanager
+from pathlib import Path
+from typing import List, NamedTuple, Optional
+import numpy as np
+import logging
+
+logger = logging.getLogger(__name__)
+
+# Bumped whenever the on-disk layout changes
+SNAPSHOT_FORMAT = 1
+
+# Name of the pointer file holding the current snapshot directory name
+CURRENT_FILE = "CURRENT"
+
+# Older snapshot directories kept around for workers still mapping them
+KEEP_SNAPSHOTS = 2
+
+class Snapshot(NamedTuple):
+    """A memory-mapped vector index snapshot"""
+    path: Path
+    corpus_version: int
+    chunk_ids: List[uuid.UUID]
+    doc_ids: List[uuid.UUID]
+    matrix: np.ndarray
+    ann_path: Optional[Path]
+
+def _uuids_to_array(ids: List[uuid.UUID]) -> np.ndarray:
+    return np.frombuffer(b"".join(i.bytes for i in ids), dtype=np.uint8).reshape(len(ids), 16)
+
+def _array_to_uuids(array: np.ndarray) -> List[uuid.UUID]:
+    raw = array.tobytes()
+    return [uuid.UUID(bytes=raw[i:i + 16]) for i in range(0, len(raw), 16)]
+
+@contextmanager
+def snapshot_lock(directory: str):
+    """Hold an exclusive cross-process lock on the snapshot directory"""
+    Path(directory).mkdir(parents=True, exist_ok=True)
+    with open(Path(directory) / ".lock", "w") as lock_file:
+        fcntl.flock(lock_file, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+def read_snapshot_meta(directory: str) -> Optional[dict]:
+    """Read the header of the current snapshot, or None if there is none"""
+    root = Path(directory)
+    try:
+        name = (root / CURRENT_FILE).read_text().strip()
+        meta = json.loads((root / name / "meta.json").read_text())
+    except (FileNotFoundError, ValueError):
+        return None
+    if meta.get("format") != SNAPSHOT_FORMAT:
+        logger.warning(f"Ignoring snapshot {name} with unsupported format {meta.get('format')}")
+        return None
+    meta["name"] = name
+    return meta
+
+def write_snapshot(
+    directory: str,
+    corpus_version: int,
+    chunk_ids: List[uuid.UUID],
+    doc_ids: List[uuid.UUID],
+    matrix: np.ndarray,
+    ann_writer=None
+) -> Path:
+    """Write a snapshot into a fresh directory and atomically make it current.
+
+    ann_writer, if given, is called with a path to persist an ANN index alongside.
+    """
+    root = Path(directory)
+    root.mkdir(parents=True, exist_ok=True)
+    name = f"snapshot-v{corpus_version}-{time.time_ns()}"
+    path = root / name
+    path.mkdir()
+
+    np.save(path / "vectors.npy", np.ascontiguousarray(matrix, dtype=np.float32))
+    np.save(path / "chunk_ids.npy", _uuids_to_array(chunk_ids))
+    np.save(path / "doc_ids.npy", _uuids_to_array(doc_ids))
+    has_ann = False
+    if ann_writer is not None:
+        has_ann = bool(ann_writer(path / "ann.faiss"))
+
+    # Header goes last: a directory without meta.json is never treated as complete
+    meta = {
+        "format": SNAPSHOT_FORMAT,
+        "corpus_version": corpus_version,
+        "count": len(chunk_ids),
+        "dimension": int(matrix.shape[1]) if matrix.ndim == 2 else 0,
+        "ann": has_ann,
+        "created_at": time.time(),
+    }
+    (path / "meta.json").write_text(json.dumps(meta))
+
+    pointer = root / f"{CURRENT_FILE}.{os.getpid()}.tmp"
+    pointer.write_text(name)
+    os.replace(pointer, root / CURRENT_FILE)
+
+    _remove_old_snapshots(root, name)
+    logger.info(f"Wrote vector snapshot {name} with {len(chunk_ids)} vectors")
+    return path
+
+def _remove_old_snapshots(root: Path, current: str) -> None:
+    # Unlinked files stay valid for processes that still have them mapped
+    snapshots = sorted(
+        (p for p in root.glob("snapshot-v*") if p.is_dir() and p.name != current),
+        key=lambda p: p.stat().st_mtime
+    )
+    for old in snapshots[:max(len(snapshots) - (KEEP_SNAPSHOTS - 1), 0)]:
+        shutil.rmtree(old, ignore_errors=True)
+
+def open_snapshot(directory: str) -> Optional[Snapshot]:
+    """Memory-map the current snapshot; pages are shared by every process mapping it"""
+    meta = read_snapshot_meta(directory)
+    if meta is None:
+        return None
+    path = Path(directory) / meta["name"]
+    try:
+        matrix = np.load(path / "vectors.npy", mmap_mode="r")
+        chunk_ids = _array_to_uuids(np.load(path / "chunk_ids.npy"))
+        doc_ids = _array_to_uuids(np.load(path / "doc_ids.npy"))
+    except FileNotFoundError:
+        # Removed by a newer writer between reading CURRENT and opening files
+        return None
+    if matrix.shape[0] != meta["count"] or len(chunk_ids) != meta["count"]:
+        logger.warning(f"Ignoring corrupt snapshot {meta['name']}")
+        return None
+    return Snapshot(
+        path=path,
+        corpus_version=meta["corpus_version"],
+        chunk_ids=chunk_ids,
+        doc_ids=doc_ids,
+        matrix=matrix,
+        ann_path=path / "ann.faiss" if meta.get("ann") else None
+    )
@@ -0,0 +1,150 @@
+import os
+import threading
+from collections import OrderedDict
+from typing import Dict, List, Optional
+import logging
+from sqlalchemy import select
+from sqlalchemy.orm import Session
+
+from app.db.models import Document, DocumentChunk
+from app.models.search import SearchFilters
+from app.utils import vector_index
+from app.utils.vector_index import INDEX_TYPE, VectorIndex
+
+logger = logging.getLogger(__name__)
+
+# Serve searches filtered to one owner from that owner's own index
+TENANT_INDEXES_ENABLED = os.getenv("TENANT_INDEXES_ENABLED", "true").lower() == "true"
+# Memory all resident tenant indexes may use together before the least recently used are evicted
+TENANT_INDEX_MEMORY_MB = float(os.getenv("TENANT_INDEX_MEMORY_MB", "512"))
+
+class TenantIndex(VectorIndex):
+    """Vector index over the chunks of one owner's documents.
+
+    Loads and change-log replays only read that owner's rows, and snapshots
+    live in a directory of their own, which is what an evicted tenant is
+    reloaded from.
+    """
+
+    def __init__(self, owner_id: int, index_type: str = INDEX_TYPE):
+        super().__init__(index_type)
+        self.owner_id = owner_id
+
+    @property
+    def snapshot_dir(self) -> str:
+        if not vector_index.SNAPSHOT_DIR:
+            return ""
+        return os.path.join(vector_index.SNAPSHOT_DIR, "tenants", f"owner-{self.owner_id}")
+
+    def _fetch_vectors(self, db: Session, *filters):
+        owned = DocumentChunk.doc_id.in_(select(Document.id).where(Document.user_id == self.owner_id))
+        return super()._fetch_vectors(db, owned, *filters)
+
+class TenantIndexes:
+    """Memory-bounded LRU of per-owner vector indexes.
+
+    An owner's index is loaded on first access, from its snapshot when one
+    exists, and then kept current like the shared index. Once the resident
+    indexes outgrow the budget, the least recently used are written back to
+    their snapshots and dropped, so the next access maps the file and replays
+    the change log instead of rebuilding from Postgres. The index just used
+    is never evicted, even when it alone exceeds the budget.
+    """
+
+    def __init__(self, memory_budget_bytes: int):
+        self.memory_budget_bytes = memory_budget_bytes
+        self._indexes: "OrderedDict[int, TenantIndex]" = OrderedDict()
+        self._load_locks: Dict[int, threading.Lock] = {}
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.loads = 0
+        self.evictions = 0
+
+    def resident(self, owner_id: int) -> Optional[TenantIndex]:
+        """The owner's index if it is loaded, without loading it or touching the LRU order"""
+        with self._lock:
+            return self._indexes.get(owner_id)
+
+    def get(self, db: Session, owner_id: int) -> TenantIndex:
+        """The owner's index, loading it and evicting others as needed"""
+        with self._lock:
+            index = self._indexes.get(owner_id)
+            if index is not None:
+                self._indexes.move_to_end(owner_id)
+                self.hits += 1
+                return index
+            load_lock = self._load_locks.setdefault(owner_id, threading.Lock())
+
+        # One load per owner; other owners keep loading and searching meanwhile
+        with load_lock:
+            with self._lock:
+                index = self._indexes.get(owner_id)
+            if index is not None:
+                return index
+            index = TenantIndex(owner_id)
+            index.ensure_loaded(db)
+            with self._lock:
+                self._indexes[owner_id] = index
+                self._load_locks.pop(owner_id, None)
+                self.loads += 1
+                evicted = self._evict(keep=owner_id)
+
+        logger.info(f"Loaded tenant index for owner {owner_id} with {index.size} vectors")
+        if evicted:
+            threading.Thread(target=self._write_back, args=(evicted,), name="tenant-index-eviction", daemon=True).start()
+        return index
+
+    def _evict(self, keep: int) -> List[TenantIndex]:
+        """Drop least recently used indexes until the rest fit the budget; call with the lock held"""
+        evicted = []
+        total = sum(index.memory_bytes for index in self._indexes.values())
+        for owner_id in list(self._indexes):
+            if total <= self.memory_budget_bytes:
+                break
+            if owner_id == keep:
+                continue
+            index = self._indexes.pop(owner_id)
+            total -= index.memory_bytes
+            evicted.append(index)
+            self.evictions += 1
+        return evicted
+
+    @staticmethod
+    def _write_back(evicted: List[TenantIndex]) -> None:
+        """Persist evicted indexes that changed since their last snapshot"""
+        for index in evicted:
+            try:
+                index.save_snapshot()
+            except Exception as e:
+                logger.error(f"Writing back tenant index for owner {index.owner_id} failed: {str(e)}")
+            logger.info(f"Evicted tenant index for owner {index.owner_id}")
+
+    def clear(self) -> None:
+        with self._lock:
+            self._indexes.clear()
+
+    def stats(self) -> Dict[str, float]:
+        with self._lock:
+            memory = sum(index.memory_bytes for index in self._indexes.values())
+            lookups = self.hits + self.loads
+            return {
+                "resident": len(self._indexes),
+                "memory_mb": round(memory / 2**20, 2),
+                "budget_mb": round(self.memory_budget_bytes / 2**20, 2),
+                "hits": self.hits,
+                "loads": self.loads,
+                "evictions": self.evictions,
+                "hit_rate": self.hits / lookups if lookups else 0.0
+            }
+
+tenant_indexes = TenantIndexes(int(TENANT_INDEX_MEMORY_MB * 2**20))
+
+def tenant_index_stats() -> Dict[str, float]:
+    """Residency and hit rate of this worker's tenant indexes"""
+    return tenant_indexes.stats()
+
+def owner_scope(filters: Optional[SearchFilters]) -> Optional[int]:
+    """Owner whose own index can serve a search with these filters, or None for the shared index"""
+    if not TENANT_INDEXES_ENABLED or filters is None:
+        return None
+    return filters.owner_id
@@ -0,0 +1,96 @@
+import os
+import re
+import threading
+from typing import List, Optional
+import logging
+
+logger = logging.getLogger(__name__)
+
+# "tiktoken" (pip install tiktoken), "regex" (offline approximation) or "auto" to prefer tiktoken when it loads
+TOKENIZER = os.getenv("TOKENIZER", "auto")
+# tiktoken encoding of the chat models prompts are budgeted for
+TOKENIZER_ENCODING = os.getenv("TOKENIZER_ENCODING", "cl100k_base")
+
+# GPT-style pre-tokenization: contractions, letter runs, digit groups of up to three,
+# punctuation runs and whitespace. Letter runs are capped, as BPE splits long rare words.
+TOKEN_PATTERN = re.compile(
+    r"'(?:s|t|re|ve|m|ll|d)| ?[^\W\d_]{1,8}| ?\d{1,3}| ?[^\s\w]+| ?_+|\s+(?!\S)|\s+",
+    re.IGNORECASE
+)
+
+class Tokenizer:
+    """Splits text into model tokens.
+
+    Implementations report where each token starts, which is enough to count
+    tokens and to cut text at a token boundary.
+    """
+
+    name = "tokenizer"
+
+    def token_offsets(self, text: str) -> List[int]:
+        """Character offset at which each token of text starts"""
+        raise NotImplementedError
+
+    def count(self, text: str) -> int:
+        return len(self.token_offsets(text))
+
+    def truncate(self, text: str, max_tokens: int) -> str:
+        """The longest prefix of text that is at most max_tokens tokens"""
+        offsets = self.token_offsets(text)
+        if len(offsets) <= max_tokens:
+            return text
+        return text[:offsets[max(max_tokens, 0)]]
+
+class RegexTokenizer(Tokenizer):
+    """Offline approximation of BPE tokens from the pre-tokenizer pattern alone"""
+
+    name = "regex"
+
+    def token_offsets(self, text: str) -> List[int]:
+        return [match.start() for match in TOKEN_PATTERN.finditer(text)]
+
+    def count(self, text: str) -> int:
+        return sum(1 for _ in TOKEN_PATTERN.finditer(text))
+
+class TiktokenTokenizer(Tokenizer):
+    """Exact token counts for OpenAI models; needs the tiktoken package and its encoding file"""
+
+    def __init__(self, encoding_name: str = TOKENIZER_ENCODING):
+        import tiktoken
+        self.encoding = tiktoken.get_encoding(encoding_name)
+        self.name = f"tiktoken:{encoding_name}"
+
+    def token_offsets(self, text: str) -> List[int]:
+        tokens = self.encoding.encode(text, disallowed_special=())
+        return self.encoding.decode_with_offsets(tokens)[1]
+
+    def count(self, text: str) -> int:
+        return len(self.encoding.encode(text, disallowed_special=()))
+
+def load_tokenizer(kind: str = TOKENIZER) -> Tokenizer:
+    """Build the configured tokenizer; "auto" falls back to the regex one when tiktoken is unavailable"""
+    if kind == "regex":
+        return RegexTokenizer()
+    try:
+        return TiktokenTokenizer()
+    except Exception as e:
+        if kind == "tiktoken":
+            raise
+        logger.info(f"tiktoken unavailable, counting tokens with the regex tokenizer: {str(e)}")
+        return RegexTokenizer()
+
+_tokenizer: Optional[Tokenizer] = None
+_tokenizer_lock = threading.Lock()
+
+def get_tokenizer() -> Tokenizer:
+    """Process-wide tokenizer, loaded on first use"""
+    global _tokenizer
+    if _tokenizer is None:
+        with _tokenizer_lock:
+            if _tokenizer is None:
+                _tokenizer = load_tokenizer()
+                logger.info(f"Counting tokens with {_tokenizer.name}")
+    return _tokenizer
+
+def count_tokens(text: str) -> int:
+    return get_tokenizer().count(text)
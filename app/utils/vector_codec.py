@@ -0,0 +1,88 @@
+import os
+from typing import List, Optional, Sequence
+import numpy as np
+
+# On-disk element formats for chunk embeddings; all little-endian
+EMBEDDING_DTYPES = {
+    "float32": np.dtype("<f4"),
+    "float16": np.dtype("<f2"),
+    "int8": np.dtype("i1"),
+}
+
+# Format used for newly written embeddings
+EMBEDDING_STORAGE_DTYPE = os.getenv("EMBEDDING_STORAGE_DTYPE", "float32")
+
+# int8 rows map their largest component to +-127 and store that scale as a
+# little-endian float32 prefix; high-dimensional unit vectors have components
+# far below 1, so a fixed scale would waste most of the 255 levels
+INT8_MAX = 127.0
+INT8_SCALE_DTYPE = np.dtype("<f4")
+INT8_HEADER_BYTES = INT8_SCALE_DTYPE.itemsize
+
+def normalize_vectors(vectors: np.ndarray) -> np.ndarray:
+    """L2-normalise a vector or each row of a matrix; zero vectors stay zero"""
+    vectors = np.asarray(vectors, dtype=np.float32)
+    norms = np.linalg.norm(vectors, axis=-1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return vectors / norms
+
+def _storage_dtype(dtype: str) -> np.dtype:
+    if dtype not in EMBEDDING_DTYPES:
+        raise ValueError(f"Unknown embedding dtype '{dtype}', expected one of {tuple(EMBEDDING_DTYPES)}")
+    return EMBEDDING_DTYPES[dtype]
+
+def encode_embedding(vector: Sequence[float], dtype: str = EMBEDDING_STORAGE_DTYPE) -> bytes:
+    """Normalise a vector and pack it into raw bytes for a bytea column"""
+    storage_dtype = _storage_dtype(dtype)
+    unit = normalize_vectors(vector)
+    if dtype == "int8":
+        peak = float(np.abs(unit).max()) if unit.size else 0.0
+        scale = peak / INT8_MAX if peak > 0 else 1.0
+        quantized = np.clip(np.rint(unit / scale), -INT8_MAX, INT8_MAX).astype(storage_dtype)
+        return np.asarray(scale, dtype=INT8_SCALE_DTYPE).tobytes() + quantized.tobytes()
+    return unit.astype(storage_dtype).tobytes()
+
+def _decode_int8_rows(raw: np.ndarray) -> np.ndarray:
+    # raw is a (rows, header + dim) uint8 view of scale-prefixed int8 vectors
+    scales = raw[:, :INT8_HEADER_BYTES].copy().view(INT8_SCALE_DTYPE)
+    values = raw[:, INT8_HEADER_BYTES:].view(np.int8).astype(np.float32)
+    return values * scales
+
+def decode_embedding(blob: bytes, dtype: str = "float32") -> np.ndarray:
+    """Unpack stored bytes into a float32 vector without an intermediate list"""
+    if dtype == "int8":
+        raw = np.frombuffer(blob, dtype=np.uint8)
+        return _decode_int8_rows(raw.reshape(1, -1))[0]
+    values = np.frombuffer(blob, dtype=_storage_dtype(dtype))
+    return values.astype(np.float32, copy=False)
+
+def decode_embeddings(blobs: List[bytes], dtype: str = "float32") -> np.ndarray:
+    """Unpack equally sized stored vectors into one float32 matrix"""
+    if not blobs:
+        return np.empty((0, 0), dtype=np.float32)
+    if dtype == "int8":
+        raw = np.frombuffer(b"".join(blobs), dtype=np.uint8)
+        return _decode_int8_rows(raw.reshape(len(blobs), -1))
+    return decode_embedding(b"".join(blobs), dtype).reshape(len(blobs), -1)
+
+def embedding_dimension(blob: Optional[bytes], dtype: str = "float32") -> int:
+    """Number of components in a stored vector"""
+    if not blob:
+        return 0
+    return dimension_from_size(len(blob), dtype)
+
+def dimension_from_size(size: Optional[int], dtype: str = "float32") -> int:
+    """Number of components in a stored vector of `size` bytes, without reading it"""
+    if not size:
+        return 0
+    if dtype == "int8":
+        return size - INT8_HEADER_BYTES
+    return size // _storage_dtype(dtype).itemsize
+
+def stored_embedding(embedding_bin: Optional[bytes], embedding_dtype: Optional[str], embedding_json) -> Optional[np.ndarray]:
+    """Decode a chunk's vector from its binary column, falling back to legacy JSON"""
+    if embedding_bin:
+        return decode_embedding(embedding_bin, embedding_dtype or "float32")
+    if embedding_json:
+        return np.asarray(embedding_json, dtype=np.float32)
+    return None
@@ -0,0 +1,730 @@
+import os
+import threading
+import time
+import uuid
+from typing import Dict, List, Optional, Tuple
+import numpy as np
+import faiss
+import logging
+from sqlalchemy import case, or_
+from sqlalchemy.orm import Session
+
+from app.db.database import SessionLocal
+from app.db.models import DocumentChunk
+from app.utils.corpus import get_corpus_version, get_corpus_changes
+from app.utils.embedding import (
+    normalize_vectors,
+    create_faiss_index,
+    search_faiss_index,
+    save_faiss_index,
+    load_faiss_index,
+)
+from app.utils.snapshot import Snapshot, open_snapshot, read_snapshot_meta, snapshot_lock, write_snapshot
+from app.utils.vector_codec import stored_embedding
+
+logger = logging.getLogger(__name__)
+
+# Rows fetched per round trip while building the index
+LOAD_BATCH_SIZE = 1000
+
+# Compact once this fraction of rows are tombstoned
+COMPACTION_THRESHOLD = float(os.getenv("VECTOR_INDEX_COMPACTION_THRESHOLD", "0.2"))
+
+# "flat" scans the matrix exactly; "ivf_flat", "ivf_pq" and "hnsw" add an ANN index
+INDEX_TYPE = os.getenv("VECTOR_INDEX_TYPE", "flat")
+# Below this many vectors an exact scan is already fast, so no ANN index is built
+ANN_MIN_VECTORS = int(os.getenv("VECTOR_INDEX_ANN_MIN_VECTORS", "10000"))
+# Optional path of a trained, empty ANN index reused across rebuilds to skip training
+TRAINED_INDEX_PATH = os.getenv("VECTOR_INDEX_TRAINED_PATH")
+
+# Memory-mapped snapshots shared by all workers; empty disables them
+SNAPSHOT_DIR = os.getenv("VECTOR_SNAPSHOT_DIR", "indexes")
+# How often a loaded index compares its version with the database
+VERSION_CHECK_INTERVAL = float(os.getenv("VECTOR_INDEX_VERSION_CHECK_SECONDS", "5"))
+# Minimum seconds between snapshot writes; changes in between are caught up from the change log
+SNAPSHOT_INTERVAL = float(os.getenv("VECTOR_SNAPSHOT_INTERVAL_SECONDS", "300"))
+# Beyond this many missed versions a worker remaps a snapshot or rebuilds instead of replaying
+CATCH_UP_MAX_CHANGES = int(os.getenv("VECTOR_INDEX_CATCH_UP_MAX_CHANGES", "1000"))
+# Filters matching at most this fraction of rows scan just those rows; broader ones
+# run the normal search with the other rows masked out
+FILTER_SCAN_FRACTION = float(os.getenv("VECTOR_INDEX_FILTER_SCAN_FRACTION", "0.3"))
+# Rough per-row cost of the id lists and lookup maps kept beside the matrix
+ROW_OVERHEAD_BYTES = 256
+# Above 1, the index is split by document across this many shard server processes
+VECTOR_SHARDS = int(os.getenv("VECTOR_SHARDS", "1"))
+
+def top_k_indices(scores: np.ndarray, k: int) -> np.ndarray:
+    """Return indices of the k highest scores, best first"""
+    if k <= 0 or scores.size == 0:
+        return np.empty(0, dtype=np.int64)
+    if k >= scores.size:
+        return np.argsort(-scores)
+
+    # Partial selection is O(N); only the k winners get fully sorted
+    candidates = np.argpartition(-scores, k - 1)[:k]
+    return candidates[np.argsort(-scores[candidates])]
+
+class _IndexState:
+    """Row storage for the vector index.
+
+    Rows are only ever appended: writers fill rows past `size` and publish them
+    by bumping `size` last, so a reader that captured `size` never sees a
+    half-written row. Growing past capacity or compacting produces a new state
+    object that is swapped in with a single assignment.
+
+    When an ANN index is attached it covers rows [0, ann_rows); rows appended
+    after it was built are scanned exactly until the next compaction.
+    """
+
+    def __init__(self, dimension: int, capacity: int):
+        self.dimension = dimension
+        self.matrix = np.zeros((capacity, dimension), dtype=np.float32)
+        self.alive = np.zeros(capacity, dtype=bool)
+        self.chunk_ids: List[uuid.UUID] = []
+        self.doc_ids: List[uuid.UUID] = []
+        self.row_of: Dict[uuid.UUID, int] = {}
+        self.rows_by_doc: Dict[uuid.UUID, List[int]] = {}
+        self.dead = 0
+        self.size = 0
+        self.ann: Optional[faiss.Index] = None
+        self.ann_rows = 0
+
+    @property
+    def capacity(self) -> int:
+        return self.matrix.shape[0]
+
+    @classmethod
+    def wrap(cls, matrix: np.ndarray, chunk_ids: List[uuid.UUID], doc_ids: List[uuid.UUID]) -> "_IndexState":
+        """Use an existing matrix, e.g. a read-only memmap, without copying it"""
+        state = cls(matrix.shape[1] if matrix.ndim == 2 else 0, 0)
+        state.matrix = matrix
+        state.alive = np.ones(len(chunk_ids), dtype=bool)
+        state.chunk_ids = list(chunk_ids)
+        state.doc_ids = list(doc_ids)
+        state.row_of = {chunk_id: row for row, chunk_id in enumerate(chunk_ids)}
+        for row, doc_id in enumerate(doc_ids):
+            state.rows_by_doc.setdefault(doc_id, []).append(row)
+        state.size = len(chunk_ids)
+        return state
+
+    def grown(self, capacity: int) -> "_IndexState":
+        """Copy this state into a larger buffer"""
+        state = _IndexState(self.dimension, capacity)
+        state.matrix[:self.size] = self.matrix[:self.size]
+        state.alive[:self.size] = self.alive[:self.size]
+        state.chunk_ids = list(self.chunk_ids)
+        state.doc_ids = list(self.doc_ids)
+        state.row_of = dict(self.row_of)
+        state.rows_by_doc = {doc_id: list(rows) for doc_id, rows in self.rows_by_doc.items()}
+        state.dead = self.dead
+        state.size = self.size
+        state.ann = self.ann
+        state.ann_rows = self.ann_rows
+        return state
+
+    def append(self, chunk_ids: List[uuid.UUID], doc_ids: List[uuid.UUID], vectors: np.ndarray) -> None:
+        """Write rows past the current size, then publish them"""
+        start = self.size
+        end = start + len(chunk_ids)
+        self.matrix[start:end] = vectors
+        self.alive[start:end] = True
+        for row, (chunk_id, doc_id) in enumerate(zip(chunk_ids, doc_ids), start):
+            self.chunk_ids.append(chunk_id)
+            self.doc_ids.append(doc_id)
+            self.row_of[chunk_id] = row
+            self.rows_by_doc.setdefault(doc_id, []).append(row)
+        self.size = end
+
+    def tombstone(self, rows) -> None:
+        """Mark rows dead and drop them from the lookup maps"""
+        self.alive[rows] = False
+        for row in rows:
+            self.row_of.pop(self.chunk_ids[row], None)
+
+        dead_rows = set(rows)
+        for doc_id in {self.doc_ids[row] for row in rows}:
+            remaining = [row for row in self.rows_by_doc.get(doc_id, []) if row not in dead_rows]
+            if remaining:
+                self.rows_by_doc[doc_id] = remaining
+            else:
+                self.rows_by_doc.pop(doc_id, None)
+        self.dead += len(rows)
+
+def _ann_selector(alive: np.ndarray):
+    """Build a FAISS selector admitting only the True rows; returns (selector, bitmap)"""
+    # The bitmap must outlive the search call, so it is returned alongside
+    bitmap = np.packbits(alive, bitorder="little")
+    return faiss.IDSelectorBitmap(len(alive), faiss.swig_ptr(bitmap)), bitmap
+
+class VectorIndex:
+    """Process-wide in-memory index of chunk embeddings.
+
+    Embeddings are held as one contiguous, L2-normalised float32 matrix so a
+    query is a single matrix-vector product instead of a per-row scan. New
+    chunks are appended in place, deleted documents are tombstoned, and a
+    background compaction drops dead rows once they pile up.
+
+    The index tracks the corpus version it reflects. Workers start from the
+    latest memory-mapped snapshot, so the matrix pages are shared through the
+    page cache, and replay the corpus change log for versions written since.
+    Snapshots are written at most every SNAPSHOT_INTERVAL seconds; only when
+    the log cannot bridge the gap does one worker rebuild from Postgres.
+    """
+
+    def __init__(self, index_type: str = INDEX_TYPE):
+        self.index_type = index_type
+        self._load_lock = threading.Lock()
+        # Serialises writers; readers never take it
+        self._write_lock = threading.Lock()
+        # Serialises whole-index rebuilds, which can run for a while
+        self._rebuild_lock = threading.Lock()
+        self._compacting = False
+        self._refreshing = False
+        self._snapshot_timer: Optional[threading.Timer] = None
+        self._snapshot_written_at = time.monotonic()
+        self._loaded = False
+        self._state = _IndexState(0, 0)
+        # Corpus version the contents reflect; -1 until loaded
+        self.version = -1
+        self._version_checked_at = 0.0
+
+    @property
+    def loaded(self) -> bool:
+        return self._loaded
+
+    @property
+    def size(self) -> int:
+        """Number of live vectors"""
+        state = self._state
+        return state.size - state.dead
+
+    @property
+    def snapshot_dir(self) -> str:
+        """Directory of this index's snapshots; empty when snapshots are disabled"""
+        return SNAPSHOT_DIR
+
+    @property
+    def memory_bytes(self) -> int:
+        """Approximate footprint: the allocated matrix plus per-row bookkeeping, excluding any ANN index"""
+        state = self._state
+        return state.matrix.nbytes + state.size * ROW_OVERHEAD_BYTES
+
+    def build(
+        self,
+        chunk_ids: List[uuid.UUID],
+        embeddings,
+        doc_ids: Optional[List[uuid.UUID]] = None,
+        version: int = 0
+    ) -> None:
+        """Replace index contents with the given chunk ids and embeddings"""
+        if doc_ids is None:
+            doc_ids = [None] * len(chunk_ids)
+        if len(chunk_ids) == 0:
+            vectors = np.empty((0, 0), dtype=np.float32)
+        else:
+            vectors = normalize_vectors(np.asarray(embeddings, dtype=np.float32))
+        if vectors.shape[0] != len(chunk_ids) or len(doc_ids) != len(chunk_ids):
+            raise ValueError("chunk_ids, doc_ids and embeddings must have the same length")
+
+        state = _IndexState(vectors.shape[1], len(chunk_ids))
+        state.append(list(chunk_ids), list(doc_ids), vectors)
+        with self._rebuild_lock:
+            self._attach_ann(state)
+            self._install(state, version)
+        logger.info(f"Built {self.index_type} vector index with {len(chunk_ids)} vectors at corpus version {version}")
+
+    def _install(self, state: _IndexState, version: int) -> None:
+        with self._write_lock:
+            self._state = state
+            self.version = version
+            self._loaded = True
+
+    def _attach_ann(self, state: _IndexState) -> None:
+        """Build the configured ANN index over all rows of a fresh state"""
+        if self.index_type == "flat" or state.size < ANN_MIN_VECTORS:
+            return
+
+        # Only IVF variants need training; HNSW builds incrementally
+        reuse_training = bool(TRAINED_INDEX_PATH) and self.index_type.startswith("ivf")
+        trained = None
+        if reuse_training and os.path.exists(TRAINED_INDEX_PATH):
+            trained = load_faiss_index(TRAINED_INDEX_PATH)
+            if trained.d != state.dimension:
+                logger.warning(f"Ignoring trained index at {TRAINED_INDEX_PATH}: dimension {trained.d} != {state.dimension}")
+                trained = None
+
+        state.ann = create_faiss_index(
+            state.matrix[:state.size], state.dimension, self.index_type, trained_index=trained
+        )
+        state.ann_rows = state.size
+        if reuse_training and trained is None:
+            save_faiss_index(state.ann, TRAINED_INDEX_PATH, trained_only=True)
+
+    @staticmethod
+    def _fetch_vectors(db: Session, *filters) -> Tuple[List[uuid.UUID], List[uuid.UUID], List[np.ndarray]]:
+        """Stream (chunk ids, doc ids, vectors) of chunks with embeddings matching the filters"""
+        chunk_ids = []
+        doc_ids = []
+        vectors = []
+        rows = db.query(
+            DocumentChunk.id,
+            DocumentChunk.doc_id,
+            DocumentChunk.embedding_bin,
+            DocumentChunk.embedding_dtype,
+            # Only read for rows the binary backfill has not reached yet
+            case((DocumentChunk.embedding_bin.is_(None), DocumentChunk.embedding))
+        ).filter(
+            or_(DocumentChunk.embedding_bin.isnot(None), DocumentChunk.embedding.isnot(None)),
+            *filters
+        ).yield_per(LOAD_BATCH_SIZE)
+
+        for chunk_id, doc_id, embedding_bin, embedding_dtype, embedding_json in rows:
+            vector = stored_embedding(embedding_bin, embedding_dtype, embedding_json)
+            if vector is not None and vector.size:
+                chunk_ids.append(chunk_id)
+                doc_ids.append(doc_id)
+                vectors.append(vector)
+        return chunk_ids, doc_ids, vectors
+
+    def load(self, db: Session) -> None:
+        """Build the index from all chunk embeddings stored in the database"""
+        # Read the version first: rows committed meanwhile only make it look older
+        version = get_corpus_version(db)
+        chunk_ids, doc_ids, vectors = self._fetch_vectors(db)
+        self.build(chunk_ids, np.vstack(vectors) if vectors else [], doc_ids, version)
+
+    def catch_up(self, db: Session, target: int) -> bool:
+        """Replay logged corpus changes up to `target`; False if the log cannot bridge the gap"""
+        start = self.version
+        if not self._loaded or start < 0 or target < start:
+            return False
+        if target == start:
+            return True
+        if target - start > CATCH_UP_MAX_CHANGES:
+            return False
+
+        changes = get_corpus_changes(db, start, target)
+        if [version for version, _ in changes] != list(range(start + 1, target + 1)):
+            # Versions from before the change log existed, or pruned entries
+            return False
+
+        # Re-reading a document's current rows makes replay idempotent, so each
+        # document is applied once even if several versions touched it
+        for doc_id in dict.fromkeys(doc_id for _, doc_id in changes):
+            chunk_ids, _, vectors = self._fetch_vectors(db, DocumentChunk.doc_id == doc_id)
+            self.remove_document(doc_id)
+            if chunk_ids:
+                self.add(chunk_ids, doc_id, np.vstack(vectors))
+
+        with self._write_lock:
+            if self.version == start:
+                self.version = target
+        logger.info(f"Caught vector index up from corpus version {start} to {target} ({len(changes)} changes)")
+        return True
+
+    def load_snapshot(self, snapshot: Snapshot) -> None:
+        """Serve directly from a memory-mapped snapshot"""
+        state = _IndexState.wrap(snapshot.matrix, snapshot.chunk_ids, snapshot.doc_ids)
+        with self._rebuild_lock:
+            if snapshot.ann_path is not None and self.index_type != "flat":
+                state.ann = load_faiss_index(snapshot.ann_path, mmap=self.index_type.startswith("ivf"))
+                state.ann_rows = state.size
+            else:
+                self._attach_ann(state)
+            self._install(state, snapshot.corpus_version)
+        logger.info(f"Mapped vector snapshot {snapshot.path.name} with {state.size} vectors")
+
+    def refresh(self, db: Session) -> None:
+        """Bring the index up to the database's corpus version.
+
+        A loaded index replays the change log. Otherwise the latest snapshot is
+        mapped and the log replayed from its version; only when that fails does
+        one worker rebuild from the database and publish a fresh snapshot.
+        """
+        target = get_corpus_version(db)
+        if self.catch_up(db, target):
+            return
+
+        if not self.snapshot_dir:
+            self.load(db)
+            return
+
+        snapshot = open_snapshot(self.snapshot_dir)
+        if snapshot is not None and self._usable_snapshot(snapshot, target):
+            self.load_snapshot(snapshot)
+            if self.catch_up(db, target):
+                return
+
+        with snapshot_lock(self.snapshot_dir):
+            # Another worker may have published it while we waited
+            snapshot = open_snapshot(self.snapshot_dir)
+            if snapshot is not None and snapshot.corpus_version == target:
+                self.load_snapshot(snapshot)
+                return
+            self.load(db)
+            self._write_snapshot()
+            self._snapshot_written_at = time.monotonic()
+
+    def _usable_snapshot(self, snapshot: Snapshot, target: int) -> bool:
+        # Not ahead of the database, and newer than what this process already has
+        if snapshot.corpus_version > target:
+            return False
+        return not self._loaded or snapshot.corpus_version > self.version
+
+    def ensure_loaded(self, db: Session) -> None:
+        """Load the index on first use, then periodically check it is current"""
+        if not self._loaded:
+            with self._load_lock:
+                if not self._loaded:
+                    self.refresh(db)
+            return
+
+        now = time.monotonic()
+        if now - self._version_checked_at < VERSION_CHECK_INTERVAL:
+            return
+        self._version_checked_at = now
+        if get_corpus_version(db) != self.version:
+            self._refresh_in_background()
+
+    def _refresh_in_background(self) -> None:
+        """Refresh a stale index without blocking readers, who keep the old state"""
+        with self._write_lock:
+            if self._refreshing:
+                return
+            self._refreshing = True
+
+        def run():
+            db = SessionLocal()
+            try:
+                with self._load_lock:
+                    self.refresh(db)
+            except Exception as e:
+                logger.error(f"Vector index refresh failed: {str(e)}")
+            finally:
+                db.close()
+                self._refreshing = False
+
+        threading.Thread(target=run, name="vector-index-refresh", daemon=True).start()
+
+    def advance_version(self, version: int) -> None:
+        """Record that this process applied the change that produced `version`.
+
+        Changes made by other processes leave a gap, which the next version
+        check notices and repairs with a refresh.
+        """
+        with self._write_lock:
+            if self.version == version - 1:
+                self.version = version
+
+    def _write_snapshot(self) -> None:
+        """Write the live rows to a new snapshot unless a newer one exists"""
+        with self._write_lock:
+            state = self._state
+            version = self.version
+            size = state.size
+            live_rows = np.flatnonzero(state.alive[:size]) if state.dead else None
+
+        # Rows below `size` never change, so they can be read without the lock
+        if live_rows is None:
+            matrix = state.matrix[:size]
+            chunk_ids = state.chunk_ids[:size]
+            doc_ids = state.doc_ids[:size]
+        else:
+            matrix = state.matrix[live_rows]
+            chunk_ids = [state.chunk_ids[row] for row in live_rows]
+            doc_ids = [state.doc_ids[row] for row in live_rows]
+
+        meta = read_snapshot_meta(self.snapshot_dir)
+        if meta is not None and meta["corpus_version"] >= version:
+            return
+
+        def write_ann(path):
+            # Only reusable when the ANN rows line up with the snapshot rows
+            if state.ann is None or live_rows is not None or state.ann_rows != size:
+                return False
+            save_faiss_index(state.ann, path)
+            return True
+
+        write_snapshot(self.snapshot_dir, version, chunk_ids, doc_ids, matrix, write_ann)
+
+    def save_snapshot(self) -> None:
+        """Publish the current contents as the shared snapshot"""
+        if not self.snapshot_dir or not self._loaded:
+            return
+        with snapshot_lock(self.snapshot_dir):
+            self._write_snapshot()
+
+    def schedule_snapshot(self) -> None:
+        """Save a snapshot in the background, at most once every SNAPSHOT_INTERVAL seconds.
+
+        Workers that see a newer version before then replay the change log, so
+        bursts of ingestion cost one full write per interval, not one per document.
+        """
+        if not self.snapshot_dir or not self._loaded:
+            return
+        with self._write_lock:
+            if self._snapshot_timer is not None:
+                return
+            delay = max(0.0, self._snapshot_written_at + SNAPSHOT_INTERVAL - time.monotonic())
+
+            def run():
+                with self._write_lock:
+                    self._snapshot_timer = None
+                try:
+                    self.save_snapshot()
+                except Exception as e:
+                    logger.error(f"Vector snapshot write failed: {str(e)}")
+                finally:
+                    self._snapshot_written_at = time.monotonic()
+
+            self._snapshot_timer = threading.Timer(delay, run)
+            self._snapshot_timer.name = "vector-index-snapshot"
+            self._snapshot_timer.daemon = True
+            self._snapshot_timer.start()
+
+    def add(self, chunk_ids: List[uuid.UUID], doc_id: uuid.UUID, embeddings: List[List[float]]) -> int:
+        """Append a document's new chunk vectors; returns the number of rows added"""
+        if len(chunk_ids) != len(embeddings):
+            raise ValueError("chunk_ids and embeddings must have the same length")
+        if not chunk_ids:
+            return 0
+
+        vectors = normalize_vectors(np.asarray(embeddings, dtype=np.float32))
+        with self._write_lock:
+            state = self._state
+            # The initial load may already have picked these rows up
+            fresh = [i for i, chunk_id in enumerate(chunk_ids) if chunk_id not in state.row_of]
+            if not fresh:
+                return 0
+
+            if state.dimension == 0:
+                state = _IndexState(vectors.shape[1], max(len(fresh), 1024))
+            elif vectors.shape[1] != state.dimension:
+                raise ValueError(
+                    f"Embedding dimension {vectors.shape[1]} does not match index dimension {state.dimension}"
+                )
+            if state.size + len(fresh) > state.capacity:
+                state = state.grown(max(2 * state.capacity, state.size + len(fresh)))
+
+            state.append([chunk_ids[i] for i in fresh], [doc_id] * len(fresh), vectors[fresh])
+            self._state = state
+
+        logger.info(f"Appended {len(fresh)} vectors for document {doc_id} to vector index")
+        return len(fresh)
+
+    def remove_document(self, doc_id: uuid.UUID) -> int:
+        """Tombstone all vectors of a document; returns the number of rows removed"""
+        with self._write_lock:
+            state = self._state
+            rows = list(state.rows_by_doc.get(doc_id, []))
+            if not rows:
+                return 0
+            state.tombstone(rows)
+
+        logger.info(f"Tombstoned {len(rows)} vectors for document {doc_id}")
+        self.maybe_compact()
+        return len(rows)
+
+    def compact(self) -> None:
+        """Rebuild the index without tombstoned rows and swap it in atomically.
+
+        The copy and any ANN training happen outside the writer lock; appends
+        and tombstones that land meanwhile are replayed before the swap.
+        """
+        with self._rebuild_lock:
+            with self._write_lock:
+                state = self._state
+                snapshot_size = state.size
+                live_rows = np.flatnonzero(state.alive[:snapshot_size])
+                if len(live_rows) == snapshot_size:
+                    return
+
+            compacted = _IndexState(state.dimension, max(len(live_rows), 1024))
+            compacted.append(
+                [state.chunk_ids[row] for row in live_rows],
+                [state.doc_ids[row] for row in live_rows],
+                state.matrix[live_rows]
+            )
+            self._attach_ann(compacted)
+
+            with self._write_lock:
+                current = self._state
+                # Tombstones first, so re-parsed documents keep their new rows
+                died = np.flatnonzero(~current.alive[live_rows])
+                if len(died):
+                    compacted.tombstone(died.tolist())
+
+                tail = [row for row in range(snapshot_size, current.size) if current.alive[row]]
+                if tail:
+                    if compacted.size + len(tail) > compacted.capacity:
+                        compacted = compacted.grown(compacted.size + len(tail))
+                    compacted.append(
+                        [current.chunk_ids[row] for row in tail],
+                        [current.doc_ids[row] for row in tail],
+                        current.matrix[tail]
+                    )
+                self._state = compacted
+
+        logger.info(f"Compacted vector index: dropped {snapshot_size - len(live_rows)} rows, {compacted.size - compacted.dead} remain")
+        # A compacted index makes a smaller snapshot
+        self.schedule_snapshot()
+
+    def maybe_compact(self) -> bool:
+        """Start a background compaction if enough rows are tombstoned"""
+        state = self._state
+        if state.size == 0 or state.dead / state.size < COMPACTION_THRESHOLD:
+            return False
+
+        with self._write_lock:
+            if self._compacting:
+                return False
+            self._compacting = True
+
+        def run():
+            try:
+                self.compact()
+            except Exception as e:
+                logger.error(f"Vector index compaction failed: {str(e)}")
+            finally:
+                self._compacting = False
+
+        threading.Thread(target=run, name="vector-index-compaction", daemon=True).start()
+        return True
+
+    def search(
+        self,
+        query_embedding: List[float],
+        k: int,
+        nprobe: Optional[int] = None,
+        ef_search: Optional[int] = None
+    ) -> List[Tuple[uuid.UUID, float]]:
+        """Return the k most similar (chunk_id, cosine score) pairs, best first.
+
+        nprobe and ef_search tune IVF and HNSW indexes for this call only.
+        """
+        return self.search_batch([query_embedding], k, nprobe, ef_search)[0]
+
+    def search_batch(
+        self,
+        query_embeddings: List[List[float]],
+        k: int,
+        nprobe: Optional[int] = None,
+        ef_search: Optional[int] = None,
+        allowed: Optional[np.ndarray] = None
+    ) -> List[List[Tuple[uuid.UUID, float]]]:
+        """Search several queries at once with a single matrix-matrix product.
+
+        allowed, a boolean mask over rows, restricts the search to its True rows.
+        """
+        state = self._state
+        size = state.size
+        if size == state.dead or len(query_embeddings) == 0:
+            return [[] for _ in query_embeddings]
+
+        query_matrix = self._query_matrix(state, query_embeddings)
+        searchable = state.alive[:size]
+        if allowed is not None:
+            searchable = searchable & allowed[:size]
+
+        hits = [[] for _ in range(len(query_matrix))]
+        start = 0
+        if state.ann is not None:
+            start = state.ann_rows
+            restricted = state.dead or allowed is not None
+            selector, bitmap = _ann_selector(searchable[:start]) if restricted else (None, None)
+            scores, rows = search_faiss_index(
+                state.ann, query_matrix, min(k, start), nprobe, ef_search, selector
+            )
+            for query_hits, query_rows, query_scores in zip(hits, rows, scores):
+                query_hits.extend((int(row), float(score)) for row, score in zip(query_rows, query_scores) if row >= 0)
+
+        # Exact scan over every row, or just those appended since the ANN build
+        if start < size:
+            scores = state.matrix[start:size] @ query_matrix.T
+            if state.dead or allowed is not None:
+                scores[~searchable[start:size]] = -np.inf
+            for column, query_hits in enumerate(hits):
+                column_scores = scores[:, column]
+                query_hits.extend(
+                    (start + int(i), float(column_scores[i]))
+                    for i in top_k_indices(column_scores, k)
+                    if column_scores[i] != -np.inf
+                )
+
+        results = []
+        for query_hits in hits:
+            query_hits.sort(key=lambda hit: hit[1], reverse=True)
+            results.append([(state.chunk_ids[row], score) for row, score in query_hits[:k]])
+        return results
+
+    @staticmethod
+    def _query_matrix(state: _IndexState, query_embeddings: List[List[float]]) -> np.ndarray:
+        query_matrix = normalize_vectors(np.atleast_2d(np.asarray(query_embeddings, dtype=np.float32)))
+        if query_matrix.shape[1] != state.dimension:
+            raise ValueError(
+                f"Query dimension {query_matrix.shape[1]} does not match index dimension {state.dimension}"
+            )
+        return query_matrix
+
+    @staticmethod
+    def _search_rows(
+        state: _IndexState,
+        rows: List[int],
+        query_matrix: np.ndarray,
+        k: int
+    ) -> List[List[Tuple[uuid.UUID, float]]]:
+        """Exact scan of just the given rows"""
+        scores = state.matrix[rows] @ query_matrix.T
+        return [
+            [(state.chunk_ids[rows[i]], float(scores[i, column])) for i in top_k_indices(scores[:, column], k)]
+            for column in range(len(query_matrix))
+        ]
+
+    def search_candidates(
+        self,
+        query_embedding: List[float],
+        chunk_ids: List[uuid.UUID],
+        k: int
+    ) -> List[Tuple[uuid.UUID, float]]:
+        """Score only the given chunks, e.g. a lexical prefilter's hits; unknown or deleted ids are skipped"""
+        state = self._state
+        rows = [row for row in (state.row_of.get(chunk_id) for chunk_id in chunk_ids) if row is not None]
+        if not rows:
+            return []
+        return self._search_rows(state, rows, self._query_matrix(state, [query_embedding]), k)[0]
+
+    def search_documents(
+        self,
+        query_embeddings: List[List[float]],
+        doc_ids: List[uuid.UUID],
+        k: int,
+        nprobe: Optional[int] = None,
+        ef_search: Optional[int] = None
+    ) -> List[List[Tuple[uuid.UUID, float]]]:
+        """search_batch restricted to the chunks of the given documents.
+
+        A narrow filter scans only its documents' rows, found through the
+        per-document row lists, so its cost follows the filter's size rather
+        than the corpus size.
+        """
+        state = self._state
+        size = state.size
+        rows = [row for doc_id in doc_ids for row in state.rows_by_doc.get(doc_id, ()) if row < size]
+        if not rows or len(query_embeddings) == 0:
+            return [[] for _ in query_embeddings]
+
+        if len(rows) > FILTER_SCAN_FRACTION * (size - state.dead):
+            allowed = np.zeros(size, dtype=bool)
+            allowed[rows] = True
+            return self.search_batch(query_embeddings, k, nprobe, ef_search, allowed=allowed)
+        return self._search_rows(state, rows, self._query_matrix(state, query_embeddings), k)
+
+_vector_index = VectorIndex()
+
+def get_vector_index() -> VectorIndex:
+    """Get the process-wide vector index, or the scatter-gather front end to its shards"""
+    if VECTOR_SHARDS > 1:
+        # Imported here: the shard module builds on this one
+        from app.utils.shards import get_sharded_index
+        return get_sharded_index()
+    return _vector_index
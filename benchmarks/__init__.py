@@ -0,0 +1 @@
+# Benchmarks for VerdictVault retrieval and ingestion paths
@@ -0,0 +1,78 @@
+#!/usr/bin/env python3
+"""
+Recall@k vs latency benchmark for the approximate index types
+Compares IVF-Flat, IVF-PQ and HNSW against the exact flat baseline
+Run with: python -m benchmarks.ann_recall --num-vectors 200000
+"""
+
+import argparse
+import os
+import time
+import numpy as np
+
+# The embedding module builds an OpenAI client at import; no calls are made here
+os.environ.setdefault("OPENAI_API_KEY", "benchmark")
+
+from app.utils.embedding import create_faiss_index, search_faiss_index, normalize_vectors
+
+def make_corpus(num_vectors: int, dim: int, num_queries: int, seed: int = 0):
+    """Generate clustered unit vectors, loosely shaped like text embeddings"""
+    rng = np.random.default_rng(seed)
+    centers = rng.standard_normal((max(num_vectors // 500, 8), dim)).astype('float32')
+    labels = rng.integers(0, len(centers), num_vectors + num_queries)
+    points = centers[labels] + 0.6 * rng.standard_normal((len(labels), dim)).astype('float32')
+    points = normalize_vectors(points)
+    return points[:num_vectors], points[num_vectors:]
+
+def time_search(index, queries: np.ndarray, k: int, tuning: dict):
+    """Run queries one at a time, as the API does; returns (ids, latencies_ms)"""
+    ids = np.empty((len(queries), k), dtype=np.int64)
+    latencies = []
+    for i, query in enumerate(queries):
+        start = time.perf_counter()
+        _, found = search_faiss_index(index, query[None, :], k, **tuning)
+        latencies.append((time.perf_counter() - start) * 1000)
+        ids[i] = found[0]
+    return ids, np.array(latencies)
+
+def recall_at_k(found: np.ndarray, truth: np.ndarray) -> float:
+    """Fraction of the exact top-k that the approximate search returned"""
+    hits = sum(len(set(f) & set(t)) for f, t in zip(found, truth))
+    return hits / truth.size
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--num-vectors", type=int, default=100000)
+    parser.add_argument("--dim", type=int, default=384)
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--k", type=int, default=10)
+    args = parser.parse_args()
+
+    corpus, queries = make_corpus(args.num_vectors, args.dim, args.queries)
+    print(f"{args.num_vectors} vectors x {args.dim} dims, {args.queries} queries, k={args.k}\n")
+
+    configs = [("flat", {}, [None])]
+    configs.append(("ivf_flat", {}, [("nprobe", n) for n in (1, 8, 32, 128)]))
+    configs.append(("ivf_pq", {"pq_m": args.dim // 4}, [("nprobe", n) for n in (8, 32, 128)]))
+    configs.append(("hnsw", {}, [("ef_search", n) for n in (16, 64, 256)]))
+
+    truth = None
+    print(f"{'index':<10} {'setting':<16} {'build s':>8} {'recall@k':>9} {'p50 ms':>8} {'p95 ms':>8}")
+    for index_type, build_args, settings in configs:
+        start = time.perf_counter()
+        index = create_faiss_index(corpus, args.dim, index_type, **build_args)
+        build_s = time.perf_counter() - start
+
+        for setting in settings:
+            tuning = dict([setting]) if setting else {}
+            found, latencies = time_search(index, queries, args.k, tuning)
+            if truth is None:
+                truth = found
+            label = f"{setting[0]}={setting[1]}" if setting else "exact"
+            print(
+                f"{index_type:<10} {label:<16} {build_s:>8.2f} {recall_at_k(found, truth):>9.3f} "
+                f"{np.percentile(latencies, 50):>8.3f} {np.percentile(latencies, 95):>8.3f}"
+            )
+
+if __name__ == "__main__":
+    main()
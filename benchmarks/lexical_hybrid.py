@@ -0,0 +1,98 @@
+#!/usr/bin/env python3
+"""
+Latency benchmark for lexical, hybrid and prefiltered retrieval
+Compares BM25, reciprocal rank fusion and lexical prefiltering against the
+full vector scan, on a synthetic corpus where every chunk carries a case number
+Run with: python -m benchmarks.lexical_hybrid --num-chunks 100000
+"""
+
+import argparse
+import os
+import time
+import uuid
+from unittest.mock import patch
+import numpy as np
+
+# The embedding module builds an OpenAI client at import; no calls are made here
+os.environ.setdefault("OPENAI_API_KEY", "benchmark")
+
+from app.utils.lexical_index import LexicalIndex
+from app.utils.vector_index import VectorIndex
+from app.utils.retrieval import search_index
+from benchmarks.ann_recall import make_corpus
+
+def make_texts(num_chunks: int, vocabulary: int, words: int, seed: int = 0):
+    """Chunks of Zipf-distributed words, each citing its own case number"""
+    rng = np.random.default_rng(seed)
+    vocab = [f"term{i}" for i in range(vocabulary)]
+    ids = np.minimum(rng.zipf(1.3, (num_chunks, words)), vocabulary) - 1
+    case_numbers = [f"2:{i % 100:02d}-cv-{i:06d}" for i in range(num_chunks)]
+    texts = [" ".join(vocab[j] for j in row) + f" No. {case}" for row, case in zip(ids, case_numbers)]
+    return texts, case_numbers
+
+def time_queries(run, queries):
+    """Run queries one at a time, as the API does; returns (results, latencies_ms)"""
+    results, latencies = [], []
+    for query in queries:
+        start = time.perf_counter()
+        results.append(run(query))
+        latencies.append((time.perf_counter() - start) * 1000)
+    return results, np.array(latencies)
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--num-chunks", type=int, default=50000)
+    parser.add_argument("--dim", type=int, default=384)
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--vocabulary", type=int, default=20000)
+    parser.add_argument("--words", type=int, default=120)
+    parser.add_argument("--k", type=int, default=10)
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(1)
+    vectors, query_vectors = make_corpus(args.num_chunks, args.dim, args.queries)
+    texts, case_numbers = make_texts(args.num_chunks, args.vocabulary, args.words)
+    chunk_ids = [uuid.uuid4() for _ in range(args.num_chunks)]
+    doc_ids = [uuid.uuid4() for _ in range(args.num_chunks)]
+
+    start = time.perf_counter()
+    vector_index = VectorIndex("flat")
+    vector_index.build(chunk_ids, vectors, doc_ids)
+    vector_build_s = time.perf_counter() - start
+    start = time.perf_counter()
+    lexical_index = LexicalIndex()
+    lexical_index.build(chunk_ids, doc_ids, texts)
+    lexical_build_s = time.perf_counter() - start
+    print(f"{args.num_chunks} chunks x {args.dim} dims, {args.queries} queries, k={args.k}")
+    print(f"build: vector {vector_build_s:.2f}s, lexical {lexical_build_s:.2f}s\n")
+
+    # Half the queries look up a case number, half mix a few common and rare terms
+    targets = rng.integers(0, args.num_chunks, args.queries)
+    queries = []
+    for i, target in enumerate(targets):
+        if i % 2 == 0:
+            queries.append((f"docket {case_numbers[target]}", query_vectors[i], chunk_ids[target]))
+        else:
+            words = " ".join(f"term{j}" for j in rng.integers(0, 2000, 3))
+            queries.append((words, query_vectors[i], None))
+
+    runs = [
+        ("vector scan", lambda q: vector_index.search(q[1], args.k)),
+        ("bm25", lambda q: lexical_index.search(q[0], args.k)),
+        ("hybrid rrf", lambda q: search_index(vector_index, [q[1]], args.k, queries=[q[0]], mode="hybrid")[0]),
+        ("prefilter", lambda q: search_index(vector_index, [q[1]], args.k, queries=[q[0]], mode="prefilter")[0]),
+    ]
+
+    print(f"{'mode':<12} {'p50 ms':>8} {'p95 ms':>8} {'case no. hit@k':>15}")
+    with patch("app.utils.retrieval.get_lexical_index", return_value=lexical_index):
+        for label, run in runs:
+            results, latencies = time_queries(run, queries)
+            lookups = [(hits, target) for hits, (_, _, target) in zip(results, queries) if target is not None]
+            found = sum(1 for hits, target in lookups if target in [chunk_id for chunk_id, _ in hits])
+            print(
+                f"{label:<12} {np.percentile(latencies, 50):>8.3f} {np.percentile(latencies, 95):>8.3f} "
+                f"{found / len(lookups):>15.3f}"
+            )
+
+if __name__ == "__main__":
+    main()
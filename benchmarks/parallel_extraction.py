@@ -0,0 +1,77 @@
+#!/usr/bin/env python3
+"""
+Serial versus process-pool text extraction of large PDFs
+Writes synthetic transcripts of several hundred pages, each page dense with
+text that runs on into the next, then times extract_chunks_from_pdf serially
+and with the extraction pool at each worker count, checking the chunks match
+Run with: python -m benchmarks.parallel_extraction --pages 300 800 --workers 2 4 8
+"""
+
+import argparse
+import os
+import tempfile
+import time
+from unittest.mock import patch
+import fitz
+import numpy as np
+
+from app.utils import parser
+
+WORDS = (
+    "plaintiff defendant counsel witness court exhibit testimony objection sustained overruled "
+    "contract breach damages liability negligence statute precedent appeal judgment motion"
+).split()
+
+def make_transcript(path: str, pages: int, seed: int = 0) -> None:
+    """A PDF of full pages of pseudo-testimony; the last sentence of each page continues on the next"""
+    rng = np.random.default_rng(seed)
+    doc = fitz.open()
+    for _ in range(pages):
+        words = rng.choice(WORDS, size=450)
+        sentences = " ".join(
+            word + ("." if i % 14 == 13 else "")
+            for i, word in enumerate(words)
+        )
+        page = doc.new_page()
+        page.insert_textbox(fitz.Rect(54, 54, 558, 738), sentences, fontsize=9)
+    doc.save(path)
+    doc.close()
+
+def time_extraction(path: str, workers: int, repeats: int):
+    """Best-of-repeats seconds and chunks; workers below 2 extract serially"""
+    best, chunks = float("inf"), None
+    with patch.object(parser, "PARALLEL_EXTRACTION_MIN_PAGES", 1), \
+            patch.object(parser, "PARALLEL_EXTRACTION_WORKERS", workers):
+        if workers > 1:
+            # Warm the pool so spawn and import time is not billed to the first document
+            parser.get_extraction_pool().submit(os.getpid).result()
+        try:
+            for _ in range(repeats):
+                start = time.perf_counter()
+                chunks = parser.extract_chunks_from_pdf(path)
+                best = min(best, time.perf_counter() - start)
+        finally:
+            parser._reset_extraction_pool()
+    return best, chunks
+
+def main():
+    arg_parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    arg_parser.add_argument("--pages", type=int, nargs="+", default=[300, 800])
+    arg_parser.add_argument("--workers", type=int, nargs="+", default=[2, 4])
+    arg_parser.add_argument("--repeats", type=int, default=3)
+    args = arg_parser.parse_args()
+
+    print(f"{os.cpu_count()} CPUs, best of {args.repeats}\n")
+    print(f"{'pages':>6} {'workers':>8} {'seconds':>9} {'speedup':>8} {'same chunks':>12}")
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        for pages in args.pages:
+            path = os.path.join(tmp_dir, f"transcript-{pages}.pdf")
+            make_transcript(path, pages)
+            serial_s, serial_chunks = time_extraction(path, 1, args.repeats)
+            print(f"{pages:>6} {'serial':>8} {serial_s:>9.3f} {1.0:>8.2f} {'':>12}")
+            for workers in args.workers:
+                seconds, chunks = time_extraction(path, workers, args.repeats)
+                print(f"{pages:>6} {workers:>8} {seconds:>9.3f} {serial_s / seconds:>8.2f} {str(chunks == serial_chunks):>12}")
+
+if __name__ == "__main__":
+    main()
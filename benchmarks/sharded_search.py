@@ -0,0 +1,112 @@
+#!/usr/bin/env python3
+"""
+Latency of scatter-gather search across local shard processes
+Starts one shard server process per shard on this machine, each holding the
+doc_id-hash slice of a synthetic corpus, and compares merged results and
+latency with a single in-process index. The last run stops one shard to show
+partial results
+Run with: python -m benchmarks.sharded_search --num-chunks 500000 --shards 4
+"""
+
+import argparse
+import multiprocessing
+import os
+import secrets
+import time
+import uuid
+from multiprocessing.connection import Client
+import numpy as np
+
+# The embedding module builds an OpenAI client at import; no calls are made here
+os.environ.setdefault("OPENAI_API_KEY", "benchmark")
+
+from app.utils.shards import ShardClient, ShardedVectorIndex, ShardIndex, is_partial, serve_index, shard_of
+from app.utils.vector_index import VectorIndex
+from benchmarks.ann_recall import make_corpus
+
+def make_ids(num_chunks: int, chunks_per_doc: int, seed: int = 0):
+    """Deterministic chunk and document ids, so every process derives the same corpus"""
+    rng = np.random.default_rng(seed)
+    raw = rng.integers(0, 256, (num_chunks + num_chunks // chunks_per_doc + 1, 16), dtype=np.uint8)
+    ids = [uuid.UUID(bytes=row.tobytes(), version=4) for row in raw]
+    chunk_ids = ids[:num_chunks]
+    doc_ids = [ids[num_chunks + i // chunks_per_doc] for i in range(num_chunks)]
+    return chunk_ids, doc_ids
+
+def run_shard(shard: int, shards: int, args, authkey: bytes, ready) -> None:
+    """Shard process: rebuild the corpus, keep this shard's rows and serve them"""
+    vectors, _ = make_corpus(args.num_chunks, args.dim, args.queries)
+    chunk_ids, doc_ids = make_ids(args.num_chunks, args.chunks_per_doc)
+    rows = [i for i, doc_id in enumerate(doc_ids) if shard_of(doc_id, shards) == shard]
+    index = ShardIndex(shard, shards)
+    index.build([chunk_ids[i] for i in rows], vectors[rows], [doc_ids[i] for i in rows])
+    serve_index(index, ("127.0.0.1", 0), authkey, ready)
+
+def time_queries(search, queries):
+    """Run queries one at a time, as the API does; returns (results, latencies_ms)"""
+    results, latencies = [], []
+    for query in queries:
+        start = time.perf_counter()
+        results.append(search(query))
+        latencies.append((time.perf_counter() - start) * 1000)
+    return results, np.array(latencies)
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--num-chunks", type=int, default=200000)
+    parser.add_argument("--dim", type=int, default=384)
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--shards", type=int, default=4)
+    parser.add_argument("--chunks-per-doc", type=int, default=20)
+    parser.add_argument("--k", type=int, default=10)
+    parser.add_argument("--timeout", type=float, default=2.0)
+    args = parser.parse_args()
+
+    context = multiprocessing.get_context("spawn")
+    authkey = secrets.token_bytes(32)
+    processes, clients = [], []
+    start = time.perf_counter()
+    for shard in range(args.shards):
+        ready, report = context.Pipe(duplex=False)
+        process = context.Process(target=run_shard, args=(shard, args.shards, args, authkey, report), daemon=True)
+        process.start()
+        report.close()
+        processes.append((process, ready))
+    for shard, (_, ready) in enumerate(processes):
+        address = ready.recv()
+        clients.append(ShardClient(shard, lambda address=address: Client(address, authkey=authkey)))
+    shards_ready_s = time.perf_counter() - start
+
+    vectors, queries = make_corpus(args.num_chunks, args.dim, args.queries)
+    chunk_ids, doc_ids = make_ids(args.num_chunks, args.chunks_per_doc)
+    whole = VectorIndex("flat")
+    whole.build(chunk_ids, vectors, doc_ids)
+    sharded = ShardedVectorIndex(clients, timeout=args.timeout)
+    print(f"{args.num_chunks} chunks x {args.dim} dims, {args.shards} shard processes, {args.queries} queries, k={args.k}")
+    print(f"shards ready in {shards_ready_s:.2f}s\n")
+
+    expected, single_ms = time_queries(lambda q: whole.search(q, args.k), queries)
+    merged, sharded_ms = time_queries(lambda q: sharded.search(q, args.k), queries)
+    agree = np.mean([
+        [chunk_id for chunk_id, _ in got] == [chunk_id for chunk_id, _ in want]
+        for got, want in zip(merged, expected)
+    ])
+
+    # Stop the last shard: searches carry on over the others and are flagged partial
+    processes[-1][0].terminate()
+    processes[-1][0].join()
+    degraded, degraded_ms = time_queries(lambda q: sharded.search(q, args.k), queries)
+    partial = np.mean([is_partial(hits) for hits in degraded])
+
+    print(f"{'setup':<22} {'p50 ms':>8} {'p95 ms':>8}")
+    for label, latencies in (
+        ("single process", single_ms),
+        (f"{args.shards} shards", sharded_ms),
+        (f"{args.shards - 1} of {args.shards} shards", degraded_ms),
+    ):
+        print(f"{label:<22} {np.percentile(latencies, 50):>8.3f} {np.percentile(latencies, 95):>8.3f}")
+    print(f"\nmerged top-{args.k} identical to single process: {agree:.3f}")
+    print(f"flagged partial with one shard down: {partial:.3f}")
+
+if __name__ == "__main__":
+    main()
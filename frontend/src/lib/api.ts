@@ -18,15 +18,26 @@ export interface UserResponse {
 export interface DocumentUploadResponse {
   id: string
   status: string
+  content_hash?: string
 }
 
-export interface ParseResult {
+export interface ParseJob {
+  job_id: string
   doc_id: string
-  chunks_indexed: number
-  total_chunks: number
   status: string
 }
 
+export interface DocumentStatusResponse {
+  document_id: string
+  status: 'uploaded' | 'queued' | 'processing' | 'completed' | 'failed'
+  progress: number
+  job_id?: string
+  stage?: string
+  pages_done?: number
+  pages_total?: number
+  error?: string
+}
+
 export interface AnswerRequest {
   query: string
   k?: number
@@ -156,11 +167,16 @@ class ApiClient {
     return response.data
   }
 
-  async parseDocument(docId: string): Promise<ParseResult> {
+  async parseDocument(docId: string): Promise<ParseJob> {
     const response = await this.client.post(`/api/parse/${docId}`)
     return response.data
   }
 
+  async getDocumentStatus(docId: string): Promise<DocumentStatusResponse> {
+    const response = await this.client.get(`/api/upload/${docId}/status`)
+    return response.data
+  }
+
   async askRag(body: AnswerRequest): Promise<AnswerResponse> {
     const response = await this.client.post('/api/rag/ask', body)
     return response.data
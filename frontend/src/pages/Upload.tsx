@@ -1,15 +1,26 @@
 import { useState } from 'react'
 import { useNavigate } from 'react-router-dom'
-import { apiClient } from '../lib/api'
+import { apiClient, DocumentStatusResponse } from '../lib/api'
 import { FileUploader } from '../components/FileUploader'
 import { Button } from '../components/ui/Button'
 import { Card, CardHeader, CardTitle, CardContent } from '../components/ui/Card'
 
+const PARSE_POLL_MS = 1000
+
+function describeProgress(status: DocumentStatusResponse | null): string {
+  if (!status || status.status === 'queued') return 'Queued...'
+  if (status.stage === 'extracting' && status.pages_total) {
+    return `Reading page ${status.pages_done} of ${status.pages_total} (${status.progress}%)`
+  }
+  return `${status.stage ? status.stage[0].toUpperCase() + status.stage.slice(1) : 'Parsing'}... (${status.progress}%)`
+}
+
 export function Upload() {
   const [selectedFile, setSelectedFile] = useState<File | null>(null)
   const [uploadedDocId, setUploadedDocId] = useState<string | null>(null)
   const [isUploading, setIsUploading] = useState(false)
   const [isParsing, setIsParsing] = useState(false)
+  const [parseProgress, setParseProgress] = useState<DocumentStatusResponse | null>(null)
   const [error, setError] = useState('')
   const navigate = useNavigate()
 
@@ -43,12 +54,25 @@ export function Upload() {
 
     try {
       await apiClient.parseDocument(uploadedDocId)
-      // Navigate to document view after successful parsing
-      navigate(`/document/${uploadedDocId}`)
+      // Parsing runs in the background; poll until the job finishes
+      for (;;) {
+        await new Promise((resolve) => setTimeout(resolve, PARSE_POLL_MS))
+        const status = await apiClient.getDocumentStatus(uploadedDocId)
+        setParseProgress(status)
+        if (status.status === 'completed') {
+          navigate(`/document/${uploadedDocId}`)
+          return
+        }
+        if (status.status === 'failed') {
+          setError(status.error || 'Parsing failed. Please try again.')
+          return
+        }
+      }
     } catch (err: any) {
       setError(err.response?.data?.detail || 'Parsing failed. Please try again.')
     } finally {
       setIsParsing(false)
+      setParseProgress(null)
     }
   }
 
@@ -112,7 +136,7 @@ export function Upload() {
                   disabled={isParsing}
                   className="flex-1"
                 >
-                  {isParsing ? 'Parsing...' : 'Parse Document Now'}
+                  {isParsing ? describeProgress(parseProgress) : 'Parse Document Now'}
                 </Button>
                 
                 <Button
@@ -1,15 +1,34 @@
 import pytest
 import uuid
 from unittest.mock import Mock, patch, MagicMock
+from fastapi import HTTPException
 from pathlib import Path
 import tempfile
 import os
+import io
+import hashlib
 
-from app.utils.parser import extract_chunks_from_pdf, clean_text, create_chunks
-from app.utils.embedding import embed_chunks, create_faiss_index, search_similar_chunks
-from app.routers.parse import parse_document, get_document_chunks
+from app.utils import parser
+from app.utils.parser import extract_chunks_from_pdf, clean_text, create_chunks, page_ranges, iter_clean_text, iter_chunks
+from app.utils.embedding import (
+    embed_chunks,
+    create_faiss_index,
+    search_similar_chunks,
+    save_faiss_index,
+    load_faiss_index,
+    normalize_vectors,
+    embed_queries,
+    EmbeddingCache,
+    plan_embedding_batches,
+)
+from app.utils.vector_codec import encode_embedding, decode_embedding, decode_embeddings, stored_embedding, embedding_dimension, dimension_from_size
+from app.utils.embedding_store import content_hash, embed_chunks_deduplicated
+from app.routers.parse import parse_document, get_document_chunks, sync_vector_index
+from app.routers import upload
+from app.utils.ingest import IngestError, IngestQueue, ingest_document
+from app.utils.tokenizer import RegexTokenizer
 from app.db.models import Document, DocumentChunk
-from app.models.chunk import ParseResult
+from app.models.chunk import ParseJob
 
 class TestTextProcessing:
     """Test text cleaning and chunking utilities"""
@@ -34,6 +53,44 @@ class TestTextProcessing:
         assert len(chunks) > 1
         assert all(len(chunk) <= 100 for chunk in chunks)
     
+    def test_streaming_pipeline_matches_whole_text(self):
+        """Test cleaning and chunking page by page gives the chunks of the joined, cleaned text"""
+        pages = [
+            "  The court finds.  The witness\n",
+            "\tstated that the contract was void.",
+            "",
+            "12",
+            "Counsel objected.   Objection overruled. " * 6,
+        ]
+        whole = create_chunks(clean_text("".join(page + " " for page in pages)), chunk_size=60, overlap=15)
+        
+        streamed = list(iter_chunks(iter_clean_text(page + " " for page in pages), chunk_size=60, overlap=15))
+        
+        assert streamed == whole
+        assert "".join(iter_clean_text(["12", "  "])) == clean_text("12  ") == ""
+    
+    def test_create_chunks_by_tokens(self):
+        """Test token chunking keeps chunks within the token size and breaks at sentences"""
+        tokenizer = RegexTokenizer()
+        text = "The court held that the contract was enforceable. " * 20
+        
+        chunks = create_chunks(text, chunk_size=30, overlap=5, tokenizer=tokenizer)
+        
+        assert len(chunks) > 1
+        assert all(tokenizer.count(chunk) <= 30 for chunk in chunks)
+        # A sentence ends within the last sixth of the first window, so that chunk is pulled back to it
+        assert chunks[0].endswith("enforceable.")
+        streamed = list(iter_chunks((word + " " for word in text.split(" ")), chunk_size=30, overlap=5, tokenizer=tokenizer))
+        assert streamed == create_chunks(text.replace("  ", " ") + " ", chunk_size=30, overlap=5, tokenizer=tokenizer)
+    
+    def test_iter_chunks_yields_before_input_ends(self):
+        """Test a chunk is emitted as soon as text past it has arrived"""
+        def pages():
+            yield "a" * 150
+            raise AssertionError("second page read before the first chunk was yielded")
+        
+        assert next(iter_chunks(pages(), chunk_size=100, overlap=10)) == "a" * 100
+    
     def test_create_chunks_with_overlap(self):
         """Test that chunks have proper overlap"""
         text = "Sentence one. Sentence two. Sentence three. Sentence four."
@@ -76,6 +133,40 @@ class TestPDFParser:
         finally:
             os.unlink(tmp_path)
     
+    def test_page_ranges_cover_pages_in_order(self):
+        """Test page ranges are contiguous, near-equal and never empty"""
+        ranges = page_ranges(10, 4)
+        assert [list(r) for r in ranges] == [[0, 1, 2], [3, 4, 5], [6, 7], [8, 9]]
+        assert page_ranges(2, 8) == [range(0, 1), range(1, 2)]
+    
+    def test_parallel_extraction_matches_serial(self):
+        """Test the process pool yields the serial chunks, with sentences joined across pages"""
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            pdf_path = os.path.join(tmp_dir, "transcript.pdf")
+            doc = parser.fitz.open()
+            for page_num in range(12):
+                # Every page ends mid-sentence; the next page finishes it
+                doc.new_page().insert_text((72, 72), f"finishes sentence {page_num}. Witness {page_num} states that", fontsize=9)
+            doc.save(pdf_path)
+            doc.close()
+            
+            serial = extract_chunks_from_pdf(pdf_path, chunk_size=120, overlap=20)
+            progress = []
+            try:
+                with patch.object(parser, "PARALLEL_EXTRACTION_MIN_PAGES", 5), \
+                        patch.object(parser, "PARALLEL_EXTRACTION_WORKERS", 2):
+                    parallel = extract_chunks_from_pdf(
+                        pdf_path, chunk_size=120, overlap=20,
+                        on_page=lambda done, total: progress.append((done, total))
+                    )
+            finally:
+                parser._reset_extraction_pool()
+        
+        assert parallel == serial
+        assert any("Witness 3 states that finishes sentence 4." in chunk for chunk in parallel)
+        assert progress[-1] == (12, 12)
+        assert [done for done, _ in progress] == sorted(done for done, _ in progress)
+    
     def test_extract_chunks_from_pdf_file_not_found(self):
         """Test PDF extraction with non-existent file"""
         with pytest.raises(FileNotFoundError):
@@ -122,6 +213,47 @@ class TestEmbeddings:
         embeddings = embed_chunks([])
         assert embeddings == []
     
+    def test_plan_embedding_batches(self):
+        """Test batches respect item and token limits and cover every chunk in order"""
+        chunks = ["a" * 40] * 7  # 10 estimated tokens each
+        assert plan_embedding_batches(chunks, max_items=3, max_tokens=1000) == [(0, 3), (3, 6), (6, 7)]
+        assert plan_embedding_batches(chunks, max_items=100, max_tokens=25) == [(0, 2), (2, 4), (4, 6), (6, 7)]
+        # An oversized chunk still gets a batch of its own
+        assert plan_embedding_batches(["a" * 400], max_items=10, max_tokens=25) == [(0, 1)]
+    
+    @patch('app.utils.embedding.EMBEDDING_BATCH_MAX_ITEMS', 2)
+    @patch('app.utils.embedding.client.embeddings.create')
+    def test_embed_chunks_batches_in_order(self, mock_openai):
+        """Test concurrent batches are reassembled in input order"""
+        import time
+        def create(model, input):
+            # Make earlier batches finish last
+            time.sleep(0.01 * (10 - int(input[0])))
+            return Mock(data=[Mock(embedding=[float(text)]) for text in input])
+        mock_openai.side_effect = create
+        
+        embeddings = embed_chunks([str(i) for i in range(7)])
+        
+        assert embeddings == [[float(i)] for i in range(7)]
+        assert mock_openai.call_count == 4
+    
+    @patch('app.utils.embedding.time.sleep')
+    @patch('app.utils.embedding.client.embeddings.create')
+    def test_embed_chunks_retries_transient_errors(self, mock_openai, mock_sleep):
+        """Test timeouts are retried with backoff and other errors are not"""
+        from openai import APITimeoutError
+        timeout = APITimeoutError(request=Mock())
+        mock_openai.side_effect = [timeout, timeout, Mock(data=[Mock(embedding=[1.0])])]
+        
+        assert embed_chunks(["text"]) == [[1.0]]
+        assert mock_sleep.call_count == 2
+        
+        mock_openai.reset_mock()
+        mock_openai.side_effect = ValueError("bad request")
+        with pytest.raises(ValueError):
+            embed_chunks(["text"])
+        assert mock_openai.call_count == 1
+    
     def test_create_faiss_index(self):
         """Test FAISS index creation"""
         embeddings = [[0.1, 0.2], [0.3, 0.4], [0.5, 0.6]]
@@ -140,6 +272,233 @@ class TestEmbeddings:
         assert len(indices) == 2
         assert indices[0] == 0  # Should match first embedding
 
+class TestQueryEmbeddingCache:
+    """Test the two-tier query embedding cache"""
+    
+    def test_key_normalises_text_and_includes_model(self):
+        """Test equivalent spellings share a key and models do not"""
+        assert EmbeddingCache.key("  Elements of a\nContract ", "m") == EmbeddingCache.key("elements of a contract", "m")
+        assert EmbeddingCache.key("contract", "m1") != EmbeddingCache.key("contract", "m2")
+    
+    def test_lru_evicts_least_recently_used(self):
+        """Test the local tier stays within its size bound"""
+        cache = EmbeddingCache(max_size=2)
+        cache.put_many(["a", "b"], "m", [[1.0], [2.0]])
+        cache.get_many(["a"], "m")
+        cache.put_many(["c"], "m", [[3.0]])
+        
+        found = cache.get_many(["a", "b", "c"], "m")
+        assert found[0] is not None and found[1] is None and found[2] is not None
+    
+    def test_redis_tier_round_trip(self):
+        """Test vectors come back from Redis as float32 and populate the LRU"""
+        import numpy as np
+        store = {}
+        mock_redis = Mock()
+        mock_redis.pipeline.return_value.setex.side_effect = lambda key, ttl, blob: store.__setitem__(key, blob)
+        mock_redis.mget.side_effect = lambda keys: [store.get(key) for key in keys]
+        
+        EmbeddingCache(max_size=10, redis_client=mock_redis).put_many(["tort"], "m", [[0.5, 0.25]])
+        other_worker = EmbeddingCache(max_size=10, redis_client=mock_redis)
+        
+        vector = other_worker.get_many(["tort"], "m")[0]
+        assert vector.dtype == np.float32
+        assert vector.tolist() == [0.5, 0.25]
+        assert other_worker.stats == {"local_hits": 0, "redis_hits": 1, "misses": 0}
+        other_worker.get_many(["tort"], "m")
+        assert other_worker.stats["local_hits"] == 1
+    
+    def test_redis_errors_are_misses(self):
+        """Test an unavailable Redis degrades to the local tier"""
+        mock_redis = Mock()
+        mock_redis.mget.side_effect = ConnectionError("down")
+        cache = EmbeddingCache(max_size=10, redis_client=mock_redis)
+        assert cache.get_many(["x"], "m") == [None]
+        assert cache.stats["misses"] == 1
+    
+    @patch('app.utils.embedding.embed_chunks')
+    def test_embed_queries_only_embeds_misses_once(self, mock_embed):
+        """Test repeated and duplicate queries skip the embeddings API"""
+        mock_embed.return_value = [[0.1, 0.2]]
+        with patch('app.utils.embedding.query_embedding_cache', EmbeddingCache(max_size=10)):
+            first = embed_queries(["What is estoppel?", "what is  estoppel?"])
+            second = embed_queries(["WHAT IS ESTOPPEL?"])
+        
+        mock_embed.assert_called_once()
+        assert mock_embed.call_args[0][0] == ["What is estoppel?"]
+        assert first == [[0.1, 0.2], [0.1, 0.2]]
+        assert second == [pytest.approx([0.1, 0.2])]
+
+class TestIndexFactory:
+    """Test approximate FAISS index types"""
+    
+    @pytest.fixture
+    def vectors(self):
+        import numpy as np
+        rng = np.random.default_rng(0)
+        return normalize_vectors(rng.standard_normal((2000, 16)))
+    
+    @pytest.mark.parametrize("index_type,params", [
+        ("ivf_flat", {"nprobe": 64}),
+        ("ivf_pq", {"nprobe": 64}),
+        ("hnsw", {"ef_search": 128}),
+    ])
+    def test_approximate_index_finds_exact_match(self, vectors, index_type, params):
+        """Test each index type returns the query vector itself as top hit"""
+        index = create_faiss_index(vectors, dimension=16, index_type=index_type, pq_m=4)
+        assert index.ntotal == 2000
+        
+        scores, indices = search_similar_chunks(vectors[7].tolist(), index, k=5, **params)
+        assert indices[0] == 7
+    
+    def test_unknown_index_type(self, vectors):
+        """Test unknown index types are rejected"""
+        with pytest.raises(ValueError):
+            create_faiss_index(vectors, dimension=16, index_type="lsh")
+    
+    def test_trained_index_round_trip(self, vectors, tmp_path):
+        """Test a persisted trained index can be refilled without retraining"""
+        index = create_faiss_index(vectors, dimension=16, index_type="ivf_flat")
+        path = tmp_path / "trained.faiss"
+        save_faiss_index(index, path, trained_only=True)
+        
+        trained = load_faiss_index(path)
+        assert trained.is_trained
+        assert trained.ntotal == 0
+        
+        refilled = create_faiss_index(vectors[:100], dimension=16, index_type="ivf_flat", trained_index=trained)
+        assert refilled.ntotal == 100
+
+    def test_hnsw_searches_with_different_ef_do_not_interleave(self):
+        """Test concurrent HNSW searches always run with the efSearch they asked for"""
+        import threading
+        import numpy as np
+        from app.utils.embedding import search_faiss_index
+        
+        vectors = np.random.default_rng(1).standard_normal((500, 16)).astype(np.float32)
+        index = create_faiss_index(vectors.tolist(), dimension=16, index_type="hnsw")
+        default_ef = index.hnsw.efSearch
+        original_search = index.search
+        local = threading.local()
+        seen = []
+        
+        def recording_search(*args, **kwargs):
+            seen.append((local.wanted, index.hnsw.efSearch))
+            return original_search(*args, **kwargs)
+        
+        def run(ef):
+            local.wanted = ef or default_ef
+            for _ in range(20):
+                search_faiss_index(index, vectors[:1], 5, ef_search=ef)
+        
+        with patch.object(index, "search", side_effect=recording_search):
+            threads = [threading.Thread(target=run, args=(ef,)) for ef in (None, 64, 200)]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+        
+        assert len(seen) == 60
+        assert all(wanted == actual for wanted, actual in seen)
+
+class TestEmbeddingCodec:
+    """Test binary embedding storage"""
+    
+    def test_float32_round_trip_is_normalised(self):
+        """Test float32 vectors are stored normalised and decode exactly"""
+        blob = encode_embedding([3.0, 4.0], "float32")
+        assert len(blob) == 8
+        assert decode_embedding(blob, "float32").tolist() == pytest.approx([0.6, 0.8])
+    
+    @pytest.mark.parametrize("dtype,size,tolerance", [("float16", 3072, 1e-3), ("int8", 1540, 5e-4)])
+    def test_compact_dtypes(self, dtype, size, tolerance):
+        """Test reduced-precision formats shrink storage and stay close"""
+        import numpy as np
+        vector = np.random.default_rng(0).standard_normal(1536)
+        blob = encode_embedding(vector, dtype)
+        assert len(blob) == size
+        
+        decoded = decode_embedding(blob, dtype)
+        assert decoded.dtype == np.float32
+        assert np.abs(decoded - vector / np.linalg.norm(vector)).max() < tolerance
+    
+    def test_int8_keeps_cosine_on_high_dimensional_vectors(self):
+        """Test per-row int8 scaling preserves similarity for realistic embeddings"""
+        import numpy as np
+        vectors = np.random.default_rng(2).standard_normal((50, 1536))
+        unit = vectors / np.linalg.norm(vectors, axis=1, keepdims=True)
+        blobs = [encode_embedding(v, "int8") for v in vectors]
+        
+        decoded = decode_embeddings(blobs, "int8")
+        cosines = np.sum(decoded * unit, axis=1) / np.linalg.norm(decoded, axis=1)
+        
+        assert embedding_dimension(blobs[0], "int8") == 1536
+        assert np.allclose(decoded[0], decode_embedding(blobs[0], "int8"))
+        assert cosines.min() > 0.9999
+    
+    def test_decode_embeddings_matrix(self):
+        """Test bulk decoding into a matrix"""
+        blobs = [encode_embedding([1.0, 0.0]), encode_embedding([0.0, 2.0])]
+        assert decode_embeddings(blobs).tolist() == [[1.0, 0.0], [0.0, 1.0]]
+    
+    def test_dimension_from_size_matches_blob(self):
+        """Test vector sizes measured in the database give the stored dimension"""
+        for dtype in ("float32", "float16", "int8"):
+            blob = encode_embedding([0.5] * 384, dtype)
+            assert dimension_from_size(len(blob), dtype) == embedding_dimension(blob, dtype) == 384
+        assert dimension_from_size(None) == 0
+    
+    def test_chunk_vectors_are_deferred(self):
+        """Test loading chunk entities leaves the vector columns unread"""
+        attrs = DocumentChunk.__mapper__.column_attrs
+        assert attrs["embedding"].deferred and attrs["embedding_bin"].deferred
+        assert not attrs["content"].deferred
+    
+    def test_stored_embedding_prefers_binary(self):
+        """Test binary column wins over legacy JSON and JSON is a fallback"""
+        assert stored_embedding(encode_embedding([0.0, 1.0]), "float32", [1.0, 0.0]).tolist() == [0.0, 1.0]
+        assert stored_embedding(None, None, [1.0, 0.0]).tolist() == [1.0, 0.0]
+        assert stored_embedding(None, None, None) is None
+    
+    def test_unknown_dtype(self):
+        """Test unknown storage formats are rejected"""
+        with pytest.raises(ValueError):
+            encode_embedding([1.0], "bfloat16")
+
+class TestEmbeddingStore:
+    """Test content-hash embedding dedupe during ingestion"""
+    
+    def test_content_hash_depends_on_model(self):
+        """Test the same text under different models gets different addresses"""
+        assert content_hash("text", "model-a") == content_hash("text", "model-a")
+        assert content_hash("text", "model-a") != content_hash("text", "model-b")
+    
+    @patch('app.utils.embedding_store.store_embeddings')
+    @patch('app.utils.embedding_store.lookup_embeddings')
+    @patch('app.utils.embedding_store.embed_chunks')
+    def test_only_novel_text_is_embedded(self, mock_embed, mock_lookup, mock_store):
+        """Test known chunks come from the store and repeats are embedded once"""
+        mock_lookup.return_value = {content_hash("known", "m"): [1.0, 0.0]}
+        mock_embed.return_value = [[0.0, 1.0]]
+        
+        result = embed_chunks_deduplicated(["new", "known", "new"], Mock(), model="m")
+        
+        assert result == [[0.0, 1.0], [1.0, 0.0], [0.0, 1.0]]
+        mock_embed.assert_called_once_with(["new"], "m")
+        mock_store.assert_called_once()
+        assert list(mock_store.call_args[0][0]) == [content_hash("new", "m")]
+    
+    @patch('app.utils.embedding_store.store_embeddings')
+    @patch('app.utils.embedding_store.lookup_embeddings')
+    @patch('app.utils.embedding_store.embed_chunks')
+    def test_fully_known_document_skips_api(self, mock_embed, mock_lookup, mock_store):
+        """Test a re-parse of known text makes no embeddings call"""
+        mock_lookup.return_value = {content_hash("a", "m"): [1.0], content_hash("b", "m"): [2.0]}
+        
+        assert embed_chunks_deduplicated(["a", "b"], Mock(), model="m") == [[1.0], [2.0]]
+        mock_embed.assert_not_called()
+        mock_store.assert_not_called()
+
 class TestParseRouter:
     """Test parse router endpoints"""
     
@@ -148,8 +507,8 @@ class TestParseRouter:
         with pytest.raises(ValueError):
             uuid.UUID("invalid-uuid")
     
-    @patch('app.routers.parse.extract_chunks_from_pdf')
-    @patch('app.routers.parse.embed_chunks')
+    @patch('app.utils.ingest.iter_chunks_from_pdf')
+    @patch('app.utils.ingest.embed_chunks_deduplicated')
     def test_parse_document_success(self, mock_embed, mock_extract):
         """Test successful document parsing"""
         # Mock dependencies
@@ -161,5 +520,209 @@ class TestParseRouter:
         assert mock_extract.return_value == ["Chunk 1", "Chunk 2"]
         assert mock_embed.return_value == [[0.1, 0.2], [0.3, 0.4]]
 
+    @patch('app.utils.ingest.get_vector_index')
+    def test_index_sync_failure_is_not_raised(self, mock_get_index):
+        """Test a committed parse is not reported as failed when the index update breaks"""
+        mock_get_index.return_value.loaded = True
+        mock_get_index.return_value.add.side_effect = ValueError("dimension mismatch")
+        
+        sync_vector_index(uuid.uuid4(), 3, replaced=False, chunk_ids=[uuid.uuid4()], embeddings=[[0.1]])
+        
+        mock_get_index.return_value.advance_version.assert_not_called()
+    
+    @patch('app.utils.ingest.tenant_indexes')
+    @patch('app.utils.ingest.get_vector_index')
+    def test_index_sync_updates_resident_tenant_index(self, mock_get_index, mock_tenants):
+        """Test the owner's tenant index gets the new chunks when this worker holds it"""
+        mock_get_index.return_value.loaded = False
+        tenant_index = mock_tenants.resident.return_value
+        tenant_index.loaded = True
+        doc_id, chunk_id = uuid.uuid4(), uuid.uuid4()
+        
+        sync_vector_index(doc_id, 4, replaced=True, chunk_ids=[chunk_id], embeddings=[[0.1]], owner_id=9)
+        
+        mock_tenants.resident.assert_called_once_with(9)
+        tenant_index.remove_document.assert_called_once_with(doc_id)
+        tenant_index.add.assert_called_once_with([chunk_id], doc_id, [[0.1]])
+        tenant_index.advance_version.assert_called_once_with(4)
+        mock_get_index.return_value.add.assert_not_called()
+    
+    @patch('app.routers.parse.ingest_queue')
+    @patch('app.routers.parse.check_parseable')
+    def test_parse_document_queues_job(self, mock_check, mock_queue):
+        """Test parsing is queued and answered with a job id instead of run in the request"""
+        doc_id = uuid.uuid4()
+        document = Mock(status="uploaded")
+        mock_check.return_value = (document, 0)
+        mock_queue.latest.return_value = None
+        mock_queue.enqueue.return_value = {"job_id": "abc", "status": "queued"}
+        db = Mock()
+        
+        result = parse_document(str(doc_id), force=False, credentials=Mock(), db=db)
+        
+        assert result == ParseJob(job_id="abc", doc_id=doc_id, status="queued")
+        mock_queue.enqueue.assert_called_once_with(doc_id, force=False)
+        assert document.status == "processing"
+        db.commit.assert_called_once()
+    
+    @patch('app.routers.parse.ingest_queue')
+    @patch('app.routers.parse.check_parseable')
+    def test_parse_document_rejects_active_job(self, mock_check, mock_queue):
+        """Test a document with a running job is not queued twice"""
+        mock_check.return_value = (Mock(), 0)
+        mock_queue.is_active.return_value = True
+        
+        with pytest.raises(HTTPException) as exc:
+            parse_document(str(uuid.uuid4()), force=True, credentials=Mock(), db=Mock())
+        
+        assert exc.value.status_code == 409
+        mock_queue.enqueue.assert_not_called()
+
+class TestIngestQueue:
+    """Test the background ingestion queue with its in-process backend"""
+    
+    @patch('app.utils.ingest.SessionLocal')
+    @patch('app.utils.ingest.ingest_document')
+    def test_job_reports_progress_and_completion(self, mock_ingest, mock_session):
+        """Test a worked job passes through its stages and ends completed"""
+        ingest_queue = IngestQueue(concurrency=1)
+        doc_id = uuid.uuid4()
+        seen = []
+        
+        def ingest(db, document_uuid, force, report):
+            report(stage="extracting", pages_done=1, pages_total=2, progress=30)
+            seen.append(ingest_queue.latest(document_uuid))
+            return 5
+        mock_ingest.side_effect = ingest
+        
+        job = ingest_queue.enqueue(doc_id, force=True)
+        assert ingest_queue.is_active(ingest_queue.latest(doc_id))
+        ingest_queue.run(ingest_queue._next(timeout=0.1))
+        
+        assert mock_ingest.call_args[0][1:3] == (doc_id, True)
+        assert seen[0]["status"] == "processing"
+        assert (seen[0]["pages_done"], seen[0]["pages_total"], seen[0]["progress"]) == (1, 2, 30)
+        finished = ingest_queue.get(job["job_id"])
+        assert (finished["status"], finished["progress"], finished["chunks"]) == ("completed", 100, 5)
+        assert not ingest_queue.is_active(finished)
+        mock_session.return_value.close.assert_called_once()
+    
+    @patch('app.utils.ingest.SessionLocal')
+    @patch('app.utils.ingest.ingest_document')
+    def test_failed_job_marks_unparsed_document_failed(self, mock_ingest, mock_session):
+        """Test a failure is recorded on the job and a document without chunks is marked failed"""
+        ingest_queue = IngestQueue(concurrency=1)
+        mock_ingest.side_effect = IngestError(422, "No text content extracted from PDF")
+        db = mock_session.return_value
+        document = Mock(status="processing")
+        db.query.return_value.filter.return_value.first.return_value = document
+        db.query.return_value.filter.return_value.count.return_value = 0
+        
+        job = ingest_queue.enqueue(uuid.uuid4())
+        ingest_queue.run(job["job_id"])
+        
+        failed = ingest_queue.get(job["job_id"])
+        assert failed["status"] == "failed"
+        assert failed["error"] == "No text content extracted from PDF"
+        assert document.status == "failed"
+    
+    @patch('app.utils.ingest.INGEST_BATCH_CHUNKS', 2)
+    @patch('app.utils.ingest.get_tokenizer', return_value=RegexTokenizer())
+    @patch('app.utils.ingest.sync_vector_index')
+    @patch('app.utils.ingest.record_corpus_change', return_value=7)
+    @patch('app.utils.ingest.embed_chunks_deduplicated')
+    @patch('app.utils.ingest.iter_chunks_from_pdf')
+    @patch('app.utils.ingest.check_parseable')
+    def test_ingest_streams_batches_while_reading_pages(self, mock_check, mock_iter, mock_embed, mock_record, mock_sync, mock_tokenizer):
+        """Test chunks are embedded and inserted batch by batch as pages are read"""
+        document = Mock(file_path="doc.pdf", user_id=3)
+        mock_check.return_value = (document, 0)
+        events = []
+        
+        def iter_chunks(path, on_page):
+            for page in range(1, 4):
+                on_page(page, 3)
+                yield f"chunk {page}"
+        mock_iter.side_effect = iter_chunks
+        mock_embed.side_effect = lambda batch, db: events.append(("embed", batch)) or [[0.1]] * len(batch)
+        reports = []
+        
+        def report(**fields):
+            reports.append(fields)
+            if "pages_done" in fields:
+                events.append(("page", fields["pages_done"]))
+        db = Mock()
+        
+        chunks = ingest_document(db, uuid.uuid4(), False, report)
+        
+        assert chunks == 3
+        # The first batch is embedded before the last page is read
+        assert events == [("page", 1), ("page", 2), ("embed", ["chunk 1", "chunk 2"]), ("page", 3), ("embed", ["chunk 3"])]
+        assert [(r["pages_done"], r["progress"]) for r in reports if "pages_done" in r] == [(1, 31), (2, 63), (3, 95)]
+        inserted = [row for call in db.execute.call_args_list for row in call[0][1]]
+        assert [row["chunk_index"] for row in inserted] == [0, 1, 2]
+        assert [row["context_tokens"] for row in inserted] == [2, 2, 2]
+        assert document.status == "parsed"
+        db.commit.assert_called_once()
+        assert mock_sync.call_args.kwargs["owner_id"] == 3
+        assert mock_sync.call_args.kwargs["embeddings"].shape == (3, 1)
+    
+    @patch('app.utils.ingest.iter_chunks_from_pdf', return_value=iter([]))
+    @patch('app.utils.ingest.check_parseable')
+    def test_ingest_without_text_is_rejected(self, mock_check, mock_iter):
+        """Test a PDF with no text fails the job and rolls back"""
+        mock_check.return_value = (Mock(file_path="doc.pdf"), 0)
+        db = Mock()
+        
+        with pytest.raises(IngestError) as exc:
+            ingest_document(db, uuid.uuid4(), False)
+        
+        assert exc.value.status_code == 422
+        db.rollback.assert_called_once()
+        db.commit.assert_not_called()
+
+class TestUploadStreaming:
+    """Test uploads are streamed to disk with hashing and size enforcement"""
+    
+    @staticmethod
+    def upload_of(content: bytes) -> Mock:
+        upload_file = Mock()
+        upload_file.file = io.BytesIO(content)
+        return upload_file
+    
+    def test_upload_is_hashed_and_renamed_into_place(self, tmp_path):
+        """Test a PDF is copied block by block and its SHA-256 computed on the way"""
+        content = b"%PDF-1.7\n" + os.urandom(5000)
+        with patch.object(upload, "UPLOAD_DIR", tmp_path), patch.object(upload, "UPLOAD_BLOCK_SIZE", 1024):
+            file_uuid, file_path, content_hash = upload.save_uploaded_file(self.upload_of(content))
+        
+        assert file_path == str(tmp_path / f"{file_uuid}.pdf")
+        assert Path(file_path).read_bytes() == content
+        assert content_hash == hashlib.sha256(content).hexdigest()
+        assert [p.name for p in tmp_path.iterdir()] == [f"{file_uuid}.pdf"]
+    
+    def test_oversized_upload_aborts_mid_stream(self, tmp_path):
+        """Test the size limit stops the copy at the first block past it and leaves no file"""
+        source = self.upload_of(b"%PDF-" + b"x" * 10000)
+        with patch.object(upload, "UPLOAD_DIR", tmp_path), patch.object(upload, "UPLOAD_BLOCK_SIZE", 1024), \
+                patch.object(upload, "MAX_FILE_SIZE", 3000):
+            with pytest.raises(HTTPException) as exc:
+                upload.save_uploaded_file(source)
+        
+        assert exc.value.status_code == 413
+        assert source.file.tell() == 3072
+        assert list(tmp_path.iterdir()) == []
+    
+    def test_non_pdf_is_rejected_on_first_block(self, tmp_path):
+        """Test content without the PDF signature is refused whatever its declared type"""
+        source = self.upload_of(b"<html>" + b"x" * 5000)
+        with patch.object(upload, "UPLOAD_DIR", tmp_path), patch.object(upload, "UPLOAD_BLOCK_SIZE", 1024):
+            with pytest.raises(HTTPException) as exc:
+                upload.save_uploaded_file(source)
+        
+        assert exc.value.status_code == 400
+        assert source.file.tell() == 1024
+        assert list(tmp_path.iterdir()) == []
+
 if __name__ == "__main__":
     pytest.main([__file__, "-v"])
\ No newline at end of file
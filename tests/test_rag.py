@@ -1,15 +1,69 @@
 import pytest
 import uuid
-from unittest.mock import Mock, patch, MagicMock
+from unittest.mock import Mock, patch, MagicMock, AsyncMock
 from decimal import Decimal
 import json
+import time
 import redis
 
 from app.models.rag import AnswerRequest, AnswerResponse, Citation, RetrievalItem
-from app.utils.retrieval import retrieve_topk, trim_context_to_token_budget
+from app.utils.retrieval import (
+    fuse_rankings,
+    retrieval_cache,
+    retrieve_topk,
+    retrieve_topk_by_embedding,
+    search_cached,
+    search_index,
+    trim_context_to_token_budget,
+)
+from app.utils.lexical_index import LexicalIndex, tokenize
+from app.utils.tokenizer import RegexTokenizer, load_tokenizer
 from app.utils.prompting import build_prompt
-from app.utils.llm import chat_complete
-from app.routers.rag import ask_legal_question, generate_cache_key, get_cached_response
+from app.utils.llm import chat_complete, chat_stream_async
+from app.utils.vector_index import VectorIndex, top_k_indices
+from app.routers.rag import (
+    CACHE_TTL,
+    answer_scope,
+    ask_legal_question,
+    ask_legal_question_stream,
+    ask_legal_questions_batch,
+    generate_cache_key,
+    get_cache_stats,
+    get_cached_response,
+)
+from app.models.rag import BatchAnswerRequest
+from app.utils.semantic_cache import SemanticCache
+from app.utils.singleflight import SingleFlight
+from app.utils.tenant_index import TenantIndex, TenantIndexes
+from app.utils.shards import (
+    Partial,
+    ShardClient,
+    ShardedVectorIndex,
+    ShardIndex,
+    is_partial,
+    serve_index,
+    shard_of,
+)
+
+@pytest.fixture(autouse=True)
+def semantic_cache():
+    """Give each test an empty per-process semantic cache at corpus version 3"""
+    cache = SemanticCache(ttl=CACHE_TTL)
+    with patch('app.routers.rag.semantic_cache', cache), patch('app.routers.rag.get_corpus_version', return_value=3):
+        yield cache
+
+@pytest.fixture(autouse=True)
+def empty_retrieval_cache():
+    """Start every test without cached rankings"""
+    retrieval_cache.clear()
+    yield retrieval_cache
+    retrieval_cache.clear()
+
+@pytest.fixture(autouse=True)
+def local_answer_flight():
+    """Coalesce /ask computations in-process only"""
+    with patch('app.routers.rag.answer_flight', SingleFlight()) as flight:
+        yield flight
 
 @pytest.fixture
 def sample_document_chunks():
@@ -58,6 +112,671 @@ class TestRetrieval:
         """Test context trimming with empty list"""
         result = trim_context_to_token_budget([], 1000, "gpt-4o-mini")
         assert result == []
+    
+    @patch('app.utils.retrieval.get_tokenizer')
+    def test_trim_sums_stored_token_counts(self, mock_get_tokenizer, sample_document_chunks):
+        """Test stored counts are budgeted as is and only uncounted snippets are tokenized"""
+        tokenizer = mock_get_tokenizer.return_value
+        tokenizer.count.return_value = 30
+        counted = sample_document_chunks[0].model_copy(update={"context_tokens": 60})
+        
+        result = trim_context_to_token_budget([counted, sample_document_chunks[1]], 90, "gpt-4o-mini")
+        assert len(result) == 2
+        tokenizer.count.assert_called_once_with(sample_document_chunks[1].snippet)
+        
+        assert len(trim_context_to_token_budget([counted, sample_document_chunks[1]], 89, "gpt-4o-mini")) == 1
+    
+    @patch('app.utils.retrieval.get_tokenizer', return_value=RegexTokenizer())
+    def test_trim_cuts_oversized_first_item_at_token_boundary(self, mock_get_tokenizer, sample_document_chunks):
+        """Test a first item larger than the budget is truncated to fit rather than dropped"""
+        oversized = sample_document_chunks[0].model_copy(update={"context_tokens": 500})
+        
+        result = trim_context_to_token_budget([oversized], 10, "gpt-4o-mini")
+        
+        assert len(result) == 1
+        assert result[0].snippet.endswith("...")
+        assert sample_document_chunks[0].snippet.startswith(result[0].snippet[:-3])
+        assert RegexTokenizer().count(result[0].snippet) <= 10
+
+class TestTokenizer:
+    """Test token counting"""
+    
+    def test_regex_tokenizer_offsets_cover_text(self):
+        """Test token offsets start at zero, ascend and cut text at token boundaries"""
+        tokenizer = RegexTokenizer()
+        text = "The court's 2019 ruling, in re Smith_v_Jones, cost $12,500.\n\nAffirmed."
+        offsets = tokenizer.token_offsets(text)
+        
+        assert offsets[0] == 0
+        assert offsets == sorted(set(offsets))
+        assert tokenizer.count(text) == len(offsets)
+        assert tokenizer.truncate(text, 3) == "The court's"
+        assert tokenizer.truncate(text, 1000) == text
+    
+    def test_long_words_count_as_several_tokens(self):
+        """Test words past the piece cap are split, as BPE splits rare long words"""
+        tokenizer = RegexTokenizer()
+        assert tokenizer.count(" the") == 1
+        assert tokenizer.count(" indemnification") == 2
+    
+    def test_auto_falls_back_to_regex_without_tiktoken(self):
+        """Test the offline tokenizer is used when tiktoken cannot load"""
+        with patch.dict('sys.modules', {'tiktoken': None}):
+            assert isinstance(load_tokenizer("auto"), RegexTokenizer)
+            with pytest.raises(ImportError):
+                load_tokenizer("tiktoken")
+
+class TestVectorIndex:
+    """Test the resident vector index"""
+    
+    def test_top_k_indices(self):
+        """Test partial top-k selection returns best scores first"""
+        import numpy as np
+        scores = np.array([0.1, 0.9, 0.5, 0.7, 0.3])
+        assert top_k_indices(scores, 3).tolist() == [1, 3, 2]
+        assert top_k_indices(scores, 10).tolist() == [1, 3, 2, 4, 0]
+        assert top_k_indices(scores, 0).tolist() == []
+    
+    def test_search_ranks_by_cosine_similarity(self):
+        """Test index search matches cosine ranking"""
+        chunk_ids = [uuid.uuid4() for _ in range(3)]
+        index = VectorIndex()
+        index.build(chunk_ids, [[1.0, 0.0], [0.0, 2.0], [3.0, 3.0]])
+        
+        hits = index.search([0.0, 1.0], k=2)
+        assert [chunk_id for chunk_id, _ in hits] == [chunk_ids[1], chunk_ids[2]]
+        assert hits[0][1] == pytest.approx(1.0)
+        assert hits[1][1] == pytest.approx(0.7071, abs=1e-4)
+    
+    def test_search_documents_scans_only_filtered_rows(self):
+        """Test narrow filters scan their rows and broad ones mask the rest"""
+        doc_a, doc_b = uuid.uuid4(), uuid.uuid4()
+        chunk_ids = [uuid.uuid4() for _ in range(4)]
+        index = VectorIndex()
+        index.build(chunk_ids, [[1.0, 0.0], [0.9, 0.1], [0.0, 1.0], [0.1, 0.9]], [doc_a, doc_a, doc_b, doc_b])
+        
+        with patch('app.utils.vector_index.FILTER_SCAN_FRACTION', 0.6):
+            with patch.object(index, 'search_batch', wraps=index.search_batch) as full_search:
+                narrow = index.search_documents([[1.0, 0.0]], [doc_b], k=3)
+                full_search.assert_not_called()
+                broad = index.search_documents([[1.0, 0.0]], [doc_a, doc_b, uuid.uuid4()], k=1)
+                full_search.assert_called_once()
+        
+        assert [chunk_id for chunk_id, _ in narrow[0]] == [chunk_ids[3], chunk_ids[2]]
+        assert [chunk_id for chunk_id, _ in broad[0]] == [chunk_ids[0]]
+        assert index.search_documents([[1.0, 0.0]], [uuid.uuid4()], k=3) == [[]]
+    
+    def test_search_batch_respects_allowed_mask(self):
+        """Test rows outside the allowed mask never appear"""
+        import numpy as np
+        chunk_ids = [uuid.uuid4() for _ in range(3)]
+        index = VectorIndex()
+        index.build(chunk_ids, [[1.0, 0.0], [0.9, 0.1], [0.0, 1.0]])
+        
+        hits = index.search_batch([[1.0, 0.0]], k=3, allowed=np.array([False, True, True]))[0]
+        assert [chunk_id for chunk_id, _ in hits] == [chunk_ids[1], chunk_ids[2]]
+    
+    def test_search_empty_index(self):
+        """Test searching an empty index"""
+        index = VectorIndex()
+        index.build([], [])
+        assert index.search([0.1, 0.2], k=5) == []
+    
+    def test_add_appends_and_skips_known_chunks(self):
+        """Test incremental appends grow the index without duplicating rows"""
+        index = VectorIndex()
+        index.build([uuid.uuid4()], [[1.0, 0.0]], [uuid.uuid4()])
+        
+        doc_id = uuid.uuid4()
+        new_ids = [uuid.uuid4() for _ in range(2000)]
+        added = index.add(new_ids, doc_id, [[0.0, 1.0]] * 2000)
+        assert added == 2000
+        assert index.add(new_ids[:10], doc_id, [[0.0, 1.0]] * 10) == 0
+        assert index.size == 2001
+        assert index.search([0.0, 1.0], k=1)[0][0] in set(new_ids)
+    
+    def test_remove_document_tombstones_and_compacts(self):
+        """Test deleted documents disappear from results before and after compaction"""
+        keep_doc, drop_doc = uuid.uuid4(), uuid.uuid4()
+        keep_id, drop_id = uuid.uuid4(), uuid.uuid4()
+        index = VectorIndex()
+        index.build([keep_id, drop_id], [[1.0, 0.0], [0.0, 1.0]], [keep_doc, drop_doc])
+        
+        with patch.object(index, 'maybe_compact'):
+            assert index.remove_document(drop_doc) == 1
+        assert index.size == 1
+        assert [chunk_id for chunk_id, _ in index.search([0.0, 1.0], k=2)] == [keep_id]
+        
+        index.compact()
+        assert index.size == 1
+        assert [chunk_id for chunk_id, _ in index.search([0.0, 1.0], k=2)] == [keep_id]
+        
+        # Re-parsed chunks for the same document are searchable again
+        new_id = uuid.uuid4()
+        index.add([new_id], drop_doc, [[0.0, 1.0]])
+        assert index.search([0.0, 1.0], k=1)[0][0] == new_id
+    
+    @patch('app.utils.vector_index.ANN_MIN_VECTORS', 100)
+    def test_ann_index_skips_tombstones_and_scans_appends(self):
+        """Test ANN-backed search honours tombstones and covers appended rows"""
+        import numpy as np
+        rng = np.random.default_rng(1)
+        vectors = rng.standard_normal((500, 8))
+        chunk_ids = [uuid.uuid4() for _ in range(500)]
+        doc_ids = [uuid.uuid4() for _ in range(500)]
+        index = VectorIndex(index_type="hnsw")
+        index.build(chunk_ids, vectors, doc_ids)
+        
+        assert index.search(vectors[3], k=1, ef_search=64)[0][0] == chunk_ids[3]
+        
+        with patch.object(index, 'maybe_compact'):
+            index.remove_document(doc_ids[3])
+        assert chunk_ids[3] not in [chunk_id for chunk_id, _ in index.search(vectors[3], k=5)]
+        
+        new_id = uuid.uuid4()
+        index.add([new_id], uuid.uuid4(), [vectors[3].tolist()])
+        assert index.search(vectors[3], k=1)[0][0] == new_id
+        
+        index.compact()
+        assert index.size == 500
+        assert index.search(vectors[3], k=1, ef_search=64)[0][0] == new_id
+    
+    def test_snapshot_round_trip_is_memory_mapped(self, tmp_path):
+        """Test a saved snapshot is mapped, not copied, and searches identically"""
+        import numpy as np
+        chunk_ids = [uuid.uuid4() for _ in range(3)]
+        doc_ids = [uuid.uuid4() for _ in range(3)]
+        source = VectorIndex()
+        source.build(chunk_ids, [[1.0, 0.0], [0.0, 1.0], [1.0, 1.0]], doc_ids, version=4)
+        
+        with patch('app.utils.vector_index.SNAPSHOT_DIR', str(tmp_path)):
+            source.save_snapshot()
+            mock_db = Mock()
+            with patch('app.utils.vector_index.get_corpus_version', return_value=4):
+                target = VectorIndex()
+                with patch.object(target, 'load') as mock_load:
+                    target.refresh(mock_db)
+                    mock_load.assert_not_called()
+        
+        assert target.version == 4
+        assert isinstance(target._state.matrix, np.memmap)
+        assert target.search([0.0, 1.0], k=3) == source.search([0.0, 1.0], k=3)
+        
+        # Appending copies out of the read-only mapping
+        new_id = uuid.uuid4()
+        target.add([new_id], uuid.uuid4(), [[0.0, 1.0]])
+        assert target.search([0.0, 1.0], k=1)[0][0] in (new_id, chunk_ids[1])
+    
+    def test_stale_snapshot_rebuilds_from_database(self, tmp_path):
+        """Test a snapshot behind the corpus version is rebuilt and republished"""
+        from app.utils.snapshot import read_snapshot_meta
+        source = VectorIndex()
+        source.build([uuid.uuid4()], [[1.0, 0.0]], [uuid.uuid4()], version=1)
+        
+        with patch('app.utils.vector_index.SNAPSHOT_DIR', str(tmp_path)):
+            source.save_snapshot()
+            target = VectorIndex()
+            
+            def fake_load(db):
+                target.build([uuid.uuid4()], [[0.0, 1.0]], [uuid.uuid4()], version=2)
+            
+            # No change log entries: the gap cannot be replayed
+            with patch('app.utils.vector_index.get_corpus_version', return_value=2), \
+                 patch('app.utils.vector_index.get_corpus_changes', return_value=[]):
+                with patch.object(target, 'load', side_effect=fake_load) as mock_load:
+                    target.refresh(Mock())
+                    mock_load.assert_called_once()
+        
+        assert target.version == 2
+        assert read_snapshot_meta(str(tmp_path))["corpus_version"] == 2
+    
+    def test_stale_snapshot_catches_up_from_change_log(self, tmp_path):
+        """Test a worker maps an older snapshot and replays logged changes instead of rebuilding"""
+        import numpy as np
+        kept, removed, added = uuid.uuid4(), uuid.uuid4(), uuid.uuid4()
+        changed_doc, removed_doc = uuid.uuid4(), uuid.uuid4()
+        source = VectorIndex()
+        source.build([kept, removed], [[1.0, 0.0], [0.0, 1.0]], [uuid.uuid4(), removed_doc], version=3)
+        
+        def fake_fetch(db, *filters):
+            # Version 4 re-parsed changed_doc, version 5 deleted removed_doc
+            doc_id = filters[0].right.value
+            if doc_id == changed_doc:
+                return [added], [changed_doc], [np.array([0.6, 0.8], dtype=np.float32)]
+            return [], [], []
+        
+        with patch('app.utils.vector_index.SNAPSHOT_DIR', str(tmp_path)):
+            source.save_snapshot()
+            target = VectorIndex()
+            with patch('app.utils.vector_index.get_corpus_version', return_value=5), \
+                 patch('app.utils.vector_index.get_corpus_changes', return_value=[(4, changed_doc), (5, removed_doc)]), \
+                 patch.object(VectorIndex, '_fetch_vectors', side_effect=fake_fetch), \
+                 patch.object(target, 'maybe_compact'), \
+                 patch.object(target, 'load') as mock_load:
+                target.refresh(Mock())
+                mock_load.assert_not_called()
+        
+        assert target.version == 5
+        assert {chunk_id for chunk_id, _ in target.search([0.0, 1.0], k=5)} == {kept, added}
+    
+    def test_snapshots_are_rate_limited(self, tmp_path):
+        """Test a burst of writes schedules one snapshot, not one per document"""
+        index = VectorIndex()
+        index.build([uuid.uuid4()], [[1.0, 0.0]], version=1)
+        with patch('app.utils.vector_index.SNAPSHOT_DIR', str(tmp_path)), \
+             patch('app.utils.vector_index.SNAPSHOT_INTERVAL', 60), \
+             patch.object(index, 'save_snapshot') as mock_save:
+            for _ in range(5):
+                index.schedule_snapshot()
+            timer = index._snapshot_timer
+            assert timer is not None
+            timer.cancel()
+            mock_save.assert_not_called()
+    
+    def test_advance_version_only_closes_local_gaps(self):
+        """Test versions from other workers leave the index marked stale"""
+        index = VectorIndex()
+        index.build([], [], version=3)
+        index.advance_version(4)
+        assert index.version == 4
+        index.advance_version(6)
+        assert index.version == 4
+    
+    def test_search_batch_matches_single_searches(self):
+        """Test the matrix-matrix batch path returns the same rankings"""
+        import numpy as np
+        rng = np.random.default_rng(2)
+        index = VectorIndex()
+        index.build([uuid.uuid4() for _ in range(50)], rng.standard_normal((50, 4)))
+        queries = rng.standard_normal((3, 4)).tolist()
+        
+        assert index.search_batch(queries, k=5) == [index.search(q, k=5) for q in queries]
+        assert index.search_batch([], k=5) == []
+    
+    @patch('app.utils.retrieval.get_vector_index')
+    @patch('app.utils.retrieval.embed_queries')
+    def test_retrieve_topk_fetches_only_winners(self, mock_embed, mock_get_index):
+        """Test retrieval keeps index ranking and only loads the top-k rows"""
+        doc_id = uuid.uuid4()
+        first, second = uuid.uuid4(), uuid.uuid4()
+        mock_embed.return_value = [[0.1, 0.2]]
+        mock_get_index.return_value.version = 1
+        mock_get_index.return_value.search.return_value = [(first, 0.9), (second, 0.8)]
+        
+        mock_db = Mock()
+        mock_db.query.return_value.filter.return_value.all.return_value = [
+            Mock(id=second, doc_id=doc_id, chunk_index=1, content="Second chunk.", context_tokens=3),
+            Mock(id=first, doc_id=doc_id, chunk_index=0, content="First chunk.", context_tokens=3)
+        ]
+        
+        items = retrieve_topk("contract", 2, mock_db)
+        
+        mock_get_index.return_value.search.assert_called_once_with([0.1, 0.2], 2, nprobe=None, ef_search=None)
+        assert [item.chunk_index for item in items] == [0, 1]
+        assert items[0].score == 0.9
+        assert items[0].snippet == "First chunk."
+
+    @patch('app.utils.retrieval.build_snippet', side_effect=lambda content: content)
+    @patch('app.utils.retrieval.RetrievalItem', side_effect=RetrievalItem)
+    @patch('app.utils.retrieval.get_vector_index')
+    @patch('app.utils.vector_index.get_corpus_version', return_value=1)
+    def test_retrieval_builds_items_only_for_winners(self, mock_version, mock_get_index, mock_item, mock_snippet):
+        """Test scoring a large index allocates results and snippets for the k winners only"""
+        import numpy as np
+        rng = np.random.default_rng(2)
+        chunk_ids = [uuid.uuid4() for _ in range(2000)]
+        index = VectorIndex()
+        index.build(chunk_ids, rng.standard_normal((2000, 8)), version=1)
+        mock_get_index.return_value = index
+        doc_id = uuid.uuid4()
+
+        def fetch_winners(*columns):
+            # The winner fetch must not read vectors back from the table
+            assert [column.key for column in columns] == ["id", "doc_id", "chunk_index", "content", "context_tokens"]
+            query = Mock()
+            query.filter.side_effect = lambda condition: Mock(all=Mock(return_value=[
+                Mock(id=chunk_id, doc_id=doc_id, chunk_index=i, content=f"Chunk {i}.", context_tokens=3)
+                for i, chunk_id in enumerate(condition.right.value)
+            ]))
+            return query
+
+        mock_db = Mock()
+        mock_db.query.side_effect = fetch_winners
+
+        items = retrieve_topk_by_embedding(rng.standard_normal(8).tolist(), 5, mock_db)
+
+        assert len(items) == 5
+        assert mock_item.call_count == 5
+        assert mock_snippet.call_count == 5
+        mock_db.query.assert_called_once()
+
+class TestLexicalIndex:
+    """Test the BM25 inverted index and hybrid retrieval modes"""
+    
+    contents = [
+        "The court in Smith v. Jones, No. 2:21-cv-01234, dismissed the claim under 42 U.S.C. 1983.",
+        "A valid contract requires offer, acceptance and consideration.",
+        "Consideration must be bargained for; past consideration is no consideration.",
+    ]
+    
+    def build(self):
+        chunk_ids = [uuid.uuid4() for _ in self.contents]
+        doc_ids = [uuid.uuid4() for _ in self.contents]
+        index = LexicalIndex()
+        index.build(chunk_ids, doc_ids, self.contents, version=1)
+        return index, chunk_ids, doc_ids
+    
+    def test_tokenize_keeps_identifiers_whole(self):
+        """Test case numbers and code citations survive tokenisation"""
+        assert tokenize("No. 2:21-CV-01234 under 42 U.S.C. 1983") == ["no", "2:21-cv-01234", "under", "42", "u.s.c", "1983"]
+    
+    def test_bm25_ranks_exact_identifier_and_term_frequency(self):
+        """Test exact strings find their chunk and repeated terms rank higher"""
+        index, chunk_ids, _ = self.build()
+        
+        assert [chunk_id for chunk_id, _ in index.search("2:21-cv-01234", 5)] == [chunk_ids[0]]
+        hits = index.search("consideration", 5)
+        assert [chunk_id for chunk_id, _ in hits] == [chunk_ids[2], chunk_ids[1]]
+        assert hits[0][1] > hits[1][1] > 0
+        assert index.search("habeas", 5) == []
+    
+    def test_incremental_add_and_remove(self):
+        """Test parse-time updates are searchable and deletions disappear, across compaction"""
+        index, chunk_ids, doc_ids = self.build()
+        new_chunk = uuid.uuid4()
+        assert index.add([new_chunk, chunk_ids[1]], uuid.uuid4(), ["Promissory estoppel replaces consideration.", "ignored"]) == 1
+        assert new_chunk in [chunk_id for chunk_id, _ in index.search("estoppel", 5)]
+        
+        assert index.remove_document(doc_ids[2]) == 1
+        assert chunk_ids[2] not in [chunk_id for chunk_id, _ in index.search("consideration", 5)]
+        # A quarter of the rows are dead, past the compaction threshold
+        assert index._state.dead == 0
+        assert index.size == 3
+        assert [chunk_id for chunk_id, _ in index.search("2:21-cv-01234", 5)] == [chunk_ids[0]]
+        assert new_chunk in [chunk_id for chunk_id, _ in index.search("consideration", 5)]
+    
+    def test_fuse_rankings_rewards_agreement(self):
+        """Test reciprocal rank fusion prefers chunks both rankings found"""
+        a, b, c = uuid.uuid4(), uuid.uuid4(), uuid.uuid4()
+        fused = fuse_rankings([[(a, 0.9), (b, 0.8)], [(b, 12.0), (c, 3.0)]], k=3, rrf_k=60)
+        assert [chunk_id for chunk_id, _ in fused] == [b, a, c]
+        assert fused[0][1] == pytest.approx(1 / 62 + 1 / 61)
+    
+    def test_prefilter_scores_only_lexical_candidates(self):
+        """Test prefilter mode vector-scores just the chunks sharing a query term"""
+        lexical, chunk_ids, doc_ids = self.build()
+        vectors = VectorIndex()
+        vectors.build(chunk_ids, [[1.0, 0.0], [0.0, 1.0], [0.6, 0.8]], doc_ids)
+        
+        with patch('app.utils.retrieval.get_lexical_index', return_value=lexical):
+            prefiltered = search_index(vectors, [[1.0, 0.0]], 2, queries=["consideration"], mode="prefilter")[0]
+            # No lexical match falls back to the full vector scan
+            fallback = search_index(vectors, [[1.0, 0.0]], 1, queries=["habeas"], mode="prefilter")[0]
+            hybrid = search_index(vectors, [[0.0, 1.0]], 3, queries=["2:21-cv-01234"], mode="hybrid")[0]
+        
+        assert [chunk_id for chunk_id, _ in prefiltered] == [chunk_ids[2], chunk_ids[1]]
+        assert [chunk_id for chunk_id, _ in fallback] == [chunk_ids[0]]
+        # The exact identifier match is pulled into the fused top results
+        assert chunk_ids[0] in [chunk_id for chunk_id, _ in hybrid][:2]
+    
+    def test_search_candidates_skips_unknown_ids(self):
+        """Test candidate scoring ignores ids that are not in the vector index"""
+        chunk_ids = [uuid.uuid4(), uuid.uuid4()]
+        index = VectorIndex()
+        index.build(chunk_ids, [[1.0, 0.0], [0.0, 1.0]])
+        
+        hits = index.search_candidates([0.0, 1.0], [uuid.uuid4(), chunk_ids[0], chunk_ids[1]], 5)
+        assert [chunk_id for chunk_id, _ in hits] == [chunk_ids[1], chunk_ids[0]]
+
+class TestRetrievalCache:
+    """Test reuse of rankings until the corpus version changes"""
+    
+    @patch('app.utils.retrieval.get_vector_index')
+    def test_repeated_search_reuses_ranking_until_version_changes(self, mock_get_index):
+        """Test the index is searched once per embedding, parameters and corpus version"""
+        chunk_id = uuid.uuid4()
+        index = mock_get_index.return_value
+        index.version = 4
+        index.search.return_value = [(chunk_id, 0.9)]
+        mock_db = Mock()
+        mock_db.query.return_value.filter.return_value.all.return_value = [
+            Mock(id=chunk_id, doc_id=uuid.uuid4(), chunk_index=0, content="Offer and acceptance.", context_tokens=4)
+        ]
+        
+        first = retrieve_topk_by_embedding([0.1, 0.2], 2, mock_db)
+        second = retrieve_topk_by_embedding([0.1, 0.2], 2, mock_db)
+        assert index.search.call_count == 1
+        assert first == second
+        # Rows are still loaded each time so deleted chunks drop out
+        assert mock_db.query.call_count == 2
+        
+        retrieve_topk_by_embedding([0.1, 0.2], 3, mock_db)
+        assert index.search.call_count == 2
+        
+        index.version = 5
+        retrieve_topk_by_embedding([0.1, 0.2], 2, mock_db)
+        assert index.search.call_count == 3
+        assert retrieval_cache.version == 5
+    
+    def test_batch_searches_only_uncached_queries(self):
+        """Test a batch reuses cached rankings and searches the rest together"""
+        first, second, third = uuid.uuid4(), uuid.uuid4(), uuid.uuid4()
+        index = Mock(version=2)
+        index.search.return_value = [(first, 0.9)]
+        search_cached(index, [[1.0, 0.0]], 1)
+        
+        index.search_batch.return_value = [[(second, 0.8)], [(third, 0.7)]]
+        hits = search_cached(index, [[1.0, 0.0], [0.0, 1.0], [0.6, 0.8]], 1)
+        
+        assert hits == [[(first, 0.9)], [(second, 0.8)], [(third, 0.7)]]
+        assert index.search_batch.call_args[0][0] == [[0.0, 1.0], [0.6, 0.8]]
+    
+    def test_results_from_an_older_index_are_not_stored(self):
+        """Test a search that raced a refresh does not repopulate the cache"""
+        index = Mock(version=2)
+        index.search.return_value = [(uuid.uuid4(), 0.9)]
+        search_cached(index, [[1.0, 0.0]], 1)
+        index.version = 3
+        search_cached(index, [[0.0, 1.0]], 1)
+        
+        key = retrieval_cache.key([1.0, 0.0], 1, None, None)
+        retrieval_cache.put(key, 2, [(uuid.uuid4(), 0.5)])
+        assert retrieval_cache.get(key, 3) is None
+
+class TestShards:
+    """Test scatter-gather search across shard servers"""
+    
+    authkey = b"test-shards"
+    
+    def start_shard(self, index):
+        """Serve an index on a local port from a background thread; returns its client"""
+        import threading
+        from multiprocessing import Pipe
+        from multiprocessing.connection import Client
+        ready, report = Pipe(duplex=False)
+        threading.Thread(target=serve_index, args=(index, ("127.0.0.1", 0), self.authkey, report), daemon=True).start()
+        address = ready.recv()
+        return ShardClient(0, lambda: Client(address, authkey=self.authkey))
+    
+    def build_shards(self, shards, chunks=200, dimension=8):
+        """Split a random corpus across shard indexes the way ShardIndex would load it"""
+        import numpy as np
+        rng = np.random.default_rng(4)
+        chunk_ids = [uuid.uuid4() for _ in range(chunks)]
+        doc_ids = [uuid.uuid4() for _ in range(chunks // 4) for _ in range(4)]
+        vectors = rng.standard_normal((chunks, dimension))
+        
+        whole = VectorIndex()
+        whole.build(chunk_ids, vectors, doc_ids, version=7)
+        parts = []
+        for shard in range(shards):
+            rows = [i for i, doc_id in enumerate(doc_ids) if shard_of(doc_id, shards) == shard]
+            part = ShardIndex(shard, shards)
+            part.build([chunk_ids[i] for i in rows], vectors[rows], [doc_ids[i] for i in rows], version=7)
+            parts.append(part)
+        return whole, parts, doc_ids, rng.standard_normal((3, dimension)).tolist()
+    
+    def test_shard_of_is_stable_and_spread(self):
+        """Test documents map to the same shard every time and fill every shard"""
+        doc_ids = [uuid.uuid4() for _ in range(400)]
+        assignments = [shard_of(doc_id, 4) for doc_id in doc_ids]
+        assert assignments == [shard_of(doc_id, 4) for doc_id in doc_ids]
+        assert set(assignments) == {0, 1, 2, 3}
+    
+    def test_shard_index_loads_only_its_rows(self):
+        """Test loads and replays of a shard filter on the doc_id hash in SQL"""
+        from sqlalchemy.dialects import postgresql
+        mock_db = Mock()
+        mock_db.query.return_value.filter.return_value.yield_per.return_value = []
+        ShardIndex(2, 4)._fetch_vectors(mock_db)
+        
+        conditions = mock_db.query.return_value.filter.call_args[0]
+        sql = str(conditions[1].compile(dialect=postgresql.dialect()))
+        assert "get_byte(uuid_send(document_chunks.doc_id)" in sql
+        with patch('app.utils.vector_index.SNAPSHOT_DIR', "indexes"):
+            assert ShardIndex(2, 4).snapshot_dir.endswith("shard-2-of-4")
+    
+    def test_scatter_gather_matches_unsharded_search(self):
+        """Test merging per-shard top-k equals searching the whole index"""
+        whole, parts, doc_ids, queries = self.build_shards(3)
+        index = ShardedVectorIndex([self.start_shard(part) for part in parts])
+        
+        def same_rankings(got, expected):
+            # Shards score their own slices, so scores may differ in the last bit
+            assert [[chunk_id for chunk_id, _ in hits] for hits in got] == [[chunk_id for chunk_id, _ in hits] for hits in expected]
+            for got_hits, expected_hits in zip(got, expected):
+                assert [score for _, score in got_hits] == pytest.approx([score for _, score in expected_hits], abs=1e-6)
+        
+        same_rankings(index.search_batch(queries, 10), whole.search_batch(queries, 10))
+        same_rankings([index.search(queries[0], 5)], [whole.search(queries[0], 5)])
+        assert not is_partial(index.search(queries[0], 5))
+        assert index.version == 7
+        
+        wanted = list(dict.fromkeys(doc_ids))[:3]
+        same_rankings(index.search_documents(queries, wanted, 5), whole.search_documents(queries, wanted, 5))
+    
+    def test_search_documents_asks_only_owning_shards(self):
+        """Test a document filter is sent only to the shards holding those documents"""
+        clients = [Mock(version=1) for _ in range(4)]
+        for client in clients:
+            future = Mock()
+            future.done.return_value = True
+            future.exception.return_value = None
+            future.result.return_value = [[]]
+            client.call.return_value = future
+        doc_id = uuid.uuid4()
+        
+        with patch('app.utils.shards.wait'):
+            ShardedVectorIndex(clients).search_documents([[1.0, 0.0]], [doc_id], 5)
+        
+        asked = [shard for shard, client in enumerate(clients) if client.call.called]
+        assert asked == [shard_of(doc_id, 4)]
+    
+    def test_slow_shard_returns_partial_results(self):
+        """Test a shard that misses the timeout is left out and the results are flagged"""
+        from multiprocessing import Pipe
+        whole, parts, _, queries = self.build_shards(2)
+        # Requests to this end of the pipe are never answered
+        silent, _unanswered = Pipe()
+        index = ShardedVectorIndex([self.start_shard(parts[0]), ShardClient(1, lambda: silent)], timeout=0.2)
+        
+        hits = index.search(queries[0], 5)
+        
+        assert is_partial(hits)
+        assert hits == parts[0].search(queries[0], 5)
+        assert index.version == -1
+    
+    def test_all_shards_failing_raises(self):
+        """Test a search with no answering shard is an error, not an empty result"""
+        def refuse():
+            raise ConnectionError("vector shard 0 is still loading")
+        
+        with pytest.raises(RuntimeError):
+            ShardedVectorIndex([ShardClient(0, refuse)], timeout=0.2).search([1.0, 0.0], 5)
+    
+    @patch('app.utils.retrieval.get_vector_index')
+    def test_partial_rankings_stay_flagged_and_uncached(self, mock_get_index):
+        """Test partial hits are not cached and the retrieved items keep the flag"""
+        chunk_id, doc_id = uuid.uuid4(), uuid.uuid4()
+        mock_get_index.return_value = Mock(version=1)
+        mock_get_index.return_value.search.return_value = Partial([(chunk_id, 0.9)])
+        mock_db = Mock()
+        mock_db.query.return_value.filter.return_value.all.return_value = [
+            Mock(id=chunk_id, doc_id=doc_id, chunk_index=0, content="Only shard that answered.", context_tokens=5)
+        ]
+        
+        items = retrieve_topk_by_embedding([1.0, 0.0], 1, mock_db)
+        retrieve_topk_by_embedding([1.0, 0.0], 1, mock_db)
+        
+        assert is_partial(items)
+        assert items[0].doc_id == doc_id
+        assert mock_get_index.return_value.search.call_count == 2
+
+class InlineThread:
+    """Thread stand-in that runs its target on start, so background work finishes before asserts"""
+    
+    def __init__(self, target, args=(), **kwargs):
+        self.target = target
+        self.args = args
+    
+    def start(self):
+        self.target(*self.args)
+
+class TestTenantIndexes:
+    """Test per-owner indexes and their memory-bounded LRU"""
+    
+    @staticmethod
+    def fake_load(sizes):
+        """ensure_loaded stand-in that builds an owner's index with sizes[owner] random vectors"""
+        import numpy as np
+        def load(index, db):
+            if not index.loaded:
+                count = sizes[index.owner_id]
+                vectors = np.random.default_rng(index.owner_id).standard_normal((count, 64))
+                index.build([uuid.uuid4() for _ in range(count)], vectors, [uuid.uuid4()] * count, version=1)
+        return load
+    
+    def test_tenant_index_loads_only_owned_rows(self):
+        """Test loads and replays of a tenant index filter on the document owner"""
+        from sqlalchemy.dialects import postgresql
+        mock_db = Mock()
+        mock_db.query.return_value.filter.return_value.yield_per.return_value = []
+        TenantIndex(42)._fetch_vectors(mock_db)
+        
+        conditions = mock_db.query.return_value.filter.call_args[0]
+        sql = str(conditions[1].compile(dialect=postgresql.dialect(), compile_kwargs={"literal_binds": True}))
+        assert "documents.user_id = 42" in sql
+        with patch('app.utils.vector_index.SNAPSHOT_DIR', "indexes"):
+            assert TenantIndex(42).snapshot_dir.endswith("owner-42")
+    
+    def test_lru_evicts_least_recently_used_within_budget(self):
+        """Test residency stays under budget and evicted tenants are written back"""
+        sizes = {1: 1000, 2: 1000, 3: 1000}
+        one_index = TenantIndex(0)
+        one_index.build([uuid.uuid4() for _ in range(1000)], [[1.0] * 64] * 1000)
+        indexes = TenantIndexes(int(one_index.memory_bytes * 2.5))
+        
+        with patch.object(TenantIndex, 'ensure_loaded', autospec=True, side_effect=self.fake_load(sizes)), \
+             patch.object(TenantIndex, 'save_snapshot', autospec=True) as save, \
+             patch('app.utils.tenant_index.threading.Thread', InlineThread):
+            first = indexes.get(Mock(), 1)
+            indexes.get(Mock(), 2)
+            assert indexes.get(Mock(), 1) is first
+            indexes.get(Mock(), 3)
+        
+        assert indexes.resident(2) is None
+        assert indexes.resident(1) is first and indexes.resident(3) is not None
+        assert [call.args[0].owner_id for call in save.call_args_list] == [2]
+        stats = indexes.stats()
+        assert stats["resident"] == 2 and stats["memory_mb"] <= stats["budget_mb"]
+        assert (stats["hits"], stats["loads"], stats["evictions"]) == (1, 3, 1)
+    
+    def test_oversized_tenant_stays_resident(self):
+        """Test the index just loaded is kept even when it alone exceeds the budget"""
+        with patch.object(TenantIndex, 'ensure_loaded', autospec=True, side_effect=self.fake_load({7: 500})):
+            indexes = TenantIndexes(1)
+            index = indexes.get(Mock(), 7)
+        assert indexes.resident(7) is index and index.size == 500
 
 class TestPrompting:
     """Test prompt building functionality"""
@@ -167,6 +886,604 @@ class TestRAGRouter:
         assert mock_retrieve.return_value[0].score == 0.95
         assert mock_llm.return_value["text"] == "A contract requires offer, acceptance, and consideration."
 
+class TestAsyncAsk:
+    """Test the non-blocking /ask path"""
+    
+    @patch('app.routers.rag.embed_queries_async', new_callable=AsyncMock, return_value=[[1.0, 0.0]])
+    @patch('app.routers.rag.retrieve_topk_async', new_callable=AsyncMock)
+    @patch('app.routers.rag.chat_complete_async', new_callable=AsyncMock)
+    @patch('app.routers.rag.async_redis_client')
+    def test_ask_awaits_llm_and_caches(self, mock_redis, mock_llm, mock_retrieve, mock_embed, sample_answer_request):
+        """Test the answer comes from the async LLM client and is cached asynchronously"""
+        import asyncio
+        mock_redis.get = AsyncMock(return_value=None)
+        mock_redis.setex = AsyncMock()
+        mock_retrieve.return_value = [
+            RetrievalItem(doc_id=uuid.uuid4(), chunk_index=0, score=0.9, snippet="Offer and acceptance.")
+        ]
+        mock_llm.return_value = {
+            "text": "Offer, acceptance and consideration.",
+            "tokens_in": 100,
+            "tokens_out": 20,
+            "cost_usd": 0.01,
+            "latency_ms": 800.0,
+            "model": "gpt-4o-mini",
+            "provider": "openai"
+        }
+        mock_db = Mock()
+        mock_db.query.return_value.first.return_value = Mock(id=7)
+        
+        response = asyncio.run(ask_legal_question(sample_answer_request, Mock(), mock_db))
+        
+        assert response.answer == "Offer, acceptance and consideration."
+        assert response.cached is False
+        mock_llm.assert_awaited_once()
+        mock_redis.setex.assert_awaited_once()
+        mock_db.add.assert_called_once()
+        # Retrieval reuses the embedding computed alongside the cache lookup
+        assert mock_retrieve.call_args.kwargs["query_embedding"] == [1.0, 0.0]
+    
+    @patch('app.routers.rag.embed_queries_async', new_callable=AsyncMock, return_value=[[1.0, 0.0]])
+    @patch('app.routers.rag.retrieve_topk_async', new_callable=AsyncMock)
+    @patch('app.routers.rag.chat_complete_async', new_callable=AsyncMock)
+    @patch('app.routers.rag.async_redis_client')
+    def test_ask_serves_cache_hit(self, mock_redis, mock_llm, mock_retrieve, mock_embed, sample_answer_request):
+        """Test a cached answer is returned without calling the LLM"""
+        import asyncio
+        cached = AnswerResponse(
+            answer="Cached answer.",
+            citations=[],
+            provider="openai",
+            model="gpt-4o-mini",
+            tokens_in=1,
+            tokens_out=1,
+            cost_usd=Decimal("0.001"),
+            latency_ms=1.0,
+            cached=False
+        )
+        mock_redis.get = AsyncMock(return_value=json.dumps({**cached.dict(), "cost_usd": "0.001"}, default=str))
+        mock_retrieve.return_value = []
+        mock_db = Mock()
+        mock_db.query.return_value.first.return_value = Mock(id=7)
+        
+        response = asyncio.run(ask_legal_question(sample_answer_request, Mock(), mock_db))
+        
+        assert response.answer == "Cached answer."
+        assert response.cached is True
+        mock_llm.assert_not_called()
+        # A cache hit never pays for retrieval
+        mock_retrieve.assert_not_called()
+
+class FakeStreamRedis:
+    """The slice of redis.asyncio the semantic cache uses, shared like one Redis server"""
+    
+    def __init__(self):
+        self.entries = []
+        self.counters = {}
+    
+    async def xadd(self, stream, fields, maxlen=None, approximate=True):
+        entry_id = f"{int(time.time() * 1000)}-{len(self.entries)}"
+        self.entries.append((entry_id.encode(), {k.encode(): v if isinstance(v, bytes) else str(v).encode() for k, v in fields.items()}))
+        return entry_id
+    
+    async def xread(self, streams, count=None):
+        (stream, last_id), = streams.items()
+        last_seq = int(last_id.split("-")[1]) if last_id != "0-0" else -1
+        new = [entry for entry in self.entries if int(entry[0].decode().split("-")[1]) > last_seq]
+        return [[stream.encode(), new[:count]]] if new else []
+    
+    async def hincrby(self, key, field, amount):
+        self.counters[field.encode()] = self.counters.get(field.encode(), 0) + amount
+    
+    async def hgetall(self, key):
+        return {field: str(value).encode() for field, value in self.counters.items()}
+
+class TestSemanticCache:
+    """Test the paraphrase lookup over cached answers"""
+    
+    def test_lookup_matches_above_threshold_only(self):
+        """Test a close paraphrase matches and an unrelated query does not"""
+        import asyncio
+        cache = SemanticCache(ttl=600, capacity=4, threshold=0.95)
+        
+        async def run():
+            await cache.put([1.0, 0.0, 0.0], scope=1, corpus_version=3, cache_key="contract")
+            close = await cache.lookup([0.99, 0.1, 0.0], scope=1, corpus_version=3)
+            far = await cache.lookup([0.7, 0.7, 0.0], scope=1, corpus_version=3)
+            return close, far
+        
+        close, far = asyncio.run(run())
+        assert close == "contract"
+        assert far is None
+    
+    def test_lookup_requires_same_scope_and_corpus_version(self):
+        """Test answers never cross users/parameters or corpus changes"""
+        import asyncio
+        cache = SemanticCache(ttl=600, capacity=4)
+        
+        async def run():
+            await cache.put([1.0, 0.0], scope=1, corpus_version=3, cache_key="contract")
+            return (
+                await cache.lookup([1.0, 0.0], scope=2, corpus_version=3),
+                await cache.lookup([1.0, 0.0], scope=1, corpus_version=4),
+                await cache.lookup([1.0, 0.0], scope=1, corpus_version=3)
+            )
+        
+        assert asyncio.run(run()) == (None, None, "contract")
+    
+    def test_ring_evicts_oldest_entry(self):
+        """Test the ring overwrites the oldest query once full"""
+        import asyncio
+        cache = SemanticCache(ttl=600, capacity=2)
+        
+        async def run():
+            await cache.put([1.0, 0.0, 0.0], 1, 3, "first")
+            await cache.put([0.0, 1.0, 0.0], 1, 3, "second")
+            await cache.put([0.0, 0.0, 1.0], 1, 3, "third")
+            return [await cache.lookup(vector, 1, 3) for vector in ([1.0, 0.0, 0.0], [0.0, 1.0, 0.0], [0.0, 0.0, 1.0])]
+        
+        assert asyncio.run(run()) == [None, "second", "third"]
+    
+    def test_entries_expire_with_the_answer_ttl(self):
+        """Test a query stops matching once its cached answer has expired"""
+        import asyncio
+        cache = SemanticCache(ttl=600, capacity=4)
+        
+        with patch('app.utils.semantic_cache.time.time', return_value=1000.0):
+            asyncio.run(cache.put([1.0, 0.0], 1, 3, "contract"))
+        with patch('app.utils.semantic_cache.time.time', return_value=1599.0):
+            assert asyncio.run(cache.lookup([1.0, 0.0], 1, 3)) == "contract"
+        with patch('app.utils.semantic_cache.time.time', return_value=1601.0):
+            assert asyncio.run(cache.lookup([1.0, 0.0], 1, 3)) is None
+    
+    def test_workers_share_entries_and_stats_through_redis(self):
+        """Test a query cached by one worker matches in another"""
+        import asyncio
+        shared = FakeStreamRedis()
+        first_worker = SemanticCache(shared, ttl=600, capacity=4)
+        second_worker = SemanticCache(shared, ttl=600, capacity=4)
+        
+        async def run():
+            await first_worker.put([1.0, 0.0], 1, 3, "contract")
+            await first_worker.record("misses")
+            match = await second_worker.lookup([0.99, 0.05], 1, 3)
+            await second_worker.record("semantic_hits")
+            return match, await second_worker.hit_rates()
+        
+        match, stats = asyncio.run(run())
+        assert match == "contract"
+        assert stats["misses"] == 1
+        assert stats["semantic_hits"] == 1
+        assert stats["semantic_hit_rate"] == 0.5
+        assert stats["entries"] == 1
+
+class TestSemanticAsk:
+    """Test /ask answering paraphrases from the semantic cache"""
+    
+    cached = AnswerResponse(
+        answer="Cached answer.",
+        citations=[],
+        provider="openai",
+        model="gpt-4o-mini",
+        tokens_in=1,
+        tokens_out=1,
+        cost_usd=Decimal("0.001"),
+        latency_ms=1.0,
+        cached=False
+    )
+    llm_response = {
+        "text": "Fresh answer.",
+        "tokens_in": 100,
+        "tokens_out": 20,
+        "cost_usd": 0.01,
+        "latency_ms": 800.0,
+        "model": "gpt-4o-mini",
+        "provider": "openai"
+    }
+    
+    def ask(self, mock_redis, semantic_cache, request, cached_at_version):
+        """Cache a paraphrase at cached_at_version, then ask request at corpus version 3"""
+        import asyncio
+        scope = answer_scope(7, request.k, request.model)
+        asyncio.run(semantic_cache.put([1.0, 0.0], scope, cached_at_version, "paraphrase-key"))
+        stored = json.dumps(self.cached.dict(), default=str)
+        mock_redis.get = AsyncMock(side_effect=lambda key: stored if key == "paraphrase-key" else None)
+        mock_redis.setex = AsyncMock()
+        mock_db = Mock()
+        mock_db.query.return_value.first.return_value = Mock(id=7)
+        return asyncio.run(ask_legal_question(request, Mock(), mock_db))
+    
+    @patch('app.routers.rag.embed_queries_async', new_callable=AsyncMock, return_value=[[0.99, 0.05]])
+    @patch('app.routers.rag.retrieve_topk_async', new_callable=AsyncMock)
+    @patch('app.routers.rag.chat_complete_async', new_callable=AsyncMock)
+    @patch('app.routers.rag.async_redis_client')
+    def test_paraphrase_is_served_from_cache(self, mock_redis, mock_llm, mock_retrieve, mock_embed, semantic_cache, sample_answer_request):
+        """Test a query close to a cached one skips retrieval and the LLM"""
+        import asyncio
+        response = self.ask(mock_redis, semantic_cache, sample_answer_request, cached_at_version=3)
+        
+        assert response.answer == "Cached answer."
+        assert response.cached is True
+        mock_retrieve.assert_not_called()
+        mock_llm.assert_not_called()
+        assert asyncio.run(semantic_cache.hit_rates())["semantic_hits"] == 1
+    
+    @patch('app.routers.rag.embed_queries_async', new_callable=AsyncMock, return_value=[[0.6, 0.8]])
+    @patch('app.routers.rag.retrieve_topk_async', new_callable=AsyncMock)
+    @patch('app.routers.rag.chat_complete_async', new_callable=AsyncMock)
+    @patch('app.routers.rag.async_redis_client')
+    def test_dissimilar_query_misses_and_is_remembered(self, mock_redis, mock_llm, mock_retrieve, mock_embed, semantic_cache, sample_answer_request):
+        """Test a query below the threshold is answered fresh and indexed for later paraphrases"""
+        import asyncio
+        mock_retrieve.return_value = [
+            RetrievalItem(doc_id=uuid.uuid4(), chunk_index=0, score=0.9, snippet="Offer and acceptance.")
+        ]
+        mock_llm.return_value = self.llm_response
+        
+        response = self.ask(mock_redis, semantic_cache, sample_answer_request, cached_at_version=3)
+        
+        assert response.answer == "Fresh answer."
+        mock_llm.assert_awaited_once()
+        scope = answer_scope(7, sample_answer_request.k, sample_answer_request.model)
+        cache_key = generate_cache_key(7, sample_answer_request.query, sample_answer_request.k, sample_answer_request.model)
+        assert asyncio.run(semantic_cache.lookup([0.6, 0.8], scope, 3)) == cache_key
+    
+    @patch('app.routers.rag.embed_queries_async', new_callable=AsyncMock, return_value=[[0.99, 0.05]])
+    @patch('app.routers.rag.retrieve_topk_async', new_callable=AsyncMock)
+    @patch('app.routers.rag.chat_complete_async', new_callable=AsyncMock)
+    @patch('app.routers.rag.async_redis_client')
+    def test_paraphrase_from_older_corpus_version_misses(self, mock_redis, mock_llm, mock_retrieve, mock_embed, semantic_cache, sample_answer_request):
+        """Test an answer generated before the corpus changed is not reused"""
+        mock_retrieve.return_value = [
+            RetrievalItem(doc_id=uuid.uuid4(), chunk_index=0, score=0.9, snippet="Offer and acceptance.")
+        ]
+        mock_llm.return_value = self.llm_response
+        
+        response = self.ask(mock_redis, semantic_cache, sample_answer_request, cached_at_version=2)
+        
+        assert response.answer == "Fresh answer."
+        mock_llm.assert_awaited_once()
+    
+    @patch('app.routers.rag.embedding_cache_stats', return_value={"hits": 0, "misses": 0})
+    def test_cache_stats_requires_a_user(self, mock_embedding_stats, semantic_cache):
+        """Test /cache/stats authenticates before reporting hit rates"""
+        import asyncio
+        from fastapi import HTTPException
+        anonymous_db = Mock()
+        anonymous_db.query.return_value.first.return_value = None
+        with pytest.raises(HTTPException) as error:
+            asyncio.run(get_cache_stats(Mock(), anonymous_db))
+        assert error.value.status_code == 401
+        
+        asyncio.run(semantic_cache.record("exact_hits"))
+        asyncio.run(semantic_cache.record("misses"))
+        mock_db = Mock()
+        mock_db.query.return_value.first.return_value = Mock(id=7)
+        stats = asyncio.run(get_cache_stats(Mock(), mock_db))
+        assert stats["answers"]["exact_hit_rate"] == 0.5
+        assert stats["query_embeddings"] == {"hits": 0, "misses": 0}
+        assert "hit_rate" in stats["retrieval"]
+
+class TestSingleFlight:
+    """Test coalescing of concurrent identical computations"""
+    
+    def test_concurrent_callers_share_one_computation(self):
+        """Test only the first caller computes and the rest receive its result"""
+        import asyncio
+        flight = SingleFlight()
+        calls = []
+        
+        async def compute():
+            calls.append(1)
+            await asyncio.sleep(0.01)
+            return "answer"
+        
+        async def run():
+            return await asyncio.gather(*(flight.do("key", compute, AsyncMock(return_value=None)) for _ in range(5)))
+        
+        results = asyncio.run(run())
+        assert len(calls) == 1
+        assert [result for result, _ in results] == ["answer"] * 5
+        assert sorted(shared for _, shared in results) == [False, True, True, True, True]
+        assert flight._inflight == {}
+    
+    def test_leader_failure_reaches_waiters_then_clears(self):
+        """Test waiters see the leader's error and the next caller computes afresh"""
+        import asyncio
+        flight = SingleFlight()
+        
+        async def fail():
+            await asyncio.sleep(0.01)
+            raise ValueError("LLM unavailable")
+        
+        async def run():
+            first = await asyncio.gather(
+                flight.do("key", fail, AsyncMock(return_value=None)),
+                flight.do("key", fail, AsyncMock(return_value=None)),
+                return_exceptions=True
+            )
+            second = await flight.do("key", AsyncMock(return_value="answer"), AsyncMock(return_value=None))
+            return first, second
+        
+        first, second = asyncio.run(run())
+        assert all(isinstance(error, ValueError) for error in first)
+        assert second == ("answer", False)
+    
+    def test_waits_for_other_worker_through_shared_cache(self):
+        """Test a worker that loses the Redis lock reuses the winner's cached result"""
+        import asyncio
+        mock_redis = Mock()
+        mock_redis.set = AsyncMock(return_value=None)
+        mock_redis.exists = AsyncMock(return_value=1)
+        flight = SingleFlight(mock_redis, wait_timeout=1, poll_interval=0.001)
+        compute = AsyncMock(return_value="own answer")
+        load_shared = AsyncMock(side_effect=[None, "their answer"])
+        
+        result = asyncio.run(flight.do("key", compute, load_shared))
+        
+        assert result == ("their answer", True)
+        compute.assert_not_called()
+        assert mock_redis.set.call_args.kwargs["nx"] is True
+    
+    def test_computes_when_other_worker_releases_without_result(self):
+        """Test a waiter computes itself once the lock holder gave up"""
+        import asyncio
+        mock_redis = Mock()
+        mock_redis.set = AsyncMock(return_value=None)
+        mock_redis.exists = AsyncMock(return_value=0)
+        flight = SingleFlight(mock_redis, wait_timeout=1, poll_interval=0.001)
+        
+        result = asyncio.run(flight.do("key", AsyncMock(return_value="own answer"), AsyncMock(return_value=None)))
+        
+        assert result == ("own answer", False)
+    
+    def test_lock_holder_releases_its_own_lock(self):
+        """Test the winner computes and releases the lock by token"""
+        import asyncio
+        mock_redis = Mock()
+        mock_redis.set = AsyncMock(return_value=True)
+        mock_redis.eval = AsyncMock(return_value=1)
+        flight = SingleFlight(mock_redis)
+        
+        result = asyncio.run(flight.do("key", AsyncMock(return_value="answer"), AsyncMock(return_value=None)))
+        
+        assert result == ("answer", False)
+        token = mock_redis.set.call_args[0][1]
+        assert mock_redis.eval.call_args[0][1:] == (1, "singleflight:key", token)
+    
+    @patch('app.routers.rag.embed_queries_async', new_callable=AsyncMock, return_value=[[1.0, 0.0]])
+    @patch('app.routers.rag.retrieve_topk_async', new_callable=AsyncMock)
+    @patch('app.routers.rag.chat_complete_async', new_callable=AsyncMock)
+    @patch('app.routers.rag.async_redis_client')
+    def test_concurrent_asks_call_llm_once(self, mock_redis, mock_llm, mock_retrieve, mock_embed, sample_answer_request):
+        """Test a burst of identical /ask requests pays for one completion"""
+        import asyncio
+        mock_redis.get = AsyncMock(return_value=None)
+        mock_redis.setex = AsyncMock()
+        mock_retrieve.return_value = [
+            RetrievalItem(doc_id=uuid.uuid4(), chunk_index=0, score=0.9, snippet="Offer and acceptance.")
+        ]
+        
+        async def slow_llm(prompt, model):
+            await asyncio.sleep(0.01)
+            return {
+                "text": "Offer, acceptance and consideration.",
+                "tokens_in": 100,
+                "tokens_out": 20,
+                "cost_usd": 0.01,
+                "latency_ms": 800.0,
+                "model": "gpt-4o-mini",
+                "provider": "openai"
+            }
+        mock_llm.side_effect = slow_llm
+        mock_db = Mock()
+        mock_db.query.return_value.first.return_value = Mock(id=7)
+        
+        async def run():
+            return await asyncio.gather(*(ask_legal_question(sample_answer_request, Mock(), mock_db) for _ in range(3)))
+        
+        responses = asyncio.run(run())
+        
+        assert mock_llm.await_count == 1
+        assert mock_retrieve.await_count == 1
+        assert [response.cached for response in responses] == [False, True, True]
+        # Only the request that paid for the answer logs it
+        mock_db.add.assert_called_once()
+
+class TestStreamingAsk:
+    """Test the Server-Sent Events /ask variant"""
+    
+    @staticmethod
+    def collect_events(response):
+        import asyncio
+        
+        async def drain():
+            return "".join([chunk async for chunk in response.body_iterator])
+        
+        events = []
+        for block in asyncio.run(drain()).strip().split("\n\n"):
+            event_line, data_line = block.split("\n")
+            events.append((event_line[len("event: "):], json.loads(data_line[len("data: "):])))
+        return events
+    
+    @patch('app.routers.rag.embed_queries_async', new_callable=AsyncMock, return_value=[[1.0, 0.0]])
+    @patch('app.routers.rag.log_query_metrics_detached')
+    @patch('app.routers.rag.retrieve_topk_async', new_callable=AsyncMock)
+    @patch('app.routers.rag.chat_stream_async')
+    @patch('app.routers.rag.async_redis_client')
+    def test_stream_emits_citations_tokens_then_usage(self, mock_redis, mock_stream, mock_retrieve, mock_log, mock_embed, sample_answer_request):
+        """Test event order and that the complete answer is cached and logged"""
+        import asyncio
+        mock_redis.get = AsyncMock(return_value=None)
+        mock_redis.setex = AsyncMock()
+        mock_retrieve.return_value = [
+            RetrievalItem(doc_id=uuid.uuid4(), chunk_index=3, score=0.9, snippet="Offer and acceptance.")
+        ]
+        
+        async def fake_stream(prompt, model):
+            yield {"type": "token", "text": "Offer, "}
+            yield {"type": "token", "text": "acceptance."}
+            yield {
+                "type": "done",
+                "text": "Offer, acceptance.",
+                "tokens_in": 100,
+                "tokens_out": 4,
+                "cost_usd": 0.01,
+                "latency_ms": 900.0,
+                "first_token_ms": 120.0,
+                "model": "gpt-4o-mini",
+                "provider": "openai"
+            }
+        mock_stream.side_effect = fake_stream
+        mock_db = Mock()
+        mock_db.query.return_value.first.return_value = Mock(id=7)
+        
+        response = asyncio.run(ask_legal_question_stream(sample_answer_request, Mock(), mock_db))
+        events = self.collect_events(response)
+        
+        assert response.media_type == "text/event-stream"
+        assert [name for name, _ in events] == ["citations", "token", "token", "done"]
+        assert events[0][1]["citations"][0]["chunk_index"] == 3
+        assert events[3][1]["tokens_in"] == 100 and events[3][1]["first_token_ms"] == 120.0
+        cached = json.loads(mock_redis.setex.call_args[0][2])
+        assert cached["answer"] == "Offer, acceptance."
+        mock_log.assert_called_once()
+    
+    @patch('app.routers.rag.embed_queries_async', new_callable=AsyncMock, return_value=[[1.0, 0.0]])
+    @patch('app.routers.rag.log_query_metrics_detached')
+    @patch('app.routers.rag.retrieve_topk_async', new_callable=AsyncMock)
+    @patch('app.routers.rag.chat_stream_async')
+    @patch('app.routers.rag.async_redis_client')
+    def test_stream_persists_before_client_hangs_up_on_done(self, mock_redis, mock_stream, mock_retrieve, mock_log, mock_embed, sample_answer_request):
+        """Test the answer is cached and logged even when the client disconnects right after done"""
+        import asyncio
+        mock_redis.get = AsyncMock(return_value=None)
+        mock_redis.setex = AsyncMock()
+        mock_retrieve.return_value = [
+            RetrievalItem(doc_id=uuid.uuid4(), chunk_index=0, score=0.9, snippet="Offer and acceptance.")
+        ]
+        
+        async def fake_stream(prompt, model):
+            yield {"type": "token", "text": "Offer."}
+            yield {
+                "type": "done",
+                "text": "Offer.",
+                "tokens_in": 10,
+                "tokens_out": 2,
+                "cost_usd": 0.001,
+                "latency_ms": 50.0,
+                "first_token_ms": 10.0,
+                "model": "gpt-4o-mini",
+                "provider": "openai"
+            }
+        mock_stream.side_effect = fake_stream
+        mock_db = Mock()
+        mock_db.query.return_value.first.return_value = Mock(id=7)
+        
+        async def read_until_done():
+            response = await ask_legal_question_stream(sample_answer_request, Mock(), mock_db)
+            iterator = response.body_iterator
+            async for chunk in iterator:
+                if chunk.startswith("event: done"):
+                    break
+            # What the server does when the client goes away
+            await iterator.aclose()
+        
+        asyncio.run(read_until_done())
+        
+        mock_redis.setex.assert_awaited_once()
+        mock_log.assert_called_once()
+    
+    @patch('app.routers.rag.embed_queries_async', new_callable=AsyncMock, return_value=[[1.0, 0.0]])
+    @patch('app.routers.rag.retrieve_topk_async', new_callable=AsyncMock)
+    @patch('app.routers.rag.chat_stream_async')
+    @patch('app.routers.rag.async_redis_client')
+    def test_stream_reports_llm_failure_as_event(self, mock_redis, mock_stream, mock_retrieve, mock_embed, sample_answer_request):
+        """Test a mid-stream failure ends the stream with an error event and nothing is cached"""
+        import asyncio
+        from fastapi import HTTPException
+        mock_redis.get = AsyncMock(return_value=None)
+        mock_redis.setex = AsyncMock()
+        mock_retrieve.return_value = [
+            RetrievalItem(doc_id=uuid.uuid4(), chunk_index=0, score=0.9, snippet="Offer and acceptance.")
+        ]
+        
+        async def failing_stream(prompt, model):
+            yield {"type": "token", "text": "Offer"}
+            raise HTTPException(status_code=503, detail="LLM service error: timeout")
+        mock_stream.side_effect = failing_stream
+        mock_db = Mock()
+        mock_db.query.return_value.first.return_value = Mock(id=7)
+        
+        events = self.collect_events(asyncio.run(ask_legal_question_stream(sample_answer_request, Mock(), mock_db)))
+        
+        assert [name for name, _ in events] == ["citations", "token", "error"]
+        mock_redis.setex.assert_not_called()
+    
+    @patch('app.utils.llm.get_async_client')
+    def test_stream_estimates_usage_without_usage_chunk(self, mock_client):
+        """Test token counts fall back to an estimate when the API sends no usage"""
+        import asyncio
+        
+        async def chunks():
+            for text in ["Consideration ", "is required."]:
+                yield Mock(choices=[Mock(delta=Mock(content=text))], usage=None)
+        mock_client.return_value.chat.completions.create = AsyncMock(return_value=chunks())
+        
+        async def run():
+            return [event async for event in chat_stream_async("x" * 40)]
+        
+        with patch.dict('os.environ', {'OPENAI_API_KEY': 'test_key'}):
+            events = asyncio.run(run())
+        
+        assert [e["text"] for e in events[:-1]] == ["Consideration ", "is required."]
+        assert events[-1]["type"] == "done"
+        assert events[-1]["text"] == "Consideration is required."
+        assert events[-1]["tokens_in"] == 10 and events[-1]["tokens_out"] == 7
+
+class TestBatchAsk:
+    """Test the batch RAG endpoint"""
+    
+    @patch('app.routers.rag.retrieve_topk_batch')
+    @patch('app.routers.rag.chat_complete_async', new_callable=AsyncMock)
+    @patch('app.routers.rag.async_redis_client')
+    def test_batch_reports_errors_per_query(self, mock_redis, mock_llm, mock_retrieve):
+        """Test one failing question does not fail the whole batch"""
+        import asyncio
+        mock_redis.get = AsyncMock(return_value=None)
+        mock_redis.setex = AsyncMock()
+        doc_id = uuid.uuid4()
+        mock_retrieve.return_value = [
+            [RetrievalItem(doc_id=doc_id, chunk_index=0, score=0.9, snippet="Offer and acceptance.")],
+            []
+        ]
+        mock_llm.return_value = {
+            "text": "Offer, acceptance and consideration.",
+            "tokens_in": 100,
+            "tokens_out": 20,
+            "cost_usd": 0.01,
+            "latency_ms": 800.0,
+            "model": "gpt-4o-mini",
+            "provider": "openai"
+        }
+        mock_db = Mock()
+        mock_db.query.return_value.first.return_value = Mock(id=7)
+        
+        request = BatchAnswerRequest(queries=["elements of a contract", "unknown topic", "  "])
+        response = asyncio.run(ask_legal_questions_batch(request, Mock(), mock_db))
+        
+        # Both valid questions share one retrieval call
+        mock_retrieve.assert_called_once()
+        assert mock_retrieve.call_args[0][0] == ["elements of a contract", "unknown topic"]
+        
+        first, second, third = response.results
+        assert first.response.answer == "Offer, acceptance and consideration."
+        assert first.error is None
+        assert second.response is None
+        assert second.error == "No relevant documents found"
+        assert third.error is not None
+        assert mock_llm.call_count == 1
+
 class TestCaching:
     """Test Redis caching functionality"""
     
@@ -181,6 +1498,13 @@ class TestCaching:
         
         assert key1 != key2
     
+    def test_cache_key_includes_filters(self):
+        """Test a filtered question never shares a cached answer with the unfiltered one"""
+        from app.models.search import SearchFilters
+        unfiltered = generate_cache_key(123, "What is contract law?", 5, "gpt-4o-mini")
+        assert generate_cache_key(123, "What is contract law?", 5, "gpt-4o-mini", SearchFilters()) == unfiltered
+        assert generate_cache_key(123, "What is contract law?", 5, "gpt-4o-mini", SearchFilters(owner_id=3)) != unfiltered
+    
     def test_cache_key_same_parameters(self):
         """Test that same parameters generate same cache key"""
         user_id = 123
@@ -0,0 +1,143 @@
+import pytest
+import asyncio
+import uuid
+from unittest.mock import Mock, patch, AsyncMock
+
+from pydantic import ValidationError
+
+from app.models.search import SearchQuery, BatchSearchQuery, SearchFilters
+from app.routers.search import search_legal_precedents, search_legal_precedents_batch, fetch_precedent_results
+from app.utils.metadata_filter import filter_document_ids, filters_key
+
+class TestPrecedentSearch:
+    """Test precedent search endpoint"""
+    
+    def test_fetch_precedent_results_single_query(self):
+        """Test winners are loaded with one joined query and keep rank order"""
+        first, second, missing = uuid.uuid4(), uuid.uuid4(), uuid.uuid4()
+        doc_id = uuid.uuid4()
+        mock_db = Mock()
+        mock_db.query.return_value.outerjoin.return_value.filter.return_value.all.return_value = [
+            Mock(id=second, doc_id=doc_id, content="Short holding.", filename=None, court=None, decision_year=None),
+            Mock(id=first, doc_id=doc_id, content="x" * 300, filename="smith_v_jones.pdf", court="9th Cir.", decision_year=2019)
+        ]
+        
+        results = fetch_precedent_results([(first, 0.9), (missing, 0.85), (second, 0.8)], mock_db)
+        
+        assert mock_db.query.call_count == 1
+        assert [r.id for r in results] == [str(first), str(second)]
+        assert results[0].title == "smith_v_jones.pdf"
+        assert (results[0].court, results[0].year) == ("9th Cir.", 2019)
+        assert results[0].summary == "x" * 200 + "..."
+        assert results[1].title == f"Document {doc_id}"
+        assert results[1].relevance_score == 0.8
+    
+    def test_fetch_precedent_results_no_hits(self):
+        """Test no database access when nothing matched"""
+        mock_db = Mock()
+        assert fetch_precedent_results([], mock_db) == []
+        mock_db.query.assert_not_called()
+    
+    @patch('app.utils.retrieval.get_vector_index')
+    @patch('app.routers.search.generate_embedding_async', new_callable=AsyncMock)
+    def test_search_uses_index_top_k(self, mock_embed, mock_get_index):
+        """Test the endpoint asks the index for the top results only"""
+        mock_embed.return_value = [0.1, 0.2]
+        mock_get_index.return_value.search.return_value = []
+        
+        response = asyncio.run(search_legal_precedents(SearchQuery(query="breach"), Mock(), Mock()))
+        
+        mock_get_index.return_value.search.assert_called_once_with([0.1, 0.2], 10)
+        assert response.total_count == 0
+
+    @patch('app.utils.retrieval.get_vector_index')
+    @patch('app.routers.search.embed_queries_async', new_callable=AsyncMock)
+    def test_batch_search_embeds_once(self, mock_embed, mock_get_index):
+        """Test a batch embeds all queries in one call and searches them together"""
+        chunk_id, doc_id = uuid.uuid4(), uuid.uuid4()
+        mock_embed.return_value = [[0.1, 0.2], [0.3, 0.4]]
+        mock_get_index.return_value.search_batch.return_value = [[(chunk_id, 0.7)], []]
+        mock_db = Mock()
+        mock_db.query.return_value.outerjoin.return_value.filter.return_value.all.return_value = [
+            Mock(id=chunk_id, doc_id=doc_id, content="Holding.", filename="a.pdf", court=None, decision_year=None)
+        ]
+        
+        batch = BatchSearchQuery(queries=["negligence", "", "estoppel"])
+        response = asyncio.run(search_legal_precedents_batch(batch, Mock(), mock_db))
+        
+        mock_embed.assert_awaited_once_with(["negligence", "estoppel"])
+        mock_get_index.return_value.search_batch.assert_called_once_with([[0.1, 0.2], [0.3, 0.4]], 10)
+        first, blank, last = response.results
+        assert first.total_count == 1 and first.results[0].title == "a.pdf"
+        assert blank.error is not None
+        assert last.total_count == 0 and last.error is None
+
+class TestSearchFilters:
+    """Test metadata filters are resolved before scoring"""
+    
+    def test_filters_are_validated_and_canonical(self):
+        """Test unknown filter keys are rejected and key order does not matter"""
+        with pytest.raises(ValidationError):
+            SearchQuery(query="breach", filters={"judge": "Hand"})
+        a, b = uuid.uuid4(), uuid.uuid4()
+        assert filters_key(SearchFilters(doc_ids=[a, b], court="SCOTUS")) == filters_key(SearchFilters(court="SCOTUS", doc_ids=[b, a]))
+        assert filters_key(SearchFilters()) == ""
+        assert filters_key(None) == ""
+    
+    def test_no_filters_skip_the_database(self):
+        """Test an unrestricted search does not query documents"""
+        mock_db = Mock()
+        assert filter_document_ids(mock_db, SearchFilters()) is None
+        mock_db.query.assert_not_called()
+    
+    def test_filters_resolve_to_document_ids(self):
+        """Test every given filter becomes one condition of a single query"""
+        doc_id = uuid.uuid4()
+        mock_db = Mock()
+        mock_db.query.return_value.filter.return_value.all.return_value = [Mock(id=doc_id)]
+        
+        doc_ids = filter_document_ids(mock_db, SearchFilters(owner_id=3, court="SCOTUS", year_from=2000, year_to=2010))
+        
+        assert doc_ids == [doc_id]
+        assert len(mock_db.query.return_value.filter.call_args[0]) == 4
+    
+    @patch('app.routers.search.filter_document_ids')
+    @patch('app.utils.retrieval.get_vector_index')
+    @patch('app.routers.search.generate_embedding_async', new_callable=AsyncMock)
+    def test_filtered_search_scores_only_matching_documents(self, mock_embed, mock_get_index, mock_filter):
+        """Test the endpoint pushes the resolved documents down to the index"""
+        doc_id = uuid.uuid4()
+        mock_embed.return_value = [0.1, 0.2]
+        mock_filter.return_value = [doc_id]
+        mock_get_index.return_value.search_documents.return_value = [[]]
+        
+        query = SearchQuery(query="breach", filters={"court": "Ninth Circuit"})
+        response = asyncio.run(search_legal_precedents(query, Mock(), Mock()))
+        
+        mock_get_index.return_value.search_documents.assert_called_once_with([[0.1, 0.2]], [doc_id], 10)
+        mock_get_index.return_value.search.assert_not_called()
+        assert mock_filter.call_args[0][1].court == "Ninth Circuit"
+        assert response.total_count == 0
+    
+    @patch('app.routers.search.filter_document_ids')
+    @patch('app.utils.retrieval.tenant_indexes')
+    @patch('app.utils.retrieval.get_vector_index')
+    @patch('app.routers.search.generate_embedding_async', new_callable=AsyncMock)
+    def test_owner_search_uses_tenant_index(self, mock_embed, mock_get_index, mock_tenants, mock_filter):
+        """Test searches scoped to one owner go to that owner's index, not the shared one"""
+        doc_id = uuid.uuid4()
+        mock_db = Mock()
+        mock_embed.return_value = [0.1, 0.2]
+        mock_filter.return_value = [doc_id]
+        tenant_index = mock_tenants.get.return_value
+        tenant_index.search_documents.return_value = [[]]
+        
+        query = SearchQuery(query="breach", filters={"owner_id": 3})
+        asyncio.run(search_legal_precedents(query, Mock(), mock_db))
+        
+        mock_tenants.get.assert_called_once_with(mock_db, 3)
+        tenant_index.search_documents.assert_called_once_with([[0.1, 0.2]], [doc_id], 10)
+        mock_get_index.assert_not_called()
+
+if __name__ == "__main__":
+    pytest.main([__file__, "-v"])